@@ -20,6 +20,9 @@ La requête :
 - Obtient le SRID du bloc après avoir fait le lien avec le BLOC via la DALLE.
 - Filtre les dalles à exclures après avoir fait le lien avec les JEU_DE_DALLES via la DALLE.
 
+Lecture parallèle (num_parallel_reads > 1) : le marqueur RANGE_FILTER est remplacé par un filtre sur un intervalle de
+STAT_VIGNETTE_LIDAR.VIGNETTE_ID, appliqué avant les jointures. Sans lecture parallèle, il vaut TRUE.
+
 */ 
 
 WITH FICHIER_LIDAR_REFERENCE AS
@@ -48,7 +51,8 @@ WITH FICHIER_LIDAR_REFERENCE AS
           ALTITUDE
    FROM STAT_VIGNETTE_LIDAR
    JOIN FICHIER_LIDAR_REFERENCE ON STAT_VIGNETTE_LIDAR.FICHIER_LIDAR_ID = FICHIER_LIDAR_REFERENCE.ID
-   WHERE NB_TOTAL > 0),
+   WHERE NB_TOTAL > 0
+     AND /* RANGE_FILTER */ TRUE),
         VIGNETTE_COLS AS
   (SELECT VIGNETTE.ID,
           VIGNETTE.DALLE_ID,
@@ -2,6 +2,8 @@ from pathlib import Path
 import pandas as pd
 from pandas import DataFrame
 
+from pacasam.connectors.bbox import get_areas
+
 SURFACE_OF_A_KM2 = 1000 * 1000
 
 
@@ -26,7 +28,7 @@ class Comparer:
 
         # Prepare to compare areas and couts of patches.
         for df in [df_database, df_sampling]:
-            df["area_km2"] = df.area / SURFACE_OF_A_KM2
+            df["area_km2"] = get_areas(df) / SURFACE_OF_A_KM2
             df["num_patches"] = 1
         comparison_df = self.compare_sizes(df_database, df_sampling)
         output_csv = self.output_path / "comparison-areas.csv"
@@ -62,7 +64,7 @@ class Comparer:
 
         """
         # Generate list of boolean descriptor names present in the base dataframe
-        boolean_descriptors_names = df_database.select_dtypes(include=bool).columns
+        boolean_descriptors_names = df_database.select_dtypes(include=[bool, "boolean"]).columns
 
         # Calculate prevalence (proportion) of each boolean descriptor for each dataframe
         prevalence_base = DataFrame(
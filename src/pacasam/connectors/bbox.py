@@ -0,0 +1,63 @@
+"""Bounding-box representation of patches.
+
+Patches are rectangles aligned with the x/y axes: four float64 arrays (xmin, ymin, xmax, ymax) describe them fully.
+Compared to shapely geometries, this removes one Python object per patch, and areas and bounds are read from arrays
+instead of calling GEOS. Geometries are only materialized for the patches that are saved.
+
+"""
+
+from typing import Optional, Tuple
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import geopandas as gpd
+from geopandas import GeoDataFrame
+import shapely
+
+BBOX_COLNAMES = ["xmin", "ymin", "xmax", "ymax"]
+
+
+def has_bboxes(df: DataFrame) -> bool:
+    return all(col in df.columns for col in BBOX_COLNAMES)
+
+
+def add_bbox_columns(gdf: GeoDataFrame) -> GeoDataFrame:
+    """Adds the bounds of the geometries as columns (geometries are kept)."""
+    if not has_bboxes(gdf):
+        gdf[BBOX_COLNAMES] = get_bounds(gdf)
+    return gdf
+
+
+def geometry_to_bbox(gdf: GeoDataFrame) -> DataFrame:
+    """Replaces the shapely geometries by their bounds."""
+    df = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    df[BBOX_COLNAMES] = get_bounds(gdf)
+    return df
+
+
+def bbox_to_geometry(df: DataFrame, crs: Optional[str] = None) -> GeoDataFrame:
+    """Materializes shapely geometries from the bounds. Inverse of geometry_to_bbox. No-op without bounds, or with geometries."""
+    if not has_bboxes(df) or isinstance(df, GeoDataFrame):
+        return df
+    geometries = shapely.box(*get_bounds(df).T)
+    return gpd.GeoDataFrame(df.drop(columns=BBOX_COLNAMES), geometry=geometries, crs=crs)
+
+
+def get_bounds(df: DataFrame) -> np.ndarray:
+    """Bounds of patches as a [N, 4] array, read from the bounds columns if present, else from the geometries."""
+    if has_bboxes(df):
+        return df[BBOX_COLNAMES].to_numpy(dtype=np.float64)
+    return df.geometry.bounds.to_numpy()
+
+
+def get_areas(df: DataFrame) -> np.ndarray:
+    """Areas of patches, read from the bounds columns if present, else from the geometries."""
+    if has_bboxes(df):
+        xmin, ymin, xmax, ymax = get_bounds(df).T
+        return (xmax - xmin) * (ymax - ymin)
+    return df.area.to_numpy()
+
+
+def get_patch_bounds(patch_info) -> Tuple[float, float, float, float]:
+    """Bounds of a single patch (row from itertuples or iterrows), read from its bounds columns."""
+    return tuple(getattr(patch_info, col) for col in BBOX_COLNAMES)
@@ -0,0 +1,97 @@
+"""Compact in-memory representation of a patch database, to sample large databases on nodes with limited memory.
+
+- Counts (`nb_*` columns) are downcast to the smallest unsigned integer type that holds them.
+- Boolean descriptors with missing values (object columns of True/False/None) become nullable booleans.
+- Columns with many repeated strings (file ids, paths) become categoricals.
+
+Databases read by chunks are compacted chunk by chunk, as they arrive (see `concat_compact_chunks`), so that the full
+database is never held in its expanded representation.
+
+GIS formats do not support categoricals and nullable integers: use `expand_compact_dtypes` before saving.
+
+"""
+
+import logging
+from typing import Iterable, List
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pandas.api.types import union_categoricals
+
+COUNT_COLNAME_PREFIX = "nb_"
+BYTES_IN_A_MB = 1024**2
+
+
+def compact_database(db: DataFrame, categorical_columns: Iterable[str]) -> DataFrame:
+    """Downcasts counts and boolean descriptors, and dictionary-encodes the categorical columns that are present."""
+    for col in db.columns:
+        if col.startswith(COUNT_COLNAME_PREFIX):
+            db[col] = downcast_count(db[col])
+        elif db[col].dtype == object and is_nullable_bool(db[col]):
+            db[col] = db[col].astype("boolean")
+    for col in categorical_columns:
+        if col in db.columns:
+            db[col] = db[col].astype("category")
+    return db
+
+
+def concat_compact_chunks(compact_chunks: List[DataFrame], categorical_columns: Iterable[str]) -> DataFrame:
+    """Concatenates chunks compacted by compact_database, into a compact database.
+
+    Categorical columns are given the union of the categories of all chunks, so that they stay categoricals once concatenated.
+    Categories are sorted, like those of a database compacted whole: categoricals then sort lexically, as the original values.
+    Counts and boolean descriptors that were compacted differently across chunks (e.g. a chunk with missing values) are
+    compacted again, once concatenated.
+
+    """
+    for col in categorical_columns:
+        if compact_chunks and col in compact_chunks[0].columns:
+            categories = union_categoricals([chunk[col] for chunk in compact_chunks], sort_categories=True, ignore_order=True).categories
+            for chunk in compact_chunks:
+                chunk[col] = chunk[col].cat.set_categories(categories)
+    return compact_database(pd.concat(compact_chunks), categorical_columns=[])
+
+
+def downcast_count(counts: pd.Series) -> pd.Series:
+    """Smallest unsigned integer type for non-negative integer counts (nullable if there are missing values)."""
+    if not pd.api.types.is_numeric_dtype(counts) or pd.api.types.is_bool_dtype(counts):
+        return counts
+    values = counts.dropna()
+    if len(values) == 0 or (values < 0).any() or (values % 1 != 0).any():
+        return counts
+    dtype = np.min_scalar_type(int(values.max()))
+    if counts.isna().any():
+        return counts.astype(f"UInt{dtype.itemsize * 8}")  # pandas' nullable unsigned integers
+    return counts.astype(dtype)
+
+
+def is_nullable_bool(values: pd.Series) -> bool:
+    """True if all non-missing values are booleans (and there is at least one)."""
+    values = values.dropna()
+    if len(values) == 0 or not isinstance(values.iloc[0], (bool, np.bool_)):
+        return False  # cheap check first, since most object columns are strings (ids, paths)
+    return values.map(type).isin([bool, np.bool_]).all()
+
+
+def expand_compact_dtypes(gdf: DataFrame) -> DataFrame:
+    """Inverse of compact_database, for formats that do not support categoricals and nullable integers (e.g. geopackage).
+
+    Categoricals are expanded to their values, and nullable integers to floats (missing values as NaN).
+    Nullable booleans are kept, since they are saved as booleans.
+
+    """
+    gdf = gdf.copy()
+    for col in gdf.columns:
+        if isinstance(gdf[col].dtype, pd.CategoricalDtype):
+            gdf[col] = gdf[col].astype(gdf[col].cat.categories.dtype)
+        elif pd.api.types.is_extension_array_dtype(gdf[col]) and pd.api.types.is_integer_dtype(gdf[col]):
+            gdf[col] = gdf[col].astype(float) if gdf[col].isna().any() else gdf[col].astype(gdf[col].dtype.numpy_dtype)
+    return gdf
+
+
+def log_memory_usage(db: DataFrame, log: logging.Logger, name: str) -> None:
+    """Logs the memory usage of the database, in total and for its five largest columns."""
+    usage_by_column = db.memory_usage(deep=True, index=True) / BYTES_IN_A_MB
+    largest_columns = usage_by_column.sort_values(ascending=False).head(5)
+    largest_columns = ", ".join(f"{col}: {mb:.1f}MB" for col, mb in largest_columns.items())
+    log.info(f"{name}: database of N={len(db)} patches uses {usage_by_column.sum():.1f}MB in memory ({largest_columns}).")
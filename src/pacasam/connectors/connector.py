@@ -1,7 +1,12 @@
+from contextlib import contextmanager
 import logging
-from typing import Iterable, Optional
+from typing import Iterable, List, Optional
+import numpy as np
+import pandas as pd
 from geopandas import GeoDataFrame
 
+from pacasam.connectors.bbox import bbox_to_geometry
+
 # Those are the necessary columns that are needed in the database to perform a sampling.
 
 GEOMETRY_COLNAME = "geometry"  # Shapely geometry (note: only rectangular shapes aligend with x/y are supported)
@@ -16,36 +21,112 @@ SRID_COLNAME = "srid"
 PATCH_INFO = [PATCH_ID_COLNAME, FILE_ID_COLNAME]
 
 
+class SelectionState:
+    """Patches selected so far, as a boolean mask aligned with the positions of patches in the database.
+
+    Selecting k patches or excluding them from a request only needs k lookups in the id->position index,
+    instead of a hash join over the whole database.
+
+    """
+
+    def __init__(self, patch_ids: np.ndarray):
+        self.id_to_position = pd.Index(patch_ids)
+        self.is_selected = np.zeros(len(patch_ids), dtype=bool)
+
+    @property
+    def num_selected(self) -> int:
+        return int(self.is_selected.sum())
+
+    def positions(self, ids: Iterable) -> np.ndarray:
+        """Positions of patches in the database, from their ids. Ids that are not in the database (e.g. of another split) are ignored."""
+        positions = self.id_to_position.get_indexer(np.asarray(ids))
+        return positions[positions >= 0]
+
+    def select(self, ids: Iterable) -> np.ndarray:
+        """Marks patches as selected. Returns a mask that is False for patches that were already selected (or repeated in ids).
+
+        Raises a KeyError if some ids are not in the database: only patches of the database can be selected.
+
+        """
+        positions = self.id_to_position.get_indexer(np.asarray(ids))
+        if (positions < 0).any():
+            raise KeyError("Some patch ids are not in the database.")
+        is_first_occurrence = np.zeros(len(positions), dtype=bool)
+        is_first_occurrence[np.unique(positions, return_index=True)[1]] = True
+        is_new = is_first_occurrence & ~self.is_selected[positions]
+        self.is_selected[positions[is_new]] = True
+        return is_new
+
+    def reset(self) -> None:
+        self.is_selected[:] = False
+
+
 class Connector:
     """Connector to a patch database. Uses GeoDataFrames under the hood."""
 
     db: GeoDataFrame
     log: logging.Logger
+    crs = None  # Set when geometries are replaced by their bounds (see pacasam.connectors.bbox).
 
     def __init__(self, log: logging.Logger):
         self.log = log
         self.name: str = self.__class__.__name__  # for convenience
+        self._selection: Optional[SelectionState] = None
+        self._selection_depth = 0
 
     @property
     def db_size(self):
         return len(self.db)
 
+    @property
+    def selection(self) -> SelectionState:
+        """State of the current selection, shared by the samplers. Built lazily since db may be loaded lazily."""
+        if self._selection is None or len(self._selection.is_selected) != self.db_size:
+            self._selection = SelectionState(self.request_all_patches()[PATCH_ID_COLNAME].values)
+        return self._selection
+
+    @contextmanager
+    def selection_session(self):
+        """Scope of a selection shared by nested samplers (e.g. TargettedSampler within TripleSampler).
+
+        The selection starts empty when entering the outermost session, and is emptied when leaving it.
+
+        """
+        if self._selection_depth == 0:
+            self.selection.reset()
+        self._selection_depth += 1
+        try:
+            yield self.selection
+        finally:
+            self._selection_depth -= 1
+            if self._selection_depth == 0:
+                self.selection.reset()
+
     def request_patches_by_boolean_indicator(self, bool_descriptor_name) -> GeoDataFrame:
-        if self.db[bool_descriptor_name].dtype != "bool":
+        if self.db[bool_descriptor_name].dtype not in ["bool", "boolean"]:
             raise KeyError(
                 f"Descriptor `{bool_descriptor_name}` is not a boolean." "Only boolean descriptor are supported for targetting patches."
             )
         return self.db.query(bool_descriptor_name)[PATCH_INFO]
 
-    def request_all_other_patches(self, exclude_ids: Iterable) -> GeoDataFrame:
-        """Requests all other patches."""
-        return self.db[~self.db[PATCH_ID_COLNAME].isin(exclude_ids)][PATCH_INFO]
+    def request_all_other_patches(self, exclude_ids: Optional[Iterable] = None) -> GeoDataFrame:
+        """Requests all other patches. By default, excludes the patches of the current selection."""
+        if exclude_ids is None:
+            is_excluded = self.selection.is_selected
+        else:
+            is_excluded = np.zeros(self.db_size, dtype=bool)
+            is_excluded[self.selection.positions(exclude_ids)] = True
+        return self.request_all_patches()[~is_excluded]
 
     def request_all_patches(self) -> GeoDataFrame:
         """Request all patches i.e. without excluding any patch."""
         return self.db[PATCH_INFO]
 
+    def request_patches_with_columns(self, columns: List[str]) -> GeoDataFrame:
+        """Request all patches, with only the specified descriptors (e.g. those used to measure diversity)."""
+        return self.db[PATCH_INFO + [c for c in columns if c not in PATCH_INFO]]
+
     def extract(self, selection: Optional[GeoDataFrame]) -> GeoDataFrame:
-        """Extract everything using ids."""
+        """Extract everything using ids. Geometries are materialized if the database only holds their bounds."""
         extract = self.db.merge(selection, how="inner", on=PATCH_ID_COLNAME)
-        return extract
+        return bbox_to_geometry(extract, crs=self.crs)
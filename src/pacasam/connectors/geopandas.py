@@ -2,23 +2,38 @@ import logging
 from pathlib import Path
 import geopandas as gpd
 
-from pacasam.connectors.connector import Connector
+from pacasam.connectors.bbox import geometry_to_bbox
+from pacasam.connectors.compact import compact_database, log_memory_usage
+from pacasam.connectors.connector import FILE_ID_COLNAME, Connector
+from pacasam.extractors.bd_ortho_vintage import IRC_COLNAME, RGB_COLNAME
+from pacasam.extractors.laz import FILE_PATH_COLNAME
 from pacasam.samplers.sampler import SAMPLER_COLNAME, SPLIT_COLNAME, SPLIT_POSSIBLE_VALUES
 
 
 class GeopandasConnector(Connector):
-    def __init__(self, log: logging.Logger, gpd_database_path: Path, split: SPLIT_POSSIBLE_VALUES):
+    def __init__(
+        self,
+        log: logging.Logger,
+        gpd_database_path: Path,
+        split: SPLIT_POSSIBLE_VALUES,
+        compact: bool = False,
+        geometry_as_bbox: bool = False,
+    ):
         """Connector to interface with any geopandas-compatible file.
 
         Args:
             log (logging.Logger): shared logger
             gpd_database_path (Path): path to file to connect to (e.g. geopackage file).
             split (str): Unused. For compatibility with other samplers only.
+            compact (bool, optional): compact in-memory representation of the database, see pacasam.connectors.compact.
+            geometry_as_bbox (bool, optional): hold patches as their bounds instead of shapely geometries, see pacasam.connectors.bbox.
 
         """
 
         super().__init__(log=log)
         self.gpd_database_path = Path(gpd_database_path).resolve()
+        self.compact = compact
+        self.geometry_as_bbox = geometry_as_bbox
         self._db = None
 
     @property
@@ -28,4 +43,10 @@ class GeopandasConnector(Connector):
             # Those two columns are present if we read from a sampling (in particular: from the output of CopySampler).
             # We need to drop them to avoid conflicts when sampling again.
             self._db = self._db.drop(columns=[SPLIT_COLNAME, SAMPLER_COLNAME], errors="ignore")
+            if self.compact:
+                self._db = compact_database(self._db, categorical_columns=[FILE_ID_COLNAME, FILE_PATH_COLNAME, RGB_COLNAME, IRC_COLNAME])
+            if self.geometry_as_bbox:
+                self.crs = self._db.crs
+                self._db = geometry_to_bbox(self._db)
+            log_memory_usage(self._db, self.log, self.name)
         return self._db
@@ -1,7 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
-from pathlib import PureWindowsPath
-from typing import Generator
+from pathlib import Path, PureWindowsPath
+from typing import Callable, Dict, Generator, List, Optional, Tuple, Union
 
 import pandas as pd
 import geopandas as gpd
@@ -10,18 +11,28 @@ from geopandas import GeoDataFrame
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.engine import URL
-from pacasam.connectors.connector import GEOMETRY_COLNAME, Connector
+from pacasam.connectors.bbox import geometry_to_bbox
+from pacasam.connectors.compact import compact_database, concat_compact_chunks, log_memory_usage
+from pacasam.connectors.connector import FILE_ID_COLNAME, GEOMETRY_COLNAME, PATCH_INFO, Connector
+from pacasam.connectors.snapshot import SNAPSHOT_SUFFIX, load_or_make_snapshot, make_snapshot_key
 from pacasam.extractors.bd_ortho_vintage import IRC_COLNAME, RGB_COLNAME
 from pacasam.extractors.laz import FILE_PATH_COLNAME
 from pacasam.samplers.sampler import PATCH_ID_COLNAME, SPLIT_POSSIBLE_VALUES
 
 TEST_COLNAME_IN_LIPAC = "test"
+# Columns with many repeated values, dictionary-encoded in compact mode.
+LIPAC_CATEGORICAL_COLUMNS = [FILE_ID_COLNAME, FILE_PATH_COLNAME, RGB_COLNAME, IRC_COLNAME]
+# Parallel reads: where the query can be filtered on a range of a column of one of its base tables (TRUE when read whole).
+RANGE_FILTER_MARKER = "/* RANGE_FILTER */ TRUE"
+DEFAULT_PARTITION_COLUMN = "VIGNETTE_ID"
+DEFAULT_PARTITION_TABLE = "STAT_VIGNETTE_LIDAR"
 
 
 class LiPaCConnector(Connector):
     """Connector to interface with the Lidar-Patch-Catalogue database and perform queries."""
 
     mounted_store_path = "/mnt"
+    load_database_at_init = True
 
     def __init__(
         self,
@@ -33,6 +44,15 @@ class LiPaCConnector(Connector):
         extraction_sql_query_path: str,
         split: SPLIT_POSSIBLE_VALUES,
         max_chunksize_for_postgis_extraction: int = 100000,
+        num_parallel_reads: int = 1,
+        partition_column_for_parallel_reads: str = DEFAULT_PARTITION_COLUMN,
+        partition_table_for_parallel_reads: str = DEFAULT_PARTITION_TABLE,
+        snapshot_cache_dir: Optional[str] = None,
+        snapshot_ttl_hours: Optional[float] = None,
+        db_lipac_port: Optional[int] = None,
+        refresh_cache: bool = False,
+        compact: bool = False,
+        geometry_as_bbox: bool = False,
     ):
         """Initialization.
 
@@ -45,32 +65,105 @@ class LiPaCConnector(Connector):
             extraction_sql_query_path (str): path to a .SQL file
             split (str): desired split, among `train`,`test`, or `any`. Will filter based on the `test` variable in Lipac.
             max_chunksize_for_postgis_extraction (int, optional): For chunk-reading the (large) database. Defaults to 100000.
+            num_parallel_reads (int, optional): number of ranges of the query result that are read concurrently,
+            each over its own connection. Defaults to 1 i.e. a single read.
+            partition_column_for_parallel_reads (str, optional): column used to define the ranges, in a base table of the
+            query. The query must hold the RANGE_FILTER_MARKER where a filter on this column applies. Defaults to VIGNETTE_ID.
+            partition_table_for_parallel_reads (str, optional): base table of partition_column_for_parallel_reads.
+            Defaults to STAT_VIGNETTE_LIDAR.
+            snapshot_cache_dir (str, optional): directory of local snapshots of the database, to avoid requesting LiPaC
+            at each sampling. Snapshots are identified by the SQL query, the database URL (host, port, user), and the split.
+            Defaults to None i.e. no snapshot.
+            snapshot_ttl_hours (float, optional): snapshots older than this are requested again. Defaults to None (no expiry).
+            db_lipac_port (int, optional): port of the database on its host machine. Defaults to None i.e. the PostgreSQL default.
+            refresh_cache (bool, optional): request LiPaC and overwrite the snapshot even if it is still valid. Defaults to False.
+            compact (bool, optional): compact in-memory representation of the database (downcast counts, nullable booleans,
+            categorical ids and paths), see pacasam.connectors.compact. Defaults to False.
+            geometry_as_bbox (bool, optional): hold patches as their bounds (xmin, ymin, xmax, ymax) instead of shapely
+            geometries, which are materialized at extraction. See pacasam.connectors.bbox. Defaults to False.
 
         """
         super().__init__(log=log)
         self.username = username
         self.host = db_lipac_host
         self.db_name = db_lipac_name
-        self.create_session(password)
+        self.port = db_lipac_port
+        self.create_session(password, pool_size=num_parallel_reads)
         with open(extraction_sql_query_path, "r") as file:
-            extraction_sql_query = file.read()
-        self.db = self.download_database(extraction_sql_query, max_chunksize_for_postgis_extraction)
-        self.db = filter_lipac_patches_on_split(db=self.db, test_colname=TEST_COLNAME_IN_LIPAC, desired_split=split)
+            self.extraction_sql_query = file.read()
+        self.split = split
+        self.max_chunksize_for_postgis_extraction = max_chunksize_for_postgis_extraction
+        self.num_parallel_reads = num_parallel_reads
+        self.partition_column_for_parallel_reads = partition_column_for_parallel_reads
+        self.partition_table_for_parallel_reads = partition_table_for_parallel_reads
+        self.snapshot_cache_dir = snapshot_cache_dir
+        self.snapshot_ttl_hours = snapshot_ttl_hours
+        self.refresh_cache = refresh_cache
+        self.compact = compact
+        self.geometry_as_bbox = geometry_as_bbox
+        self._db = self.load_database() if self.load_database_at_init else None
 
-    def create_session(self, password):
-        url = URL.create(
+    @property
+    def db(self) -> Union[GeoDataFrame, pd.DataFrame]:
+        if self._db is None:
+            self._db = self.load_database()
+        return self._db
+
+    def load_database(self) -> GeoDataFrame:
+        """Downloads the database and filters it on the split, or loads it from a valid local snapshot (compact if needed)."""
+
+        def download_and_filter_database():
+            db = self.download_database(
+                self.extraction_sql_query,
+                self.max_chunksize_for_postgis_extraction,
+                num_parallel_reads=self.num_parallel_reads,
+                partition_column=self.partition_column_for_parallel_reads,
+                partition_table=self.partition_table_for_parallel_reads,
+                compact=self.compact,
+            )
+            return filter_lipac_patches_on_split(db=db, test_colname=TEST_COLNAME_IN_LIPAC, desired_split=self.split)
+
+        if self.snapshot_cache_dir is None:
+            db = download_and_filter_database()
+        else:
+            # The database is identified by its URL (without the password). Compact snapshots hold categorical paths, hence a distinct key.
+            database_url = self.url.render_as_string(hide_password=True)
+            key_parts = [self.extraction_sql_query, database_url, self.split] + (["compact"] if self.compact else [])
+            snapshot_key = make_snapshot_key(*key_parts)
+            snapshot_path = Path(self.snapshot_cache_dir) / f"lipac-{self.split}-{snapshot_key}{SNAPSHOT_SUFFIX}"
+            db = load_or_make_snapshot(
+                snapshot_path, download_and_filter_database, log=self.log, ttl_hours=self.snapshot_ttl_hours, refresh=self.refresh_cache
+            )
+        if self.geometry_as_bbox:
+            self.crs = db.crs
+            db = geometry_to_bbox(db)
+        log_memory_usage(db, self.log, self.name)
+        return db
+
+    def create_session(self, password, pool_size: int = 1):
+        self.url = URL.create(
             drivername="postgresql",
             username=self.username,
             password=password,
             host=self.host,
+            port=self.port,
             database=self.db_name,
         )
 
-        self.engine = create_engine(url)
+        # Pool with enough connections for parallel reads (5 is the default pool size of SQLAlchemy).
+        self.engine = create_engine(self.url, pool_size=max(pool_size, 5))
         self.session = scoped_session(sessionmaker())
         self.session.configure(bind=self.engine, autoflush=False, expire_on_commit=False)
 
-    def download_database(self, extraction_sql_query: str, max_chunksize_for_postgis_extraction: int) -> gpd.GeoDataFrame:
+    def download_database(
+        self,
+        extraction_sql_query: str,
+        max_chunksize_for_postgis_extraction: int,
+        num_parallel_reads: int = 1,
+        partition_column: str = DEFAULT_PARTITION_COLUMN,
+        partition_table: str = DEFAULT_PARTITION_TABLE,
+        compact: bool = False,
+    ) -> gpd.GeoDataFrame:
         """This function extracts all data from a PostGIS database.
 
         It uses using the SQL query provided as a parameter, and returns a
@@ -78,19 +171,94 @@ class LiPaCConnector(Connector):
 
         Data is read data the database in blocks of size `CHUNKSIZE_FOR_POSTGIS_REQUESTS`.
         This allows processing the data in blocks rather than loading all of it into memory at once.
+        With num_parallel_reads > 1, ranges of the result are read concurrently (see read_postgis_by_ranges).
+        With compact=True, each block is compacted as soon as it is read (see pacasam.connectors.compact).
         """
         self.log.info(f"Requesting the LiPaC database via the following SQL command: \n {extraction_sql_query}")
-        chunks: Generator = gpd.read_postgis(
-            text(extraction_sql_query),
-            self.engine.connect(),
-            geom_col=GEOMETRY_COLNAME,
-            chunksize=max_chunksize_for_postgis_extraction,
-        )
-        gdf: gpd.GeoDataFrame = pd.concat(chunks)
+        prepare_chunk = compact_lipac_chunk if compact else None
+        if num_parallel_reads > 1:
+            chunks = self.read_postgis_by_ranges(
+                extraction_sql_query,
+                max_chunksize_for_postgis_extraction,
+                num_parallel_reads,
+                partition_column,
+                partition_table,
+                prepare_chunk=prepare_chunk,
+            )
+        else:
+            chunks: Generator = gpd.read_postgis(
+                text(extraction_sql_query),
+                self.engine.connect(),
+                geom_col=GEOMETRY_COLNAME,
+                chunksize=max_chunksize_for_postgis_extraction,
+            )
+            chunks = [prepare_chunk(chunk) for chunk in chunks] if compact else chunks
+        gdf: gpd.GeoDataFrame = concat_compact_chunks(chunks, LIPAC_CATEGORICAL_COLUMNS) if compact else pd.concat(chunks)
         gdf = gdf.sort_values(by=PATCH_ID_COLNAME)
         gdf = gdf.drop_duplicates(subset=PATCH_ID_COLNAME)
+        return self.convert_samba_paths_to_mounted_paths(gdf)
+
+    def read_postgis_by_ranges(
+        self,
+        extraction_sql_query: str,
+        max_chunksize_for_postgis_extraction: int,
+        num_ranges: int,
+        partition_column: str,
+        partition_table: str,
+        prepare_chunk: Optional[Callable[[gpd.GeoDataFrame], gpd.GeoDataFrame]] = None,
+    ) -> List[gpd.GeoDataFrame]:
+        """Reads the query result by ranges of partition_column, concurrently, each range over its own pooled connection.
+
+        partition_column is a column of partition_table, a base table of the query. Each range filter replaces the
+        RANGE_FILTER_MARKER of the query, so that the database applies it before the joins and window functions of the
+        query, instead of computing the whole query for each range. Range bounds are quantiles of partition_column in
+        partition_table. Chunks are passed to prepare_chunk (e.g. compacted) as soon as they are read. Returns all chunks of
+        all ranges, in the order of the ranges, so that they are concatenated only once.
+
+        """
+        for identifier in [partition_column, partition_table]:
+            if not identifier.isidentifier():
+                raise ValueError(f"Invalid identifier to partition the LiPaC query: `{identifier}`.")
+        if RANGE_FILTER_MARKER not in extraction_sql_query:
+            raise ValueError(
+                f"Parallel reads need the marker `{RANGE_FILTER_MARKER}` in the SQL query, where a filter on `{partition_column}` "
+                f"(a column of `{partition_table}`) can be applied, e.g. in the WHERE clause of the subquery on `{partition_table}`."
+            )
+        bounds = self.get_range_bounds(partition_table, num_ranges, partition_column)
+        self.log.info(f"Reading LiPaC by {len(bounds) + 1} ranges of `{partition_table}.{partition_column}`, concurrently.")
+
+        def read_range(range_filter: str, params: Dict) -> List[gpd.GeoDataFrame]:
+            with self.engine.connect() as connection:
+                chunks = gpd.read_postgis(
+                    text(extraction_sql_query.replace(RANGE_FILTER_MARKER, f"({range_filter})")),
+                    connection,
+                    geom_col=GEOMETRY_COLNAME,
+                    params=params,
+                    chunksize=max_chunksize_for_postgis_extraction,
+                )
+                return [prepare_chunk(chunk) for chunk in chunks] if prepare_chunk else list(chunks)
+
+        range_filters = make_range_filters(f"{partition_table}.{partition_column}", bounds)
+        with ThreadPoolExecutor(max_workers=num_ranges) as executor:
+            chunks_by_range = list(executor.map(lambda args: read_range(*args), range_filters))
+        return [chunk for chunks in chunks_by_range for chunk in chunks]
+
+    def get_range_bounds(self, partition_table: str, num_ranges: int, partition_column: str) -> List:
+        """Distinct quantiles of partition_column that split partition_table into num_ranges ranges of similar sizes."""
+        fractions = [i / num_ranges for i in range(1, num_ranges)]
+        quantiles_query = text(
+            f"SELECT percentile_disc(CAST(:fractions AS double precision[])) WITHIN GROUP (ORDER BY {partition_column}) "
+            f"FROM {partition_table}"
+        )
+        with self.engine.connect() as connection:
+            bounds = connection.execute(quantiles_query, {"fractions": fractions}).scalar()
+        return sorted(set(b for b in bounds if b is not None))
+
+    def convert_samba_paths_to_mounted_paths(self, gdf: GeoDataFrame) -> GeoDataFrame:
+        """Converts each unique path once (paths are shared by all patches of a file), instead of once per patch."""
         for col in [FILE_PATH_COLNAME, RGB_COLNAME, IRC_COLNAME]:
-            gdf[col] = gdf[col].apply(self.convert_samba_path_to_mounted_path)
+            mounted_paths = gdf[col].astype("category").map(self.convert_samba_path_to_mounted_path, na_action="ignore")
+            gdf[col] = mounted_paths if self.compact else mounted_paths.astype(object)
         return gdf
 
     def convert_samba_path_to_mounted_path(self, samba_path):
@@ -99,6 +267,80 @@ class LiPaCConnector(Connector):
         return mounted_path
 
 
+class LazyLiPaCConnector(LiPaCConnector):
+    """LiPaC connector that pushes requests down to the database, instead of downloading it whole at initialization.
+
+    Samplers only get the rows and columns they need: ids of all patches (requested once), ids of patches with a
+    boolean descriptor, or the few descriptors used by DiversitySampler and OutliersSampler. Full rows are requested
+    for the selected patches only, in `extract`. The full database is still downloaded if `db` is accessed, possibly
+    from a local snapshot: run_sampling.py therefore skips the comparison of the sampling with the database.
+
+    """
+
+    load_database_at_init = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lipac_query = self.extraction_sql_query.strip().rstrip(";")
+        self.split_filter = make_split_filter(TEST_COLNAME_IN_LIPAC, self.split)
+        self._patch_info: Optional[pd.DataFrame] = None
+
+    def read_patches(self, columns: Optional[List[str]], where: str = "TRUE", params: Optional[Dict] = None, with_geometry: bool = False):
+        """Requests columns (all columns if None) of the patches of the split that match the `where` SQL filter.
+
+        Like the full database, patches are sorted by id and deduplicated.
+
+        """
+        for column in columns or []:
+            if not column.isidentifier():
+                raise ValueError(f"Invalid column name to request from LiPaC: `{column}`.")
+        selected_columns = ", ".join(columns) if columns else "*"
+        query = text(f"SELECT {selected_columns} FROM ({self.lipac_query}) AS lipac_query WHERE ({self.split_filter}) AND ({where})")
+        with self.engine.connect() as connection:
+            if with_geometry:
+                df = pd.concat(
+                    gpd.read_postgis(
+                        query, connection, geom_col=GEOMETRY_COLNAME, params=params, chunksize=self.max_chunksize_for_postgis_extraction
+                    )
+                )
+            else:
+                df = pd.read_sql(query, connection, params=params)
+        df = df.sort_values(by=PATCH_ID_COLNAME)
+        df = df.drop_duplicates(subset=PATCH_ID_COLNAME)
+        if self.compact:
+            df = compact_database(df, categorical_columns=LIPAC_CATEGORICAL_COLUMNS)
+        return df
+
+    @property
+    def db_size(self):
+        return len(self.request_all_patches())
+
+    def request_all_patches(self) -> pd.DataFrame:
+        """Ids of all patches, requested once."""
+        if self._patch_info is None:
+            self.log.info(f"{self.name}: requesting the ids of all patches.")
+            self._patch_info = self.read_patches(PATCH_INFO)
+        return self._patch_info
+
+    def request_patches_by_boolean_indicator(self, bool_descriptor_name) -> pd.DataFrame:
+        if not bool_descriptor_name.isidentifier():
+            raise KeyError(f"Invalid descriptor name: `{bool_descriptor_name}`.")
+        return self.read_patches(PATCH_INFO, where=f"{bool_descriptor_name} IS TRUE")
+
+    def request_patches_with_columns(self, columns: List[str]) -> pd.DataFrame:
+        return self.read_patches(PATCH_INFO + [c for c in columns if c not in PATCH_INFO])
+
+    def extract(self, selection: Optional[GeoDataFrame]) -> GeoDataFrame:
+        """Requests full rows for the selected patches only."""
+        selected_ids = list(selection[PATCH_ID_COLNAME].unique())
+        self.log.info(f"{self.name}: requesting the {len(selected_ids)} selected patches.")
+        selected_patches = self.read_patches(
+            None, where=f"{PATCH_ID_COLNAME} = ANY(:selected_ids)", params={"selected_ids": selected_ids}, with_geometry=True
+        )
+        selected_patches = self.convert_samba_paths_to_mounted_paths(selected_patches)
+        return selected_patches.merge(selection, how="inner", on=PATCH_ID_COLNAME)
+
+
 def filter_lipac_patches_on_split(db: GeoDataFrame, test_colname: str, desired_split: SPLIT_POSSIBLE_VALUES):
     """Filter patches based on the desired split.
 
@@ -138,9 +380,41 @@ def filter_lipac_patches_on_split(db: GeoDataFrame, test_colname: str, desired_s
         raise ValueError(f"Invalid desired split: `{desired_split}`. Choose among `train`, `test`, or `any`.")
 
 
-def load_LiPaCConnector(**lipac_kwargs) -> LiPaCConnector:
+def compact_lipac_chunk(chunk: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    return compact_database(chunk, categorical_columns=LIPAC_CATEGORICAL_COLUMNS)
+
+
+def make_split_filter(test_colname: str, desired_split: SPLIT_POSSIBLE_VALUES) -> str:
+    """SQL filter equivalent to filter_lipac_patches_on_split. NULL values in the split column are train samples."""
+    if desired_split == "any":
+        return "TRUE"
+    if desired_split == "test":
+        return f"{test_colname} IS TRUE"
+    if desired_split == "train":
+        return f"{test_colname} IS NOT TRUE"
+    raise ValueError(f"Invalid desired split: `{desired_split}`. Choose among `train`, `test`, or `any`.")
+
+
+def make_range_filters(column: str, bounds: List) -> List[Tuple[str, Dict]]:
+    """SQL filters (and their parameters) for the consecutive ranges of column delimited by the sorted bounds.
+
+    The first and last ranges are open, and NULL values of column belong to the first range, so that every row belongs
+    to exactly one range.
+
+    """
+    if not bounds:
+        return [("TRUE", {})]
+    range_filters = [(f"{column} < :upper OR {column} IS NULL", {"upper": bounds[0]})]
+    for lower, upper in zip(bounds[:-1], bounds[1:]):
+        range_filters += [(f"{column} >= :lower AND {column} < :upper", {"lower": lower, "upper": upper})]
+    range_filters += [(f"{column} >= :lower", {"lower": bounds[-1]})]
+    return range_filters
+
+
+def load_LiPaCConnector(lazy: bool = False, **lipac_kwargs) -> LiPaCConnector:
     # TODO: at some point we will not need this since hydra will be able to
     # to get the env variables directly.
     lipac_username = os.getenv("LIPAC_LOGIN")
     lipac_password = os.getenv("LIPAC_PASSWORD")
-    return LiPaCConnector(username=lipac_username, password=lipac_password, **lipac_kwargs)
+    connector_class = LazyLiPaCConnector if lazy else LiPaCConnector
+    return connector_class(username=lipac_username, password=lipac_password, **lipac_kwargs)
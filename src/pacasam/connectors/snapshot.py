@@ -0,0 +1,66 @@
+"""Local snapshots of a patch database, to avoid requesting the same data at each sampling.
+
+Snapshots are saved in the Arrow IPC format (uncompressed), so that they can be memory-mapped when loaded.
+Each snapshot is identified by a key made from everything that defines its content (e.g. SQL query, database, split).
+Writes are atomic: a snapshot is either complete or absent.
+
+"""
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import Optional
+import geopandas as gpd
+
+SNAPSHOT_SUFFIX = ".arrow"
+
+
+def make_snapshot_key(*parts: str) -> str:
+    """Hash of all parts that define the content of a snapshot."""
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(str(part).encode("utf-8"))
+        sha.update(b"\0")  # separator, so that ("ab", "c") and ("a", "bc") give different keys.
+    return sha.hexdigest()[:16]
+
+
+def snapshot_is_valid(snapshot_path: Path, ttl_hours: Optional[float] = None) -> bool:
+    """A snapshot is valid if it exists and, when a time-to-live is given, is not older than it."""
+    if not snapshot_path.exists():
+        return False
+    if ttl_hours is None:
+        return True
+    age_hours = (time.time() - snapshot_path.stat().st_mtime) / 3600
+    return age_hours <= ttl_hours
+
+
+def save_snapshot(gdf: gpd.GeoDataFrame, snapshot_path: Path) -> None:
+    """Atomically saves a GeoDataFrame as an uncompressed Arrow IPC file."""
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=snapshot_path.parent, suffix=SNAPSHOT_SUFFIX, delete=False) as tmp_snapshot:
+        tmp_snapshot_path = tmp_snapshot.name
+    try:
+        gdf.to_feather(tmp_snapshot_path, compression="uncompressed")
+        os.replace(tmp_snapshot_path, snapshot_path)
+    except BaseException:
+        Path(tmp_snapshot_path).unlink(missing_ok=True)
+        raise
+
+
+def load_snapshot(snapshot_path: Path) -> gpd.GeoDataFrame:
+    """Loads a snapshot, memory-mapping the Arrow IPC file."""
+    return gpd.read_feather(snapshot_path, memory_map=True)
+
+
+def load_or_make_snapshot(snapshot_path: Path, make_gdf, log: logging.Logger, ttl_hours: Optional[float] = None, refresh: bool = False):
+    """Loads a valid snapshot, or calls make_gdf() and saves its output as a new snapshot."""
+    if not refresh and snapshot_is_valid(snapshot_path, ttl_hours):
+        log.info(f"Loading the database from its local snapshot: {snapshot_path}")
+        return load_snapshot(snapshot_path)
+    gdf = make_gdf()
+    save_snapshot(gdf, snapshot_path)
+    log.info(f"Saved a local snapshot of the database: {snapshot_path}")
+    return gdf
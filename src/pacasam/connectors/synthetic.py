@@ -1,10 +1,13 @@
+import json
 import logging
 from math import ceil
-from typing import List
+import os
+from pathlib import Path
+import shutil
+from typing import Dict, List, Optional
 import numpy as np
-from pandas import DataFrame
 import geopandas as gpd
-from shapely.geometry import box
+from shapely import box
 
 from pacasam.connectors.connector import FILE_ID_COLNAME, Connector
 from pacasam.connectors.lipac import SPLIT_POSSIBLE_VALUES, TEST_COLNAME_IN_LIPAC, filter_lipac_patches_on_split
@@ -29,6 +32,8 @@ PATCH_SIZE = 50
 
 NUM_PATCHES_BY_SLAB = int((SLAB_SIZE / PATCH_SIZE) ** 2)
 FRAC_OF_TEST_PATCHES_IN_DATABASE = 0.2
+# Parameters of a GeoParquet dataset, stored next to its files. Files prefixed with "_" are not read as parquet files.
+GEOPARQUET_PARAMETERS_FILENAME = "_parameters.json"
 
 
 class SyntheticConnector(Connector):
@@ -40,6 +45,9 @@ class SyntheticConnector(Connector):
       - Binary descriptors, with specific prevalences (C1, C2...)
       - Mandatory fields as described in connector.py
 
+    Generation is vectorized. Large databases can be generated chunk by chunk to a GeoParquet dataset on disk,
+    which is then reused, to reproduce production-scale loads without LiPaC access.
+
     """
 
     def __init__(
@@ -48,6 +56,9 @@ class SyntheticConnector(Connector):
         binary_descriptors_prevalence: List[float],
         split: SPLIT_POSSIBLE_VALUES,
         db_size: int = 10000,
+        seed: Optional[int] = None,
+        geoparquet_path: Optional[str] = None,
+        chunk_size: int = 1_000_000,
     ):
         """Initialization.
 
@@ -56,58 +67,102 @@ class SyntheticConnector(Connector):
             binary_descriptors_prevalence (List[float]): a list of prevalences to create synthetic boolean descriptors.
             split (str): desired split, among `train`,`test`, or `any`.
             db_size (int, optional): Desired size of the synthetic database. Defaults to 10000.
+            seed (int, optional): seed of the random generator, for reproducible databases. Defaults to None.
+            geoparquet_path (str, optional): directory of a GeoParquet dataset of the synthetic database. It is generated
+            chunk by chunk if it does not exist yet, or if it was generated with another db_size, seed, or
+            binary_descriptors_prevalence, and then loaded. Defaults to None i.e. generation in memory.
+            chunk_size (int, optional): number of patches by chunk (i.e. by file) of the GeoParquet dataset.
 
             Note that the actual synthetic database to sample from will be smaller than given db_size, if the split
             is either train or val.
 
         """
         super().__init__(log=log)
-        df_geom, df_file_ids = make_synthetic_geometries_and_slabs(db_size)
-        # WARNING: the synthetic geometries will not be compliant with the FILE_ID_COLNAME.
-        self.db = gpd.GeoDataFrame(
-            geometry=df_geom,
-            crs="EPSG:2154",
-        )
-        for idx, t in enumerate(binary_descriptors_prevalence):
-            n_target = ceil(t * db_size)
-            d = np.concatenate([np.ones(shape=(n_target,)).astype(bool), np.zeros(shape=(db_size - n_target,)).astype(bool)])
-            np.random.shuffle(d)
-            self.db[f"C{idx}"] = d
-
-        for nb_point_colname in NB_POINTS_COLNAMES:
-            d = np.random.randint(low=0, high=60_000, size=(db_size,)).astype(int)
-            self.db[nb_point_colname] = d
-
-        self.db[PATCH_ID_COLNAME] = range(len(self.db))
-        self.db[FILE_ID_COLNAME] = df_file_ids
-
-        # create a test columns that flags "reserved" patches (i.e. reserved for test set)
-        n_target = int(db_size * FRAC_OF_TEST_PATCHES_IN_DATABASE)
-        d = np.concatenate([np.ones(shape=(n_target,)).astype(bool), np.full(shape=(db_size - n_target,), fill_value=np.nan)])
-        np.random.shuffle(d)
-        self.db[TEST_COLNAME_IN_LIPAC] = d
-        self.db = filter_lipac_patches_on_split(db=self.db, test_colname=TEST_COLNAME_IN_LIPAC, desired_split=split)
-
-
-def make_synthetic_geometries_and_slabs(db_size: int):
+        if geoparquet_path is None:
+            db = make_synthetic_patches(0, db_size, db_size, binary_descriptors_prevalence, rng=np.random.default_rng(seed))
+        else:
+            parameters = make_geoparquet_parameters(db_size, binary_descriptors_prevalence, seed)
+            if read_geoparquet_parameters(geoparquet_path) != parameters:
+                if Path(geoparquet_path).exists() and self.log is not None:
+                    self.log.info(f"{self.name}: regenerating {geoparquet_path}, which was generated with other parameters.")
+                write_synthetic_geoparquet(geoparquet_path, db_size, binary_descriptors_prevalence, chunk_size=chunk_size, seed=seed)
+            db = gpd.read_parquet(geoparquet_path)
+        self.db = filter_lipac_patches_on_split(db=db, test_colname=TEST_COLNAME_IN_LIPAC, desired_split=split)
+
+
+def make_synthetic_patches(
+    start: int, stop: int, db_size: int, binary_descriptors_prevalence: List[float], rng: np.random.Generator
+) -> gpd.GeoDataFrame:
+    """Synthetic patches from position `start` to position `stop` in a synthetic database of size `db_size`.
+
+    Prevalences of binary descriptors and of test patches are exact within the generated patches.
+
+    """
+    num_patches = stop - start
+    x, y, file_ids = make_synthetic_geometries_and_slabs(start, stop, db_size)
+    # WARNING: the synthetic geometries will not be compliant with the FILE_ID_COLNAME.
+    db = gpd.GeoDataFrame(geometry=box(x, y, x + PATCH_SIZE, y + PATCH_SIZE, ccw=False), crs="EPSG:2154")
+    for idx, t in enumerate(binary_descriptors_prevalence):
+        n_target = ceil(t * num_patches)
+        db[f"C{idx}"] = rng.permutation(np.arange(num_patches) < n_target)
+
+    for nb_point_colname in NB_POINTS_COLNAMES:
+        db[nb_point_colname] = rng.integers(low=0, high=60_000, size=(num_patches,))
+
+    db[PATCH_ID_COLNAME] = np.arange(start, stop)
+    db[FILE_ID_COLNAME] = file_ids
+
+    # create a test columns that flags "reserved" patches (i.e. reserved for test set)
+    n_target = int(num_patches * FRAC_OF_TEST_PATCHES_IN_DATABASE)
+    db[TEST_COLNAME_IN_LIPAC] = rng.permutation(np.where(np.arange(num_patches) < n_target, 1.0, np.nan))
+    return db
+
+
+def make_synthetic_geometries_and_slabs(start: int, stop: int, db_size: int):
+    """Lower-left corners and slab ids of patches, row by row in a square grid big enough for db_size patches."""
     fake_grid_size = ceil(np.sqrt(db_size))
-    # Cartesian product of range * tile_size
-    df_x = DataFrame({"x": range(fake_grid_size)}) * PATCH_SIZE
-    df_y = DataFrame({"y": range(fake_grid_size)}) * PATCH_SIZE
-    df_xy = df_x.merge(df_y, how="cross")
-
-    # limit the size to the desired db_size
-    df_xy = df_xy.head(db_size)
-
-    df_geom = df_xy.apply(
-        lambda row: box(
-            row["x"],
-            row["y"],
-            row["x"] + PATCH_SIZE,
-            row["y"] + PATCH_SIZE,
-            ccw=False,
-        ),
-        axis=1,
-    )
-    df_file_ids = (df_xy // SLAB_SIZE).apply(lambda row: str(row["x"]) + "_" + str(row["y"]), axis=1)
-    return df_geom, df_file_ids
+    positions = np.arange(start, stop)
+    x = (positions // fake_grid_size) * PATCH_SIZE
+    y = (positions % fake_grid_size) * PATCH_SIZE
+    # Ids are formatted once per slab, and then broadcast to the patches of the slab.
+    slab_keys = (x // SLAB_SIZE) * (fake_grid_size + 1) + y // SLAB_SIZE
+    unique_slab_keys, slab_of_patch = np.unique(slab_keys, return_inverse=True)
+    slab_x, slab_y = np.divmod(unique_slab_keys, fake_grid_size + 1)
+    slab_ids = np.char.add(np.char.add(slab_x.astype(str), "_"), slab_y.astype(str)).astype(object)
+    return x, y, slab_ids[slab_of_patch]
+
+
+def write_synthetic_geoparquet(
+    geoparquet_path: str, db_size: int, binary_descriptors_prevalence: List[float], chunk_size: int = 1_000_000, seed: Optional[int] = None
+) -> None:
+    """Generates a synthetic database chunk by chunk, to a GeoParquet dataset (one file per chunk).
+
+    Memory usage is bounded by chunk_size. The dataset is written to a temporary directory which is then renamed,
+    so that an interrupted generation is not mistaken for a complete dataset.
+
+    """
+    rng = np.random.default_rng(seed)
+    geoparquet_path = Path(geoparquet_path)
+    tmp_path = geoparquet_path.with_name(geoparquet_path.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    for chunk_idx, start in enumerate(range(0, db_size, chunk_size)):
+        chunk = make_synthetic_patches(start, min(start + chunk_size, db_size), db_size, binary_descriptors_prevalence, rng=rng)
+        chunk.to_parquet(tmp_path / f"part-{chunk_idx:05d}.parquet")
+    parameters = make_geoparquet_parameters(db_size, binary_descriptors_prevalence, seed)
+    (tmp_path / GEOPARQUET_PARAMETERS_FILENAME).write_text(json.dumps(parameters))
+    # A dataset generated with other parameters is replaced.
+    shutil.rmtree(geoparquet_path, ignore_errors=True)
+    os.replace(tmp_path, geoparquet_path)
+
+
+def make_geoparquet_parameters(db_size: int, binary_descriptors_prevalence: List[float], seed: Optional[int]) -> Dict:
+    return {"db_size": int(db_size), "binary_descriptors_prevalence": [float(p) for p in binary_descriptors_prevalence], "seed": seed}
+
+
+def read_geoparquet_parameters(geoparquet_path: str) -> Optional[Dict]:
+    """Parameters of an existing GeoParquet dataset, or None if there is no dataset (or one without parameters)."""
+    parameters_path = Path(geoparquet_path) / GEOPARQUET_PARAMETERS_FILENAME
+    if not parameters_path.exists():
+        return None
+    return json.loads(parameters_path.read_text())
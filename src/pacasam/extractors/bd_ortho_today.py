@@ -10,18 +10,37 @@ dataset_root_path/
 ├── test/
 │   ├── TEST-{patch_id}.tiff
 
+By default, patches are extracted by `num_jobs` processes, each requesting the orthoimages of a patch one after the other.
+With `max_in_flight_requests`, orthoimages are instead requested concurrently by an asyncio event loop, over a shared pool
+of keep-alive connections (see `pacasam.extractors.wms`), and collated into patches by a pool of `num_jobs` processes.
+
 """
 
 
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
 from pathlib import Path
 import shutil
 import tempfile
+from typing import Optional, Tuple
 from pdaltools.color import retry, download_image_from_geoplateforme
-from pacasam.connectors.connector import GEOMETRY_COLNAME, PATCH_ID_COLNAME, SRID_COLNAME
+from pacasam.connectors.bbox import get_patch_bounds
+from pacasam.connectors.connector import PATCH_ID_COLNAME, SRID_COLNAME
 from pacasam.extractors.extractor import Extractor, DEFAULT_SRID_LAMBERT93
+from pacasam.extractors.failures import DEFAULT_NUM_RETRIES
+from pacasam.extractors.journal import sha1sum
+from pacasam.extractors.shards import DEFAULT_MAX_SHARD_SIZE_GB, FILES_LAYOUT
+from pacasam.extractors.wms import GEOPLATEFORME_WMS_URL, AsyncWMSDownloader, gather_or_cancel
+from pacasam.extractors.wms_cache import DEFAULT_WMS_CACHE_MAX_SIZE_GB, WMSImageCache
 from pacasam.samplers.sampler import SPLIT_COLNAME
 import rasterio
-from mpire import WorkerPool
+from tqdm import tqdm
+
+RGB_LAYER = "ORTHOIMAGERY.ORTHOPHOTOS"
+IRC_LAYER = "ORTHOIMAGERY.ORTHOPHOTOS.IRC"
 
 
 class BDOrthoTodayExtractor(Extractor):
@@ -35,25 +54,72 @@ class BDOrthoTodayExtractor(Extractor):
     """
 
     patch_suffix: str = ".tiff"
+    patch_record_columns = Extractor.patch_record_columns + [SRID_COLNAME]
     timeout_second = 300
     pixel_per_meter = 5
+    wms_url = GEOPLATEFORME_WMS_URL
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        sampling_path: Path,
+        dataset_root_path: Path,
+        num_jobs: int = 1,
+        max_in_flight_requests: Optional[int] = None,
+        max_requests_per_second: Optional[float] = None,
+        wms_cache_dir: Optional[Path] = None,
+        wms_cache_max_size_gb: float = DEFAULT_WMS_CACHE_MAX_SIZE_GB,
+        output_layout: str = FILES_LAYOUT,
+        max_shard_size_gb: float = DEFAULT_MAX_SHARD_SIZE_GB,
+        fault_tolerant: bool = False,
+        num_retries: int = DEFAULT_NUM_RETRIES,
+        num_retry_jobs: int = 1,
+    ):
+        """Initialization.
+
+        max_in_flight_requests: if given, orthoimages are requested concurrently by an asyncio event loop, with at most this
+        number of requests in flight, and num_jobs is the number of processes that collate them into patches. Defaults to None.
+        max_requests_per_second: rate limit of the concurrent requests. Defaults to None (no limit).
+        wms_cache_dir: if given, orthoimages are read from and saved to this (local) directory, shared by successive
+        extractions (see pacasam.extractors.wms_cache). Defaults to None.
+
+        """
+        super().__init__(
+            log,
+            sampling_path,
+            dataset_root_path,
+            num_jobs=num_jobs,
+            output_layout=output_layout,
+            max_shard_size_gb=max_shard_size_gb,
+            fault_tolerant=fault_tolerant,
+            num_retries=num_retries,
+            num_retry_jobs=num_retry_jobs,
+        )
+        self.max_in_flight_requests = max_in_flight_requests
+        self.max_requests_per_second = max_requests_per_second
+        self.wms_cache = WMSImageCache(wms_cache_dir, wms_cache_max_size_gb, log=log) if wms_cache_dir else None
 
     def extract(self) -> None:
         """Download the orthoimages dataset."""
-        # mpire does argument unpacking, see https://github.com/sybrenjansen/mpire/issues/29#issuecomment-984559662.
-        iterable_of_args = [(patch_info,) for _, patch_info in self.sampling.iterrows()]
-        with WorkerPool(n_jobs=self.num_jobs) as pool:
-            pool.map(self.extract_single_patch, iterable_of_args, progress_bar=True)
+        if self.wms_cache is not None:
+            self.wms_cache.evict()
+        self.extract_and_retry_failures(self.select_patches_to_extract())
+        self.finalize_output()
+        if self.wms_cache is not None:
+            self.wms_cache.evict()
+
+    def extract_patches(self, sampling) -> None:
+        if self.max_in_flight_requests:
+            asyncio.run(self.extract_concurrently(sampling))
+        else:
+            self.extract_patches_by_chunks(sampling)
 
     def extract_single_patch(self, patch_info):
         """Extract and RGB+NIR tiff for the patch."""
 
         split = getattr(patch_info, SPLIT_COLNAME)
         patch_id = getattr(patch_info, PATCH_ID_COLNAME)
-        tiff_patch_path: Path = self.make_new_patch_path(patch_id=patch_id, split=split)
-        if tiff_patch_path.exists():
-            return
-        patch_bounds = getattr(patch_info, GEOMETRY_COLNAME).bounds
+        patch_bounds = get_patch_bounds(patch_info)
         # Use given srid if possible, else use the default value.
         srid = getattr(patch_info, SRID_COLNAME, DEFAULT_SRID_LAMBERT93)
 
@@ -61,33 +127,140 @@ class BDOrthoTodayExtractor(Extractor):
             self.get_orthoimages_for_patch(patch_bounds, srid, tmp_ortho_rgb.name, tmp_ortho_nir.name)
             tmp_patch: tempfile._TemporaryFileWrapper = tempfile.NamedTemporaryFile(suffix=self.patch_suffix, prefix="extracted_patch")
             self.collate_rgbnir_and_save(tmp_ortho_rgb.name, tmp_ortho_nir.name, tmp_patch)
-            tiff_patch_path.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy(tmp_patch.name, tiff_patch_path)
+            self.save_patch(Path(tmp_patch.name), patch_id, split)
 
-    def get_orthoimages_for_patch(self, patch_bounds: tuple, srid: str, tmp_ortho_rgb: str, tmp_ortho_nir: str):
-        """Request RGB and NIR-Color orthoimages,"""
-        xmin, ymin, xmax, ymax = patch_bounds
+    async def extract_concurrently(self, patches) -> None:
+        """Download the orthoimages dataset with concurrent requests.
 
-        download_image_from_geoplateforme_retrying = retry(7, 15, 2)(download_image_from_geoplateforme)
-        download_image_from_geoplateforme_retrying(
-            srid, "ORTHOIMAGERY.ORTHOPHOTOS", xmin, ymin, xmax, ymax, self.pixel_per_meter, tmp_ortho_rgb, self.timeout_second
+        Each of max_in_flight_requests coroutines takes the next patch to extract, requests its RGB and IRC orthoimages
+        concurrently, and waits for the process pool to collate them, so that orthoimages of at most max_in_flight_requests
+        patches are on disk at any time.
+
+        """
+        patches_iterator = patches.itertuples()
+        progress_bar = tqdm(total=len(patches))
+        # Processes are spawned: forking the threads of the downloader is unsafe.
+        process_pool = ProcessPoolExecutor(max_workers=self.num_jobs, mp_context=multiprocessing.get_context("spawn"))
+        downloader = AsyncWMSDownloader(
+            url=self.wms_url,
+            max_in_flight_requests=self.max_in_flight_requests,
+            max_requests_per_second=self.max_requests_per_second,
+            timeout_second=self.timeout_second,
+            cache=self.wms_cache,
         )
-        download_image_from_geoplateforme_retrying(
-            srid, "ORTHOIMAGERY.ORTHOPHOTOS.IRC", xmin, ymin, xmax, ymax, self.pixel_per_meter, tmp_ortho_nir, self.timeout_second
+        loop = asyncio.get_running_loop()
+
+        async def extract_next_patches(tmp_dir: Path):
+            # The iterator is shared by all coroutines: each patch is extracted once.
+            for patch_info in patches_iterator:
+                with self.isolate_failures([patch_info]):
+                    await extract_patch(patch_info, tmp_dir)
+                progress_bar.update()
+
+        async def extract_patch(patch_info, tmp_dir: Path):
+            tmp_ortho_rgb, tmp_ortho_nir = tmp_dir / f"{patch_info.Index}-rgb.tiff", tmp_dir / f"{patch_info.Index}-irc.tiff"
+            srid = getattr(patch_info, SRID_COLNAME, DEFAULT_SRID_LAMBERT93)
+            bounds = get_patch_bounds(patch_info)
+            await download_rgb_and_irc_orthoimages_concurrently(downloader, bounds, srid, tmp_ortho_rgb, tmp_ortho_nir, self.pixel_per_meter)
+            tmp_patch = tmp_dir / f"{patch_info.Index}{self.patch_suffix}"
+            if self.shard_writers is None:
+                tiff_patch_path = self._patch_path(patch_info)
+                size, checksum = await loop.run_in_executor(
+                    process_pool, collate_rgbnir_and_save_atomically, tmp_ortho_rgb, tmp_ortho_nir, tiff_patch_path, tmp_patch
+                )
+                self.journal.record_entries([(self.journal.relative_path(tiff_patch_path), size, checksum)])
+            else:
+                await loop.run_in_executor(process_pool, collate_rgbnir_and_save, tmp_ortho_rgb, tmp_ortho_nir, tmp_patch)
+                self.save_patch(tmp_patch, getattr(patch_info, PATCH_ID_COLNAME), getattr(patch_info, SPLIT_COLNAME))
+                tmp_patch.unlink()
+            tmp_ortho_rgb.unlink()
+            tmp_ortho_nir.unlink()
+
+        with tempfile.TemporaryDirectory() as tmp_dir, process_pool, progress_bar:
+            async with downloader:
+                # Without fault tolerance, the first error stops all coroutines.
+                await gather_or_cancel(*[extract_next_patches(Path(tmp_dir)) for _ in range(self.max_in_flight_requests)])
+
+    def _patch_path(self, patch_info) -> Path:
+        return self.make_new_patch_path(patch_id=getattr(patch_info, PATCH_ID_COLNAME), split=getattr(patch_info, SPLIT_COLNAME))
+
+    def get_orthoimages_for_patch(self, patch_bounds: tuple, srid: str, tmp_ortho_rgb: str, tmp_ortho_nir: str):
+        """Request RGB and NIR-Color orthoimages,"""
+        download_rgb_and_irc_orthoimages(
+            patch_bounds, srid, tmp_ortho_rgb, tmp_ortho_nir, self.pixel_per_meter, self.timeout_second, wms_cache=self.wms_cache
         )
 
     def collate_rgbnir_and_save(self, tmp_ortho_rgb: str, tmp_ortho_nir: str, tiff_patch_path: Path):
         """Collate RGB and NIR tiff images and save to a new geotiff."""
-        with rasterio.open(tmp_ortho_rgb) as ortho_rgb, rasterio.open(tmp_ortho_nir) as ortho_irc:
-            options = ortho_rgb.meta
-            options.update(count=4)
-            options.update(compress="DEFLATE")
-            with rasterio.open(tiff_patch_path, "w", **options) as dst:
-                dst.write(ortho_irc.read(1), 1)
-                dst.set_band_description(1, "Infrared")
-                dst.write(ortho_rgb.read(1), 2)
-                dst.set_band_description(2, "Red")
-                dst.write(ortho_rgb.read(2), 3)
-                dst.set_band_description(3, "Green")
-                dst.write(ortho_rgb.read(3), 4)
-                dst.set_band_description(4, "Blue")
+        collate_rgbnir_and_save(tmp_ortho_rgb, tmp_ortho_nir, tiff_patch_path)
+
+
+def collate_rgbnir_and_save(tmp_ortho_rgb: str, tmp_ortho_nir: str, tiff_patch_path: Path):
+    """Collate RGB and NIR tiff images and save to a new geotiff."""
+    with rasterio.open(tmp_ortho_rgb) as ortho_rgb, rasterio.open(tmp_ortho_nir) as ortho_irc:
+        options = ortho_rgb.meta
+        options.update(count=4)
+        options.update(compress="DEFLATE")
+        with rasterio.open(tiff_patch_path, "w", **options) as dst:
+            dst.write(ortho_irc.read(1), 1)
+            dst.set_band_description(1, "Infrared")
+            dst.write(ortho_rgb.read(1), 2)
+            dst.set_band_description(2, "Red")
+            dst.write(ortho_rgb.read(2), 3)
+            dst.set_band_description(3, "Green")
+            dst.write(ortho_rgb.read(3), 4)
+            dst.set_band_description(4, "Blue")
+
+
+def collate_rgbnir_and_save_atomically(
+    tmp_ortho_rgb: str, tmp_ortho_nir: str, tiff_patch_path: Path, local_patch_path: Path
+) -> Tuple[int, str]:
+    """Collate RGB and NIR tiff images into a local file, copied to a temporary file next to the patch path which is then renamed:
+    a patch is always complete. Returns the size and SHA-1 of the local file, so that the patch (e.g. on a network share) is not
+    read again to journal it."""
+    collate_rgbnir_and_save(tmp_ortho_rgb, tmp_ortho_nir, local_patch_path)
+    size, checksum = os.path.getsize(local_patch_path), sha1sum(local_patch_path)
+    tmp_patch_prefix = f".{tiff_patch_path.stem}-"
+    with tempfile.NamedTemporaryFile(suffix=tiff_patch_path.suffix, prefix=tmp_patch_prefix, dir=tiff_patch_path.parent, delete=False) as tmp:
+        tmp_patch_path = Path(tmp.name)
+    try:
+        shutil.copyfile(local_patch_path, tmp_patch_path)
+        os.replace(tmp_patch_path, tiff_patch_path)
+    finally:
+        tmp_patch_path.unlink(missing_ok=True)
+        Path(local_patch_path).unlink(missing_ok=True)
+    return size, checksum
+
+
+def download_rgb_and_irc_orthoimages(
+    bounds: tuple,
+    srid: str,
+    rgb_path: str,
+    irc_path: str,
+    pixel_per_meter: float,
+    timeout_second: int,
+    wms_cache: Optional[WMSImageCache] = None,
+):
+    """Request RGB and NIR-Color orthoimages of the bounds to the Géoplateforme WMS, retrying on failures.
+
+    With a wms_cache, cached orthoimages are not requested, and requested ones are saved to the cache.
+
+    """
+    xmin, ymin, xmax, ymax = bounds
+    download_image_from_geoplateforme_retrying = retry(7, 15, 2)(download_image_from_geoplateforme)
+    for layer, path in [(RGB_LAYER, rgb_path), (IRC_LAYER, irc_path)]:
+        if wms_cache is not None and wms_cache.fetch(layer, srid, bounds, pixel_per_meter, path):
+            continue
+        download_image_from_geoplateforme_retrying(srid, layer, xmin, ymin, xmax, ymax, pixel_per_meter, path, timeout_second)
+        if wms_cache is not None:
+            wms_cache.store(layer, srid, bounds, pixel_per_meter, path)
+
+
+async def download_rgb_and_irc_orthoimages_concurrently(
+    downloader: AsyncWMSDownloader, bounds: tuple, srid: str, rgb_path: str, irc_path: str, pixel_per_meter: float
+):
+    """Request RGB and NIR-Color orthoimages of the bounds concurrently, through a downloader with a shared connection pool."""
+    await gather_or_cancel(
+        downloader.download(RGB_LAYER, srid, bounds, pixel_per_meter, rgb_path),
+        downloader.download(IRC_LAYER, srid, bounds, pixel_per_meter, irc_path),
+    )
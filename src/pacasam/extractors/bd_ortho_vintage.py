@@ -16,23 +16,30 @@ The patches are expected to be fully included in the indicated file. If this is
 
 """
 
+from collections import OrderedDict
+import logging
+import os
 from pathlib import Path
-import shutil
 import tempfile
-from typing import Tuple
+from typing import Iterable, Optional, Tuple
 import numpy as np
-from pacasam.connectors.connector import GEOMETRY_COLNAME, PATCH_ID_COLNAME
+from pacasam.connectors.bbox import get_patch_bounds
+from pacasam.connectors.connector import PATCH_ID_COLNAME
+from pacasam.extractors.cog_cache import DEFAULT_COG_CACHE_MAX_SIZE_GB, COGCache, stage_orthoimagery_sources
 from pacasam.extractors.extractor import Extractor
+from pacasam.extractors.failures import DEFAULT_NUM_RETRIES
+from pacasam.extractors.shards import DEFAULT_MAX_SHARD_SIZE_GB, FILES_LAYOUT
 from pacasam.samplers.sampler import SPLIT_COLNAME
 import rasterio
 from rasterio import DatasetReader
 from rasterio import Affine
-from rasterio.mask import mask
-from mpire import WorkerPool
+from rasterio.crs import CRS
+from rasterio.windows import Window, from_bounds
 
 RGB_COLNAME = "rgb_file"
 IRC_COLNAME = "irc_file"
 BDORTHO_PIXELS_PER_METER = 5
+DATASET_READERS_CACHE_SIZE = 16  # Open rasters per worker, e.g. 8 pairs of RGB and IRC files.
 
 
 class BDOrthoVintageExtractor(Extractor):
@@ -44,47 +51,77 @@ class BDOrthoVintageExtractor(Extractor):
     """
 
     patch_suffix: str = ".tiff"
+    patch_record_columns = Extractor.patch_record_columns + [RGB_COLNAME, IRC_COLNAME]
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        sampling_path: Path,
+        dataset_root_path: Path,
+        num_jobs: int = 1,
+        cog_cache_dir: Optional[Path] = None,
+        cog_cache_max_size_gb: float = DEFAULT_COG_CACHE_MAX_SIZE_GB,
+        output_layout: str = FILES_LAYOUT,
+        max_shard_size_gb: float = DEFAULT_MAX_SHARD_SIZE_GB,
+        fault_tolerant: bool = False,
+        num_retries: int = DEFAULT_NUM_RETRIES,
+        num_retry_jobs: int = 1,
+    ):
+        """Initialization.
+
+        cog_cache_dir: if given, orthoimagery sources are transcoded to Cloud-Optimized GeoTIFFs in this (local) directory
+        before extraction, and read from there (see pacasam.extractors.cog_cache). Defaults to None.
+
+        """
+        super().__init__(
+            log,
+            sampling_path,
+            dataset_root_path,
+            num_jobs=num_jobs,
+            output_layout=output_layout,
+            max_shard_size_gb=max_shard_size_gb,
+            fault_tolerant=fault_tolerant,
+            num_retries=num_retries,
+            num_retry_jobs=num_retry_jobs,
+        )
+        self.cog_cache = COGCache(cog_cache_dir, cog_cache_max_size_gb, log=log) if cog_cache_dir else None
 
     def extract(self) -> None:
-        """Extract the orthoimages dataset."""
-        # mpire does argument unpacking, see https://github.com/sybrenjansen/mpire/issues/29#issuecomment-984559662.
-        iterable_of_args = [(patch_info,) for _, patch_info in self.sampling.iterrows()]
-        with WorkerPool(n_jobs=self.num_jobs) as pool:
-            pool.map(self.extract_single_patch, iterable_of_args, progress_bar=True)
+        """Extract the orthoimages dataset.
+
+        Patches are sorted by source rasters, and mpire sends contiguous chunks of patches to the workers: patches that share
+        rasters are extracted by the same worker, which opens these rasters once (see DatasetReadersCache).
+
+        """
+        if self.cog_cache is not None:
+            self.sampling = stage_orthoimagery_sources(self.sampling, [RGB_COLNAME, IRC_COLNAME], self.cog_cache, num_jobs=self.num_jobs)
+        self.extract_and_retry_failures(self.select_patches_to_extract())
+        self.finalize_output()
+
+    def extract_patches(self, sampling) -> None:
+        self.extract_patches_by_chunks(sampling.sort_values([RGB_COLNAME, IRC_COLNAME], kind="stable"))
 
     def extract_single_patch(self, patch_info):
         split = getattr(patch_info, SPLIT_COLNAME)
         patch_id = getattr(patch_info, PATCH_ID_COLNAME)
-        tiff_patch_path: Path = self.make_new_patch_path(patch_id=patch_id, split=split)
-        if tiff_patch_path.exists():
-            return
-        patch_geometry = getattr(patch_info, GEOMETRY_COLNAME)
+        patch_bounds = get_patch_bounds(patch_info)
         rgb_file = getattr(patch_info, RGB_COLNAME)
         irc_file = getattr(patch_info, IRC_COLNAME)
-        tmp_patch = extract_rgbnir_patch_as_tmp_file(rgb_file, irc_file, BDORTHO_PIXELS_PER_METER, patch_geometry)
-        tiff_patch_path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy(tmp_patch.name, tiff_patch_path)
+        tmp_patch = extract_rgbnir_patch_as_tmp_file(rgb_file, irc_file, BDORTHO_PIXELS_PER_METER, patch_bounds)
+        self.save_patch(Path(tmp_patch.name), patch_id, split)
 
 
-def extract_rgbnir_patch_as_tmp_file(rgb_file, irc_file, pixel_per_meter, patch_geometry):
+def extract_rgbnir_patch_as_tmp_file(rgb_file, irc_file, pixel_per_meter, patch_bounds: Tuple):
     """Extract both rgb and irc patch images and collate them into a temporary file."""
-    with rasterio.open(rgb_file) as rgb_open, rasterio.open(irc_file) as irc_open:
-        bbox = patch_geometry.bounds
-        width = bbox[2] - bbox[0]
-        height = bbox[3] - bbox[1]
-        assert width == height  # squares only
-        width_pixels = int(pixel_per_meter * width)
-        rgb_arr = extract_patch_as_geotiffs(rgb_open, patch_geometry, width_pixels)
-        irc_arr = extract_patch_as_geotiffs(irc_open, patch_geometry, width_pixels)
-    image_resolution = 1 / pixel_per_meter
+    rgb_arr, irc_arr, transform, crs = extract_rgbnir_patch_as_arrays(rgb_file, irc_file, pixel_per_meter, patch_bounds)
     options = {
         "driver": "GTiff",
         "count": 4,
         "dtype": rgb_arr.dtype,
-        "transform": Affine(image_resolution, 0, bbox[0], 0, -image_resolution, bbox[3]),
-        "crs": rgb_open.crs,
-        "width": width_pixels,
-        "height": width_pixels,
+        "transform": transform,
+        "crs": crs,
+        "width": rgb_arr.shape[2],
+        "height": rgb_arr.shape[1],
         "compress": "DEFLATE",
         "tiled": False,
         "bigtiff": "IF_SAFER",
@@ -95,10 +132,69 @@ def extract_rgbnir_patch_as_tmp_file(rgb_file, irc_file, pixel_per_meter, patch_
     return tmp_patch
 
 
-def extract_patch_as_geotiffs(src_orthoimagery: DatasetReader, patch_geometry: Tuple, num_pixels: int):
-    clipped_dataset, _ = mask(src_orthoimagery, [patch_geometry], crop=True)
-    clipped_dataset = clipped_dataset[:, :num_pixels, :num_pixels]
-    return clipped_dataset
+def extract_rgbnir_patch_as_arrays(rgb_file, irc_file, pixel_per_meter, patch_bounds: Tuple) -> Tuple[np.ndarray, np.ndarray, Affine, CRS]:
+    """Extract both rgb and irc patch images as arrays, with the transform and crs of the patch image."""
+    bbox = patch_bounds
+    width = bbox[2] - bbox[0]
+    height = bbox[3] - bbox[1]
+    assert width == height  # squares only
+    width_pixels = int(pixel_per_meter * width)
+    rgb_open = DATASET_READERS_CACHE.open(rgb_file)
+    irc_open = DATASET_READERS_CACHE.open(irc_file)
+    rgb_arr = extract_patch_as_geotiffs(rgb_open, patch_bounds, width_pixels)
+    irc_arr = extract_patch_as_geotiffs(irc_open, patch_bounds, width_pixels)
+    image_resolution = 1 / pixel_per_meter
+    transform = Affine(image_resolution, 0, bbox[0], 0, -image_resolution, bbox[3])
+    return rgb_arr, irc_arr, transform, rgb_open.crs
+
+
+def extract_patch_as_geotiffs(src_orthoimagery: DatasetReader, patch_bounds: Tuple, num_pixels: int):
+    """Reads the window of the patch (a square aligned with the axes) from the orthoimagery, as an array of num_pixels x num_pixels.
+
+    The window starts at the pixel nearest to the top-left corner of the patch. Pixels beyond the orthoimagery are filled with zeros.
+
+    """
+    window = from_bounds(*patch_bounds, transform=src_orthoimagery.transform)
+    window = Window(round(window.col_off), round(window.row_off), num_pixels, num_pixels)
+    return src_orthoimagery.read(window=window, boundless=True, fill_value=0)
+
+
+class DatasetReadersCache:
+    """LRU cache of open rasterio datasets, so that a worker opens each raster once instead of once per patch.
+
+    Opening a VRT over many JP2 files parses the VRT and the headers of its sources. Datasets are not shared between processes:
+    those inherited from a parent process (e.g. before mpire forks its workers) are discarded without being closed.
+
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._pid = os.getpid()
+        self._datasets: OrderedDict = OrderedDict()
+
+    def open(self, path) -> DatasetReader:
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._datasets = OrderedDict()
+        path = str(path)
+        if path in self._datasets:
+            self._datasets.move_to_end(path)
+            return self._datasets[path]
+        self._datasets[path] = rasterio.open(path)
+        if len(self._datasets) > self.maxsize:
+            _, least_recently_used = self._datasets.popitem(last=False)
+            least_recently_used.close()
+        return self._datasets[path]
+
+    def discard(self, paths: Iterable) -> None:
+        """Closes datasets that will not be read anymore (e.g. temporary files)."""
+        for path in paths:
+            dataset = self._datasets.pop(str(path), None)
+            if dataset is not None:
+                dataset.close()
+
+
+DATASET_READERS_CACHE = DatasetReadersCache(maxsize=DATASET_READERS_CACHE_SIZE)
 
 
 def collate_rgbnir_and_save(meta, rgb_arr: np.ndarray, irc_arr: np.ndarray, tiff_patch_path: Path):
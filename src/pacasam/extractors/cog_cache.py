@@ -0,0 +1,187 @@
+"""
+Local cache of orthoimagery sources as Cloud-Optimized GeoTIFFs (COG).
+
+BD Ortho sources are JPEG2000 files on a network mount, often referenced through VRTs. Decoding JPEG2000 is the largest cost
+of orthoimagery extraction, and the same source files are read for many patches. Before extraction, sources referenced by
+the sampling are transcoded once, in parallel, to tiled and losslessly compressed COGs on a local disk:
+    - a raster file (e.g. a jp2) is replaced by its COG;
+    - a VRT is replaced by a local copy of the VRT, whose sources that overlap patches of the sampling point to their COGs.
+
+The cache is shared by successive extractions and capped in size: least recently used COGs are evicted first.
+
+"""
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple
+import xml.etree.ElementTree as ET
+import numpy as np
+import rasterio
+import rasterio.shutil
+from geopandas import GeoDataFrame
+from mpire import WorkerPool
+
+from pacasam.connectors.bbox import get_bounds
+
+COG_SUFFIX = ".tif"
+VRT_SUFFIX = ".vrt"
+COG_CREATION_OPTIONS = {"compress": "DEFLATE", "predictor": 2, "blocksize": 512}  # lossless: pixels are identical to the sources.
+BYTES_IN_A_GB = 1024**3
+DEFAULT_COG_CACHE_MAX_SIZE_GB = 100
+
+
+class COGCache:
+    """Directory of COGs, each identified by the path, size and modification time of its source."""
+
+    def __init__(self, cache_dir: Path, max_size_gb: float = DEFAULT_COG_CACHE_MAX_SIZE_GB, log: Optional[logging.Logger] = None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_gb * BYTES_IN_A_GB
+        self.log = log
+
+    def cog_path(self, source: str) -> Path:
+        return self.cache_dir / f"{Path(source).stem}-{source_key(source)}{COG_SUFFIX}"
+
+    def vrt_path(self, vrt: str) -> Path:
+        return self.cache_dir / f"{Path(vrt).stem}-{source_key(vrt)}{VRT_SUFFIX}"
+
+    def transcode(self, source: str) -> Path:
+        """Transcodes the source to a COG, unless it is already cached. Atomic: a COG in the cache is always complete."""
+        cog_path = self.cog_path(source)
+        if cog_path.exists():
+            os.utime(cog_path)  # marks the COG as recently used
+            return cog_path
+        with tempfile.NamedTemporaryFile(suffix=COG_SUFFIX, prefix=f".{cog_path.stem}-", dir=self.cache_dir, delete=False) as tmp_file:
+            tmp_path = Path(tmp_file.name)
+        try:
+            rasterio.shutil.copy(source, tmp_path, driver="COG", **COG_CREATION_OPTIONS)
+            os.replace(tmp_path, cog_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return cog_path
+
+    def evict(self, keep: Iterable[Path] = ()) -> None:
+        """Deletes the least recently used COGs until the cache fits its maximal size. COGs in keep are not deleted."""
+        cache_size = evict_least_recently_used(self.cache_dir.glob(f"*{COG_SUFFIX}"), self.max_size_bytes, keep=keep)
+        if cache_size > self.max_size_bytes and self.log is not None:
+            self.log.warning(f"COG cache {self.cache_dir} exceeds its maximal size: the sampling needs {cache_size / BYTES_IN_A_GB:.1f}GB.")
+
+
+def evict_least_recently_used(files: Iterable[Path], max_size_bytes: float, keep: Iterable[Path] = ()) -> int:
+    """Deletes the least recently used (i.e. modified) files until their total size fits max_size_bytes. Returns their total size.
+
+    Hidden files (temporary files being written) and files in keep are not deleted. Files may be deleted concurrently by other
+    processes sharing the cache.
+
+    """
+    keep = {Path(p) for p in keep}
+    files_stats = []
+    for file in files:
+        if file.name.startswith("."):
+            continue
+        try:
+            files_stats.append((file, file.stat()))
+        except FileNotFoundError:
+            continue
+    files_stats.sort(key=lambda file_stat: file_stat[1].st_mtime)
+    cache_size = sum(stat.st_size for _, stat in files_stats)
+    for file, stat in files_stats:
+        if cache_size <= max_size_bytes:
+            break
+        if file in keep:
+            continue
+        cache_size -= stat.st_size
+        file.unlink(missing_ok=True)
+    return cache_size
+
+
+def source_key(source: str) -> str:
+    """Identifies a source by its path, size and modification time, so that a modified source is transcoded again."""
+    stat = os.stat(source)
+    return hashlib.sha1(f"{Path(source).resolve()}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+
+
+def stage_orthoimagery_sources(sampling: GeoDataFrame, columns: List[str], cache: COGCache, num_jobs: int = 1) -> GeoDataFrame:
+    """Transcodes the orthoimagery sources of the sampling to the COG cache, and points the sampling to the cached files."""
+    sources = {source for col in columns for source in sampling[col].dropna().unique()}
+    # Raster files to transcode: the sources themselves, or the sources of VRTs that overlap patches.
+    files_to_transcode = {}
+    for source in sorted(sources):
+        if Path(source).suffix.lower() == VRT_SUFFIX:
+            uses_vrt = np.logical_or.reduce([sampling[col] == source for col in columns])
+            vrt_sources = list_vrt_sources_overlapping_patches(source, get_bounds(sampling[uses_vrt]))
+            files_to_transcode.update({vrt_source: None for vrt_source in vrt_sources})
+        else:
+            files_to_transcode[source] = None
+    files_to_transcode = list(files_to_transcode)
+
+    cache.evict(keep=[cache.cog_path(f) for f in files_to_transcode])
+    with WorkerPool(n_jobs=num_jobs) as pool:
+        cogs = pool.map(cache.transcode, files_to_transcode, progress_bar=True)
+    cog_of_file = dict(zip(files_to_transcode, [str(cog) for cog in cogs]))
+    cache.evict(keep=cogs)
+
+    staged_source = {}
+    for source in sources:
+        if Path(source).suffix.lower() == VRT_SUFFIX:
+            staged_source[source] = str(write_vrt_with_cogs(source, cog_of_file, cache.vrt_path(source)))
+        else:
+            staged_source[source] = cog_of_file[source]
+    sampling = sampling.copy()
+    for col in columns:
+        sampling[col] = sampling[col].map(staged_source, na_action="ignore")
+    return sampling
+
+
+def list_vrt_sources_overlapping_patches(vrt: str, patch_bounds: np.ndarray) -> List[str]:
+    """Absolute paths of the sources of a VRT that overlap at least one of the patches (array of [xmin, ymin, xmax, ymax])."""
+    return [source for source, source_bounds in read_vrt_sources(vrt) if overlaps_any(source_bounds, patch_bounds)]
+
+
+def read_vrt_sources(vrt: str) -> List[Tuple[str, Tuple[float, float, float, float]]]:
+    """Absolute path and bounds (xmin, ymin, xmax, ymax) of each source of each band of a VRT, from their destination windows."""
+    root = ET.parse(vrt).getroot()
+    geotransform = [float(v) for v in root.find("GeoTransform").text.split(",")]
+    sources = []
+    for source_element in root.iter():
+        source_filename, dst_rect = source_element.find("SourceFilename"), source_element.find("DstRect")
+        if source_filename is None or dst_rect is None:
+            continue
+        x_off, y_off, x_size, y_size = (float(dst_rect.get(k)) for k in ["xOff", "yOff", "xSize", "ySize"])
+        x0, y0 = geotransform[0] + x_off * geotransform[1], geotransform[3] + y_off * geotransform[5]
+        x1, y1 = x0 + x_size * geotransform[1], y0 + y_size * geotransform[5]
+        sources.append((resolve_vrt_source(vrt, source_filename), (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))))
+    return sources
+
+
+def resolve_vrt_source(vrt: str, source_filename: ET.Element) -> str:
+    if source_filename.get("relativeToVRT") == "1":
+        return str((Path(vrt).parent / source_filename.text).resolve())
+    return source_filename.text
+
+
+def overlaps_any(bounds: Tuple[float, float, float, float], patch_bounds: np.ndarray) -> bool:
+    xmin, ymin, xmax, ymax = bounds
+    return bool(((patch_bounds[:, 0] < xmax) & (patch_bounds[:, 2] > xmin) & (patch_bounds[:, 1] < ymax) & (patch_bounds[:, 3] > ymin)).any())
+
+
+def write_vrt_with_cogs(vrt: str, cog_of_file: Dict[str, str], vrt_path: Path) -> Path:
+    """Writes a copy of a VRT where sources that were transcoded point to their COGs, and other sources to their absolute paths."""
+    tree = ET.parse(vrt)
+    for source_element in tree.getroot().iter():
+        source_filename = source_element.find("SourceFilename")
+        if source_filename is None:
+            continue
+        source = resolve_vrt_source(vrt, source_filename)
+        source_filename.set("relativeToVRT", "0")
+        source_filename.text = cog_of_file.get(source, source)
+        source_properties = source_element.find("SourceProperties")
+        if source in cog_of_file and source_properties is not None:
+            source_element.remove(source_properties)  # describes the blocks of the original source, not of the COG.
+    with tempfile.NamedTemporaryFile(suffix=VRT_SUFFIX, prefix=f".{vrt_path.stem}-", dir=vrt_path.parent, delete=False) as tmp_file:
+        tree.write(tmp_file.name)
+    os.replace(tmp_file.name, vrt_path)
+    return vrt_path
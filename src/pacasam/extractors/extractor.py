@@ -1,12 +1,28 @@
+from contextlib import contextmanager
 import logging
+import math
 from pathlib import Path
-from typing import Iterable
+import shutil
+from typing import Iterable, List, Optional, Tuple
 from geopandas import GeoDataFrame
 import geopandas as gpd
+from mpire import WorkerPool
+import pandas as pd
+from pandas import DataFrame
 from shapely import Polygon
+from tqdm import tqdm
+
+from pacasam.connectors.bbox import BBOX_COLNAMES, add_bbox_columns
+from pacasam.connectors.connector import PATCH_ID_COLNAME
+from pacasam.extractors.failures import DEFAULT_NUM_RETRIES, FailureLog
+from pacasam.extractors.journal import ExtractionJournal, sha1sum
+from pacasam.extractors.shards import DEFAULT_MAX_SHARD_SIZE_GB, FILES_LAYOUT, OUTPUT_LAYOUTS, SHARDS_LAYOUT, ShardWriters, write_index
+from pacasam.samplers.sampler import SPLIT_COLNAME
 
 
 DEFAULT_SRID_LAMBERT93 = "2154"  # Assume Lambert93 if we cannot infer srid from sampling or data itself
+NUM_CHUNKS_PER_JOB = 4  # Tasks are sent to workers by chunks of contiguous patches (the default of mpire)...
+MAX_CHUNK_SIZE = 1000  # ...of bounded size, so that the progress of large extractions is reported.
 
 
 class Extractor:
@@ -14,29 +30,198 @@ class Extractor:
 
     All extractors support parallelization with mpire.
     All extractors support resuming extraction without duplication of computations: patches are only extracted
-    if they do not yet exist, and extraction operations are atomic at the patch level.
+    if they are not recorded in the journal of the dataset (see pacasam.extractors.journal), and extraction operations
+    are atomic at the patch level.
     """
 
     patch_suffix: str
+    output_layouts = OUTPUT_LAYOUTS
+    # Columns that extract_single_patch reads from the records of patches. Optional columns are kept if in the sampling.
+    patch_record_columns: List[str] = [PATCH_ID_COLNAME, SPLIT_COLNAME] + BBOX_COLNAMES
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        sampling_path: Path,
+        dataset_root_path: Path,
+        num_jobs: int = 1,
+        output_layout: str = FILES_LAYOUT,
+        max_shard_size_gb: float = DEFAULT_MAX_SHARD_SIZE_GB,
+        fault_tolerant: bool = False,
+        num_retries: int = DEFAULT_NUM_RETRIES,
+        num_retry_jobs: int = 1,
+    ):
+        """Initializes the extractor. Always loads the sampling with sanity checks on format.
+
+        output_layout: "files" to save each patch to its own file, or "shards" to stream patches into tar shards of at most
+        max_shard_size_gb per split, with a parquet index (see pacasam.extractors.shards). Defaults to "files".
+        Extractors may support other layouts (see output_layouts).
 
-    def __init__(self, log: logging.Logger, sampling_path: Path, dataset_root_path: Path, num_jobs: int = 1):
-        """Initializes the extractor. Always loads the sampling with sanity checks on format."""
+        fault_tolerant: if True, errors raised by the extraction of a patch (or of a LAZ file) are recorded instead of aborting
+        the extraction, and failed patches are retried num_retries times at the end, by at most num_retry_jobs processes.
+        Patches that still fail are reported in dataset_root_path/failures.parquet (see pacasam.extractors.failures).
+        Defaults to False.
+
+        """
+        if output_layout not in self.output_layouts:
+            raise ValueError(f"Output layout {output_layout} is not supported by {self.__class__.__name__}. Choose from {self.output_layouts}.")
         self.log = log
         self.name: str = self.__class__.__name__
         self.dataset_root_path = dataset_root_path
         self.sampling = load_sampling(sampling_path=sampling_path)
         check_sampling_format(self.sampling)
+        # Bounds of all patches are computed once, and then read directly by extractors.
+        self.sampling = add_bbox_columns(self.sampling)
         self.num_jobs = num_jobs
+        self.journal = ExtractionJournal(dataset_root_path)
+        self.journal.create()
+        # Split directories are created once, instead of once per patch.
+        for split in self.sampling[SPLIT_COLNAME].unique():
+            (self.dataset_root_path / split).mkdir(parents=True, exist_ok=True)
+        self.output_layout = output_layout
+        self.shard_writers = ShardWriters(dataset_root_path, max_shard_size_gb, self.journal) if output_layout == SHARDS_LAYOUT else None
+        self.failure_log = FailureLog(dataset_root_path) if fault_tolerant else None
+        self.num_retries = num_retries
+        self.num_retry_jobs = num_retry_jobs
+        self.failures_report: Optional[Path] = None
 
     def extract(self):
         raise NotImplementedError("Abstract class.")
 
+    def extract_patches(self, sampling: DataFrame) -> None:
+        """Extracts the patches of a sampling, e.g. with a pool of workers. Called by extract_and_retry_failures."""
+        raise NotImplementedError("Abstract class.")
+
+    def extract_and_retry_failures(self, sampling: DataFrame) -> None:
+        """Extracts the patches of the sampling. In fault-tolerant mode, failed patches are then retried, with bounded concurrency.
+
+        Before each retry, the outputs of the main process are completed, so that patches saved before a failure (e.g. other
+        patches of a LAZ file) are in the journal and are not extracted again.
+
+        """
+        if self.failure_log is None:
+            self.extract_patches(sampling)
+            return
+        self.failure_log.reset()
+        self.extract_patches(sampling)
+        num_jobs = self.num_jobs
+        self.num_jobs = min(num_jobs, self.num_retry_jobs)
+        try:
+            for attempt in range(1, self.num_retries + 1):
+                failed_patch_ids = self.failure_log.failures(attempt=self.failure_log.attempt)[PATCH_ID_COLNAME]
+                if failed_patch_ids.empty:
+                    break
+                self.close_writers()
+                patches_to_retry = self.select_patches_to_extract()
+                patches_to_retry = patches_to_retry[patches_to_retry[PATCH_ID_COLNAME].isin(failed_patch_ids)]
+                self.failure_log.attempt = attempt
+                if patches_to_retry.empty:
+                    break
+                if self.log is not None:
+                    self.log.info(f"Retry {attempt}/{self.num_retries} of {len(patches_to_retry)} failed patches.")
+                self.extract_patches(patches_to_retry)
+        finally:
+            self.num_jobs = num_jobs
+        # Patches saved before a failure (e.g. of their LAZ file) are in the journal, and are not reported.
+        self.close_writers()
+        self.failures_report = self.failure_log.write_report(pending_patch_ids=self.select_patches_to_extract()[PATCH_ID_COLNAME])
+        self.log_failures_summary()
+
+    def log_failures_summary(self) -> None:
+        if self.log is None:
+            return
+        if self.failures_report is None:
+            self.log.info("All patches were extracted.")
+            return
+        num_failures = len(pd.read_parquet(self.failures_report))
+        self.log.error(
+            f"{num_failures} patches could not be extracted after {self.num_retries} retries: see {self.failures_report}. "
+            "Run the extraction again to retry them."
+        )
+
+    @contextmanager
+    def isolate_failures(self, patch_infos: List):
+        """In fault-tolerant mode, records the error raised by the extraction of patches instead of raising it."""
+        if self.failure_log is None:
+            yield
+            return
+        try:
+            yield
+        except Exception as error:
+            self.failure_log.record(patch_infos, error)
+            if self.log is not None:
+                self.log.warning(f"Extraction of {len(patch_infos)} patch(es) failed: {error!r}")
+
     def make_new_patch_path(self, patch_id: int, split: str) -> Path:
-        """Get path to save patch data, creating directories if needed."""
-        newdir: Path = self.dataset_root_path / split
-        newdir.mkdir(parents=True, exist_ok=True)
-        patch_path = newdir / f"{split.upper()}-{patch_id}{self.patch_suffix}"
-        return patch_path
+        """Get path to save patch data. Its split directory is created at initialization."""
+        return self.dataset_root_path / split / f"{split.upper()}-{patch_id}{self.patch_suffix}"
+
+    def select_patches_to_extract(self) -> GeoDataFrame:
+        """Patches of the sampling that are not recorded in the journal, i.e. not extracted yet. Does not access the patches themselves."""
+        split = self.sampling[SPLIT_COLNAME].astype(str)
+        # Same paths as make_new_patch_path, relative to the dataset root.
+        patch_paths = split + "/" + split.str.upper() + "-" + self.sampling[PATCH_ID_COLNAME].astype(str) + self.patch_suffix
+        return self.sampling[~patch_paths.isin(self.journal.extracted_patches())]
+
+    def save_patch(self, patch_file: Path, patch_id: int, split: str) -> None:
+        """Saves a patch written to a (temporary) file: copied to its path, or added to the current shard of its split."""
+        patch_path = self.make_new_patch_path(patch_id=patch_id, split=split)
+        if self.shard_writers is not None:
+            self.shard_writers.add(split, patch_id, patch_file, member_name=patch_path.name)
+            return
+        # Size and checksum of the local file: the copy (e.g. on a network share) is not read again.
+        entry = (self.journal.relative_path(patch_path), patch_file.stat().st_size, sha1sum(patch_file))
+        shutil.copy(patch_file, patch_path)
+        self.journal.record_entries([entry])
+
+    def extract_patches_by_chunks(self, sampling: DataFrame) -> None:
+        """Extracts patches one by one (extract_single_patch) in a pool of workers, by chunks of contiguous patches.
+
+        Workers inherit the records of the patches (see make_patch_records) as mpire shared objects, and tasks are the ranges of
+        the chunks: patches are neither converted to pandas Series (iterrows) nor pickled one by one.
+
+        """
+        records = make_patch_records(sampling, self.patch_record_columns)
+        chunks = make_chunks(len(records), self.num_jobs * NUM_CHUNKS_PER_JOB, MAX_CHUNK_SIZE)
+        # The progress bar counts patches: chunks hold up to MAX_CHUNK_SIZE patches.
+        with WorkerPool(n_jobs=self.num_jobs, shared_objects=records) as pool, tqdm(total=len(records), unit="patch") as progress_bar:
+            # mpire also passes the shared objects to worker_exit.
+            for num_patches in pool.imap_unordered(
+                self._extract_chunk, chunks, chunk_size=1, worker_exit=lambda _records: self.close_writers()
+            ):
+                progress_bar.update(num_patches)
+
+    def _extract_chunk(self, records: DataFrame, start: int, stop: int) -> int:
+        """Extracts the patches of a chunk, and returns their number."""
+        for patch_info in records.iloc[start:stop].itertuples(index=False):
+            with self.isolate_failures([patch_info]):
+                self.extract_single_patch(patch_info)
+        return stop - start
+
+    def extract_single_patch(self, patch_info):
+        raise NotImplementedError("Extractors that extract patches by chunks define how to extract a single patch.")
+
+    def close_writers(self) -> None:
+        """Completes the outputs (e.g. shards) of the current process. To be called at the end of each worker, and of the extraction."""
+        if self.shard_writers is not None:
+            self.shard_writers.close()
+
+    def finalize_output(self) -> None:
+        """Completes the outputs of the main process, and gathers the outputs of all processes (e.g. indexes of shards)."""
+        self.close_writers()
+        if self.shard_writers is not None:
+            write_index(self.dataset_root_path)
+
+
+def make_patch_records(sampling: DataFrame, columns: List[str]) -> DataFrame:
+    """Lightweight records of the patches: the given columns (if present) of the sampling, without geometries."""
+    return pd.DataFrame(sampling[[col for col in columns if col in sampling.columns]]).reset_index(drop=True)
+
+
+def make_chunks(num_patches: int, num_chunks: int, max_chunk_size: int) -> List[Tuple[int, int]]:
+    """Ranges (start, stop) of contiguous chunks of patches: at least num_chunks (if enough patches), of at most max_chunk_size."""
+    chunk_size = min(max(1, math.ceil(num_patches / num_chunks)), max_chunk_size)
+    return [(start, min(start + chunk_size, num_patches)) for start in range(0, num_patches, chunk_size)]
 
 
 # READING SAMPLINGS
@@ -0,0 +1,103 @@
+"""
+Failures of a fault-tolerant extraction: errors raised by the extraction of patches (e.g. a flaky network read, a corrupt
+raster, a WMS error after all retries) are recorded instead of aborting the extraction, and failed patches are retried
+at the end of the extraction.
+
+Like the journal (see pacasam.extractors.journal), failures are appended to one log per process, in the hidden directory
+`dataset_root_path/.failures/`, as JSON lines (tracebacks span several lines). Each failure is recorded with the attempt
+during which it happened: 0 for the extraction, then 1, 2... for the retries. Patches that still fail after the last retry are
+reported with their error and traceback in `dataset_root_path/failures.parquet`.
+
+"""
+
+import json
+import os
+from pathlib import Path
+import shutil
+import socket
+import traceback
+from typing import Iterable, Optional
+import numpy as np
+import pandas as pd
+
+from pacasam.connectors.connector import PATCH_ID_COLNAME
+from pacasam.extractors.shards import write_parquet_atomically
+from pacasam.samplers.sampler import SPLIT_COLNAME
+
+FAILURES_DIRNAME = ".failures"
+FAILURES_REPORT_FILENAME = "failures.parquet"
+ATTEMPT_COLNAME = "attempt"
+ERROR_COLNAME = "error"
+TRACEBACK_COLNAME = "traceback"
+FAILURE_COLUMNS = [PATCH_ID_COLNAME, SPLIT_COLNAME, ATTEMPT_COLNAME, ERROR_COLNAME, TRACEBACK_COLNAME]
+DEFAULT_NUM_RETRIES = 2
+
+
+class FailureLog:
+    """Append-only logs of the failures of an extraction, one per process."""
+
+    def __init__(self, dataset_root_path: Path):
+        self.dataset_root_path = Path(dataset_root_path)
+        self.failures_dir = self.dataset_root_path / FAILURES_DIRNAME
+        self.report_path = self.dataset_root_path / FAILURES_REPORT_FILENAME
+        # Set by the main process before each attempt: forked workers inherit it.
+        self.attempt = 0
+
+    def reset(self) -> None:
+        """Deletes the logs of previous extractions, before a new extraction."""
+        shutil.rmtree(self.failures_dir, ignore_errors=True)
+        self.failures_dir.mkdir(parents=True)
+        self.attempt = 0
+
+    def record(self, patch_infos: Iterable, error: Exception) -> None:
+        """Records the error raised by the extraction of patches (rows from itertuples), e.g. all the patches of a LAZ file."""
+        formatted_traceback = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+        lines = [
+            json.dumps(
+                {
+                    PATCH_ID_COLNAME: to_json_value(getattr(patch_info, PATCH_ID_COLNAME)),
+                    SPLIT_COLNAME: str(getattr(patch_info, SPLIT_COLNAME)),
+                    ATTEMPT_COLNAME: self.attempt,
+                    ERROR_COLNAME: repr(error),
+                    TRACEBACK_COLNAME: formatted_traceback,
+                }
+            )
+            for patch_info in patch_infos
+        ]
+        # The log of the current process: after a fork, workers write to their own log.
+        with open(self.failures_dir / f"{socket.gethostname()}-{os.getpid()}.jsonl", "a") as log:
+            log.write("".join(f"{line}\n" for line in lines))
+
+    def failures(self, attempt: Optional[int] = None) -> pd.DataFrame:
+        """Recorded failures, of all attempts or of a single one. Incomplete lines (e.g. interrupted writing) are ignored."""
+        records = []
+        for log in self.failures_dir.glob("*.jsonl"):
+            for line in log.read_text().splitlines():
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        failures = pd.DataFrame(records, columns=FAILURE_COLUMNS)
+        return failures if attempt is None else failures[failures[ATTEMPT_COLNAME] == attempt]
+
+    def write_report(self, pending_patch_ids: Optional[Iterable] = None) -> Optional[Path]:
+        """Reports the patches that failed during the last attempt, then deletes the logs. Returns the report, or None if all succeeded.
+
+        pending_patch_ids: patches that are not extracted yet. A failure recorded for all the patches of a LAZ file also records its
+        patches that were saved before the error: only failures of pending patches are reported.
+
+        """
+        last_failures = self.failures(attempt=self.attempt)
+        if pending_patch_ids is not None:
+            last_failures = last_failures[last_failures[PATCH_ID_COLNAME].isin(pending_patch_ids)]
+        shutil.rmtree(self.failures_dir, ignore_errors=True)
+        if last_failures.empty:
+            self.report_path.unlink(missing_ok=True)
+            return None
+        write_parquet_atomically(last_failures.reset_index(drop=True), self.report_path)
+        return self.report_path
+
+
+def to_json_value(patch_id):
+    """Patch ids as native values: int (e.g. synthetic data) or str (e.g. LiPaC ids, like `0793_6272-000000123`)."""
+    return patch_id.item() if isinstance(patch_id, np.generic) else patch_id
@@ -0,0 +1,89 @@
+"""
+Journal of the patches extracted to a dataset, to resume an interrupted extraction without checking the existence of each patch.
+
+The journal is a hidden directory of the dataset, `dataset_root_path/.journal/`, holding append-only TSV logs: each process
+appends to its own log, so that concurrent processes never write to the same file (appends to a shared file are not atomic on
+network file systems). Each line records a patch that was written to its final path, with its size and checksum:
+
+    {split}/{SPLIT}-{patch_id}{suffix}    {size in bytes}    {sha1 of the patch}
+
+Reading the journal is a single read of a few files, whatever the number of patches. A patch is recorded after it is (atomically)
+written: if a process is interrupted in between, the patch is extracted again at the next run. An incomplete last line (e.g.
+interrupted writing) is ignored.
+
+"""
+
+import csv
+import hashlib
+import os
+from pathlib import Path
+import socket
+from typing import List, Set, Tuple
+import pandas as pd
+
+JOURNAL_DIRNAME = ".journal"
+JOURNAL_SUFFIX = ".tsv"
+JOURNAL_COLUMNS = ["patch", "size", "sha1"]
+UNKNOWN_CHECKSUM = "-"
+# Log of the patches that existed when the journal was created, i.e. that were extracted by versions of pacasam without journal.
+EXISTING_PATCHES_LOG = f"existing{JOURNAL_SUFFIX}"
+
+
+class ExtractionJournal:
+    """Append-only logs of the extracted patches of a dataset, one per process."""
+
+    def __init__(self, dataset_root_path: Path):
+        self.dataset_root_path = Path(dataset_root_path)
+        self.journal_dir = self.dataset_root_path / JOURNAL_DIRNAME
+
+    def record(self, patch_path: Path) -> None:
+        """Records a patch that was written to its final path. The patch is read again to compute its checksum: for patches
+        written from a local file or from memory, prefer record_entries with the size and checksum of the local copy."""
+        patch_path = Path(patch_path)
+        self.record_entries([(self.relative_path(patch_path), patch_path.stat().st_size, sha1sum(patch_path))])
+
+    def relative_path(self, patch_path: Path) -> str:
+        """Path of a patch as recorded in the journal, e.g. `train/TRAIN-42.laz`."""
+        return Path(patch_path).relative_to(self.dataset_root_path).as_posix()
+
+    def record_entries(self, entries: List[Tuple[str, int, str]]) -> None:
+        """Records patches from their relative path, size and checksum (e.g. patches written to a shard, see pacasam.extractors.shards)."""
+        # The log of the current process: after a fork, workers write to their own log.
+        with open(self.journal_dir / f"{socket.gethostname()}-{os.getpid()}{JOURNAL_SUFFIX}", "a") as log:
+            log.write("".join(f"{path}\t{size}\t{checksum}\n" for path, size, checksum in entries))
+
+    def create(self) -> None:
+        """Creates the journal if needed. Patches of a dataset extracted without journal are recorded from a listing of its directories."""
+        if not self.journal_dir.exists():
+            self.record_existing_patches()
+
+    def extracted_patches(self) -> Set[str]:
+        """Paths of the extracted patches, relative to the dataset root, e.g. `train/TRAIN-42.laz`."""
+        logs = [log for log in self.journal_dir.glob(f"*{JOURNAL_SUFFIX}") if log.stat().st_size > 0]
+        if not logs:
+            return set()
+        read_options = {"sep": "\t", "names": JOURNAL_COLUMNS, "dtype": str, "quoting": csv.QUOTE_NONE, "on_bad_lines": "skip"}
+        journal = pd.concat([pd.read_csv(log, **read_options) for log in logs], ignore_index=True)
+        return set(journal.dropna()["patch"])
+
+    def record_existing_patches(self) -> None:
+        """Records the patches in the split directories. Their checksum is unknown: only the size that comes with the listing is recorded."""
+        lines = []
+        if self.dataset_root_path.exists():
+            for split_dir in os.scandir(self.dataset_root_path):
+                if not split_dir.is_dir() or split_dir.name.startswith("."):
+                    continue
+                for entry in os.scandir(split_dir.path):
+                    if entry.is_file() and not entry.name.startswith("."):
+                        lines.append(f"{split_dir.name}/{entry.name}\t{entry.stat().st_size}\t{UNKNOWN_CHECKSUM}\n")
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        if lines:
+            (self.journal_dir / EXISTING_PATCHES_LOG).write_text("".join(lines))
+
+
+def sha1sum(path: Path, block_size: int = 2**20) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            sha1.update(block)
+    return sha1.hexdigest()
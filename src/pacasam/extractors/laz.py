@@ -37,21 +37,41 @@ Read and check the sampling geopackage:
 
 """
 
+import copy
+import hashlib
+import io
 import logging
+import os
 from pathlib import Path
-import shutil
 import tempfile
-from typing import Optional, Union
+import time
+from contextlib import ExitStack
+from typing import Generator, List, Optional, Tuple, Union
 import warnings
 import laspy
 from laspy import LasData, LasHeader
-import pdal
+import numpy as np
 from pdaltools.color import color
 from geopandas import GeoDataFrame
 from mpire import WorkerPool
-from pacasam.connectors.connector import GEOMETRY_COLNAME, PATCH_ID_COLNAME, SRID_COLNAME
-from pacasam.extractors.bd_ortho_vintage import BDORTHO_PIXELS_PER_METER, IRC_COLNAME, RGB_COLNAME, extract_rgbnir_patch_as_tmp_file
-from pacasam.extractors.extractor import Extractor, check_all_files_exist
+from rasterio import Affine
+from pacasam.connectors.bbox import get_patch_bounds
+from pacasam.connectors.connector import PATCH_ID_COLNAME, SRID_COLNAME
+from pacasam.extractors.bd_ortho_vintage import (
+    BDORTHO_PIXELS_PER_METER,
+    DATASET_READERS_CACHE,
+    IRC_COLNAME,
+    RGB_COLNAME,
+    extract_rgbnir_patch_as_arrays,
+)
+from pacasam.extractors.cog_cache import DEFAULT_COG_CACHE_MAX_SIZE_GB, COGCache, stage_orthoimagery_sources
+from pacasam.extractors.bd_ortho_today import BDOrthoTodayExtractor, download_rgb_and_irc_orthoimages
+from pacasam.extractors.scheduling import log_worker_utilization, schedule_tasks
+from pacasam.extractors.point_arrays import POINT_ARRAYS_LAYOUT, PointArraysWriters, gather_point_arrays
+from pacasam.extractors.failures import DEFAULT_NUM_RETRIES
+from pacasam.extractors.shards import DEFAULT_MAX_SHARD_SIZE_GB, FILES_LAYOUT, OUTPUT_LAYOUTS
+from pacasam.extractors.wms_cache import DEFAULT_WMS_CACHE_MAX_SIZE_GB, WMSImageCache
+from pacasam.extractors.extractor import DEFAULT_SRID_LAMBERT93, Extractor, check_all_files_exist
 from pacasam.samplers.sampler import SPLIT_COLNAME
 
 FILE_PATH_COLNAME = "file_path"  # path to LAZ for extraction e.g. "/path/to/file.LAZ"
@@ -61,94 +81,481 @@ FILE_PATH_COLNAME = "file_path"  # path to LAZ for extraction e.g. "/path/to/fil
 # which defaults to EPSG:9001 ("World") when pdaltools tries to infer the projection from the LAZ file.
 EMPTY_STRING_TO_TELL_PDALTOOLS_TO_INFER_PROJ_FROM_LAZ_FILE = ""
 
+# Colorization from orthoimagery files: 8-bit bands of the I-R-G-B image, scaled to 16-bit LAS colors.
+COLORIZATION_BANDS = [("nir", "Infrared"), ("red", "Red"), ("green", "Green"), ("blue", "Blue")]
+COLORIZATION_SCALE = 256.0
+COLORIZED_POINT_FORMAT_ID = 8  # LAS 1.4 with RGB and NIR
+
+COPC_VLR_USER_ID = "copc"  # user id of the VLR and EVLR that hold the COPC info and octree hierarchy.
+
+# From this number of patches in a file, points are indexed once instead of scanning the whole cloud for each patch.
+# Building the index costs about as much as a few scans.
+MIN_NUM_PATCHES_FOR_POINT_INDEX = 8
+POINT_INDEX_CELL_SIZE = 50  # meters, i.e. the usual patch width.
+# Reads of the points within bounds (e.g. by sub-tasks of heavy files), by chunks of this number of points.
+BOUNDED_READ_CHUNK_SIZE = 2_000_000
+# Streaming: patches written at once during a pass over a file (each holds a writer and a temporary file open).
+MAX_NUM_STREAMING_WRITERS = 256
+
 
 class LAZExtractor(Extractor):
     """Extract a dataset of LAZ data patches."""
 
     patch_suffix: str = ".laz"
+    output_layouts = OUTPUT_LAYOUTS + [POINT_ARRAYS_LAYOUT]
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        sampling_path: Path,
+        dataset_root_path: Path,
+        num_jobs: int = 1,
+        streaming_chunk_size: Optional[int] = None,
+        batch_wms_requests: bool = False,
+        cog_cache_dir: Optional[Path] = None,
+        cog_cache_max_size_gb: float = DEFAULT_COG_CACHE_MAX_SIZE_GB,
+        wms_cache_dir: Optional[Path] = None,
+        wms_cache_max_size_gb: float = DEFAULT_WMS_CACHE_MAX_SIZE_GB,
+        output_layout: str = FILES_LAYOUT,
+        max_shard_size_gb: float = DEFAULT_MAX_SHARD_SIZE_GB,
+        fault_tolerant: bool = False,
+        num_retries: int = DEFAULT_NUM_RETRIES,
+        num_retry_jobs: int = 1,
+    ):
+        """Initialization.
+
+        streaming_chunk_size: if given, files are read by chunks of this number of points instead of all at once,
+        so that memory usage is bounded by the chunk size instead of the file size. Defaults to None.
 
-    def __init__(self, log: logging.Logger, sampling_path: Path, dataset_root_path: Path, num_jobs: int = 1):
-        super().__init__(log, sampling_path, dataset_root_path, num_jobs=num_jobs)
+        batch_wms_requests: for colorization from the Géoplateforme WMS, request the orthoimages once per file, over the union
+        of the bounds of its patches, instead of once per patch. Defaults to False.
+
+        cog_cache_dir: if given, orthoimagery files are transcoded to Cloud-Optimized GeoTIFFs in this (local) directory
+        before extraction, and read from there (see pacasam.extractors.cog_cache). Defaults to None.
+
+        wms_cache_dir: if given, orthoimages for colorization from the Géoplateforme WMS are read from and saved to this (local)
+        directory, shared by successive extractions (see pacasam.extractors.wms_cache), and patches are colorized from them
+        in memory. Defaults to None.
+
+        output_layout: in addition to the layouts of all extractors, "npy" saves the points of each split as contiguous
+        arrays that can be memory-mapped (see pacasam.extractors.point_arrays). Defaults to "files".
+
+        """
+        super().__init__(
+            log,
+            sampling_path,
+            dataset_root_path,
+            num_jobs=num_jobs,
+            output_layout=output_layout,
+            max_shard_size_gb=max_shard_size_gb,
+            fault_tolerant=fault_tolerant,
+            num_retries=num_retries,
+            num_retry_jobs=num_retry_jobs,
+        )
+        self.streaming_chunk_size = streaming_chunk_size
+        self.batch_wms_requests = batch_wms_requests
+        self.cog_cache = COGCache(cog_cache_dir, cog_cache_max_size_gb, log=log) if cog_cache_dir else None
+        self.wms_cache = WMSImageCache(wms_cache_dir, wms_cache_max_size_gb, log=log) if wms_cache_dir else None
+        self.point_array_writers = (
+            PointArraysWriters(dataset_root_path, self.journal, self.patch_suffix) if output_layout == POINT_ARRAYS_LAYOUT else None
+        )
         unique_file_paths = self.sampling[FILE_PATH_COLNAME].unique()
         check_all_files_exist(unique_file_paths)
         if RGB_COLNAME not in self.sampling or IRC_COLNAME not in self.sampling:
-            warnings.warns(
+            warnings.warn(
                 "Colorization of point cloud will use the Géoplateforme orthoimagery WMS. "
-                "To colorize from files, sampling must contain columns {RGB_COLNAME} and {IRC_COLNAME}"
+                f"To colorize from files, sampling must contain columns {RGB_COLNAME} and {IRC_COLNAME}"
             )
 
     def extract(self) -> None:
         """Performs extraction and colorization to a laz dataset.
 
-        Uses pandas groupby to handle both single-file and multiple-file samplings.
+        Uses pandas groupby to handle both single-file and multiple-file samplings. Tasks (the patches of a file) are submitted
+        longest first, and the heaviest files are split into sub-tasks (see pacasam.extractors.scheduling).
 
         """
+        if self.cog_cache is not None and RGB_COLNAME in self.sampling and IRC_COLNAME in self.sampling:
+            self.sampling = stage_orthoimagery_sources(self.sampling, [RGB_COLNAME, IRC_COLNAME], self.cog_cache, num_jobs=self.num_jobs)
+        if self.wms_cache is not None:
+            self.wms_cache.evict()
+        self.extract_and_retry_failures(self.select_patches_to_extract())
+        self.finalize_output()
+        if self.wms_cache is not None:
+            self.wms_cache.evict()
+
+    def extract_patches(self, sampling) -> None:
         # mpire does argument unpacking, see https://github.com/sybrenjansen/mpire/issues/29#issuecomment-984559662.
-        iterable_of_args = [
-            (single_file_path, single_file_sampling) for single_file_path, single_file_sampling in self.sampling.groupby(FILE_PATH_COLNAME)
-        ]
+        iterable_of_args = schedule_tasks(list(sampling.groupby(FILE_PATH_COLNAME)), self.num_jobs)
+        start = time.perf_counter()
         with WorkerPool(n_jobs=self.num_jobs) as pool:
-            pool.map(self._extract_from_single_file, iterable_of_args, progress_bar=True)
-
-    def _extract_from_single_file(self, single_file_path: Path, single_file_sampling: GeoDataFrame):
-        """Extract all patches from a single file based on its sampling."""
-        cloud = None
-        for patch_info in single_file_sampling.itertuples():
-            patch_geometry = getattr(patch_info, GEOMETRY_COLNAME)
-            patch_bounds = patch_geometry.bounds
-            patch_id = getattr(patch_info, PATCH_ID_COLNAME)
-            split = getattr(patch_info, SPLIT_COLNAME)
-            colorized_patch: Path = self.make_new_patch_path(patch_id=patch_id, split=split)
-
-            if colorized_patch.exists():
-                continue
-
-            if not cloud:
-                cloud = laspy.read(single_file_path)
-            tmp_laz: tempfile._TemporaryFileWrapper = extract_single_patch_from_LasData(cloud, cloud.header, patch_bounds)
-
-            # Use given srid if possible, else pdaltools will infer it from the LAZ file.
-            srid = getattr(patch_info, SRID_COLNAME, None)
-            rgb_file = getattr(patch_info, RGB_COLNAME, None)
-            irc_file = getattr(patch_info, IRC_COLNAME, None)
-            if rgb_file and irc_file:
-                # colorize from orthoimagery files
-                tmp_rgbnir = extract_rgbnir_patch_as_tmp_file(rgb_file, irc_file, BDORTHO_PIXELS_PER_METER, patch_geometry)
-                pipeline = pdal.Reader.las(filename=tmp_laz.name)
-                pipeline |= pdal.Filter.colorization(
-                    raster=tmp_rgbnir.name, dimensions="Infrared:1:256.0, Red:2:256.0, Green:3:256.0, Blue:4:256.0"
+            # Tasks are sent one by one, in order: workers that are done with short tasks take the next ones.
+            task_timings = pool.map(self._run_task, iterable_of_args, progress_bar=True, chunk_size=1, worker_exit=self.close_writers)
+        num_subtasks = sum(is_subtask for _, _, is_subtask in iterable_of_args)
+        log_worker_utilization(self.log, task_timings, time.perf_counter() - start, self.num_jobs, num_subtasks)
+
+    def _run_task(self, single_file_path: Path, single_file_sampling: GeoDataFrame, is_subtask: bool) -> Tuple[int, float]:
+        """Extracts the patches of a task, and returns the pid of the worker and the duration of the task."""
+        start = time.perf_counter()
+        with self.isolate_failures(list(single_file_sampling.itertuples())):
+            self._extract_from_single_file(single_file_path, single_file_sampling, is_subtask=is_subtask)
+        return os.getpid(), time.perf_counter() - start
+
+    def _extract_from_single_file(self, single_file_path: Path, single_file_sampling: GeoDataFrame, is_subtask: bool = False):
+        """Extract all patches from a single file based on its sampling.
+
+        is_subtask: the sampling is part of the patches of the file, run concurrently with its other sub-tasks: only the points of
+        the area of its patches are kept in memory while decoding the file.
+
+        """
+        patches_to_extract = list(single_file_sampling.itertuples())
+        all_patch_bounds = [get_patch_bounds(patch_info) for patch_info in patches_to_extract]
+        # Patches are kept in memory (LasData) when possible, and in temporary files when streaming.
+        if is_copc(single_file_path):
+            patches = crop_patches_from_copc(single_file_path, all_patch_bounds)
+        elif self.streaming_chunk_size is None:
+            patches = crop_patches_from_cloud(single_file_path, all_patch_bounds, within_union_of_bounds=is_subtask)
+        else:
+            patches = extract_patches_by_streaming(single_file_path, all_patch_bounds, self.streaming_chunk_size)
+        with tempfile.TemporaryDirectory(prefix="wms_orthoimages_") as tmp_dir:
+            wms_orthoimages = None
+            patches_to_colorize_from_wms = [patch_info for patch_info in patches_to_extract if not has_orthoimagery_files(patch_info)]
+            if self.batch_wms_requests and patches_to_colorize_from_wms:
+                wms_orthoimages = download_orthoimages_for_patches(
+                    single_file_path, patches_to_colorize_from_wms, Path(tmp_dir), self.wms_cache
                 )
-                pipeline |= pdal.Writer.las(filename=tmp_laz.name, extra_dims="all", minor_version="4", dataformat_id="8", forward="all")
-                pipeline.execute()
+            try:
+                for patch_info, patch in zip(patches_to_extract, patches):
+                    if wms_orthoimages is None and self.wms_cache is not None and not has_orthoimagery_files(patch_info):
+                        # Orthoimages of the patch, which extractions of the same patches (e.g. by BDOrthoTodayExtractor) share.
+                        patch_orthoimages = download_orthoimages_for_patches(single_file_path, [patch_info], Path(tmp_dir), self.wms_cache)
+                        try:
+                            self._colorize_and_save_patch(patch_info, patch, wms_orthoimages=patch_orthoimages)
+                        finally:
+                            DATASET_READERS_CACHE.discard(patch_orthoimages)
+                        continue
+                    self._colorize_and_save_patch(patch_info, patch, wms_orthoimages=wms_orthoimages)
+            finally:
+                # Readers of the temporary orthoimages must not outlive them, even if a patch failed.
+                if wms_orthoimages is not None:
+                    DATASET_READERS_CACHE.discard(wms_orthoimages)
+
+    def _patch_path(self, patch_info) -> Path:
+        return self.make_new_patch_path(patch_id=getattr(patch_info, PATCH_ID_COLNAME), split=getattr(patch_info, SPLIT_COLNAME))
+
+    def close_writers(self) -> None:
+        super().close_writers()
+        if self.point_array_writers is not None:
+            self.point_array_writers.close()
+
+    def finalize_output(self) -> None:
+        super().finalize_output()
+        if self.point_array_writers is not None:
+            for split in self.sampling[SPLIT_COLNAME].unique():
+                gather_point_arrays(self.dataset_root_path / split)
+
+    def _colorize_and_save_patch(
+        self, patch_info, patch: Union[LasData, tempfile._TemporaryFileWrapper], wms_orthoimages: Optional[Tuple[Path, Path]] = None
+    ):
+        """Colorize an extracted patch and save it to the dataset.
+
+        wms_orthoimages: RGB and IRC orthoimages downloaded for all the patches of the file, used when the patch has no orthoimagery files.
+
+        """
+        colorized_patch: Path = self._patch_path(patch_info)
+        patch_id, split = getattr(patch_info, PATCH_ID_COLNAME), getattr(patch_info, SPLIT_COLNAME)
+        if has_orthoimagery_files(patch_info):
+            rgb_file, irc_file = getattr(patch_info, RGB_COLNAME), getattr(patch_info, IRC_COLNAME)
+        elif wms_orthoimages is not None:
+            rgb_file, irc_file = wms_orthoimages
+        else:
+            rgb_file, irc_file = None, None
+        if rgb_file and irc_file:
+            # colorize from orthoimagery files, in memory: the patch is only written once, to its final path (or to a shard).
+            cloud = patch if isinstance(patch, LasData) else laspy.read(patch.name)
+            rgb_arr, irc_arr, transform, _ = extract_rgbnir_patch_as_arrays(
+                rgb_file, irc_file, BDORTHO_PIXELS_PER_METER, get_patch_bounds(patch_info)
+            )
+            colorized = colorize_from_rgbnir(cloud, rgb_arr, irc_arr, transform)
+            if self.point_array_writers is not None:
+                self.point_array_writers.add(split, patch_id, colorized, get_patch_bounds(patch_info))
+            elif self.shard_writers is not None:
+                with write_patch_to_tmp_file(colorized) as tmp_laz:
+                    self.save_patch(Path(tmp_laz.name), patch_id, split)
             else:
-                # colorize from https://data.geopf.fr/wms-r/
-                # TODO: simplify signature...
-                colorize_single_patch(nocolor_patch=Path(tmp_laz.name), colorized_patch=Path(tmp_laz.name), srid=srid)
-            colorized_patch.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy(tmp_laz.name, colorized_patch)
+                size, checksum = write_las_atomically(colorized, colorized_patch)
+                self.journal.record_entries([(self.journal.relative_path(colorized_patch), size, checksum)])
+            return
+        # colorize from https://data.geopf.fr/wms-r/
+        tmp_laz = write_patch_to_tmp_file(patch) if isinstance(patch, LasData) else patch
+        # Use given srid if possible, else pdaltools will infer it from the LAZ file.
+        srid = getattr(patch_info, SRID_COLNAME, None)
+        # TODO: simplify signature...
+        colorize_single_patch(nocolor_patch=Path(tmp_laz.name), colorized_patch=Path(tmp_laz.name), srid=srid)
+        if self.point_array_writers is not None:
+            self.point_array_writers.add(split, patch_id, laspy.read(tmp_laz.name), get_patch_bounds(patch_info))
+            return
+        self.save_patch(Path(tmp_laz.name), patch_id, split)
+
+
+def has_orthoimagery_files(patch_info) -> bool:
+    return bool(getattr(patch_info, RGB_COLNAME, None) and getattr(patch_info, IRC_COLNAME, None))
+
+
+def download_orthoimages_for_patches(
+    las_path: Path, patches: List, tmp_dir: Path, wms_cache: Optional[WMSImageCache] = None
+) -> Tuple[Path, Path]:
+    """Downloads RGB and IRC orthoimages from the Géoplateforme WMS, once for all the patches of a file (union of their bounds)."""
+    union_bounds = get_union_of_bounds([get_patch_bounds(patch_info) for patch_info in patches])
+    # Use given srid if possible, else infer it from the LAZ file.
+    srid = getattr(patches[0], SRID_COLNAME, None) or infer_srid_from_laz(las_path)
+    rgb_path, irc_path = tmp_dir / "rgb.tiff", tmp_dir / "irc.tiff"
+    download_rgb_and_irc_orthoimages(
+        union_bounds,
+        str(srid),
+        str(rgb_path),
+        str(irc_path),
+        BDOrthoTodayExtractor.pixel_per_meter,
+        BDOrthoTodayExtractor.timeout_second,
+        wms_cache=wms_cache,
+    )
+    return rgb_path, irc_path
+
+
+def infer_srid_from_laz(las_path: Path) -> str:
+    """EPSG code of the LAZ file, or Lambert-93 if it cannot be inferred."""
+    with laspy.open(las_path) as reader:
+        crs = reader.header.parse_crs()
+    epsg = crs.to_epsg() if crs is not None else None
+    return str(epsg) if epsg else DEFAULT_SRID_LAMBERT93
+
+
+def crop_patches_from_cloud(
+    las_path: Path, all_patch_bounds: List[Tuple], within_union_of_bounds: bool = False
+) -> Generator[LasData, None, None]:
+    """Reads the whole cloud once, and yields its patches one by one (uncolorized, in memory).
+
+    within_union_of_bounds: only the points within the union of the bounds of the patches are kept, while reading the cloud
+    by chunks (see read_cloud_within_bounds), e.g. for a sub-task of a heavy file.
+
+    """
+    if within_union_of_bounds:
+        cloud = read_cloud_within_bounds(las_path, get_union_of_bounds(all_patch_bounds))
+    else:
+        cloud = laspy.read(las_path)
+    point_index = PointGridIndex(cloud.x, cloud.y) if len(all_patch_bounds) >= MIN_NUM_PATCHES_FOR_POINT_INDEX else None
+    for patch_bounds in all_patch_bounds:
+        yield crop_single_patch_from_LasData(cloud, cloud.header, patch_bounds, point_index=point_index)
+
+
+def read_cloud_within_bounds(las_path: Path, bounds: Tuple, chunk_size: int = BOUNDED_READ_CHUNK_SIZE) -> LasData:
+    """Reads the points of the cloud within the bounds (included), in their original order, by chunks of points.
 
+    Memory usage is bounded by the points within the bounds (and a chunk), instead of the whole cloud: sub-tasks of a heavy file,
+    run concurrently by several workers, each hold the points of their own area only.
 
-def extract_single_patch_from_LasData(cloud: LasData, header: LasHeader, patch_bounds) -> tempfile._TemporaryFileWrapper:
-    """Extracts data from a single patch from a (laspy.LasData) cloud.
+    """
+    xmin, ymin, xmax, ymax = bounds
+    with laspy.open(las_path) as reader:
+        header = reader.header
+        kept_points = [np.zeros(0, dtype=header.point_format.dtype())]
+        for points in reader.chunk_iterator(chunk_size):
+            x, y = points.x, points.y
+            kept_points.append(points.array[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)])
+    points = laspy.ScaleAwarePointRecord(np.concatenate(kept_points), header.point_format, header.scales, header.offsets)
+    return LasData(header, points=points)
+
+
+def get_union_of_bounds(all_patch_bounds: List[Tuple]) -> Tuple:
+    all_patch_bounds = np.asarray(all_patch_bounds, dtype=np.float64)
+    return (*all_patch_bounds[:, :2].min(axis=0), *all_patch_bounds[:, 2:].max(axis=0))
+
+
+def is_copc(las_path: Path) -> bool:
+    """True if the file is a COPC (Cloud-Optimized Point Cloud), i.e. a LAZ file with a "copc" info VLR. Only reads the header."""
+    with laspy.open(las_path) as reader:
+        return any(vlr.user_id == COPC_VLR_USER_ID for vlr in reader.header.vlrs)
+
+
+def crop_patches_from_copc(las_path: Path, all_patch_bounds: List[Tuple]) -> Generator[LasData, None, None]:
+    """Yields the patches of a COPC file (uncolorized, in memory), decompressing only the octree nodes that overlap each patch.
+
+    Patches hold the same points as with crop_patches_from_cloud, but in the order of the octree nodes.
+
+    """
+    with laspy.CopcReader.open(las_path) as reader:
+        # Patches are plain LAZ files: the COPC info and hierarchy of the source would not describe them.
+        header = copy.deepcopy(reader.header)
+        header.vlrs = [vlr for vlr in header.vlrs if vlr.user_id != COPC_VLR_USER_ID]
+        header.evlrs = [evlr for evlr in (header.evlrs or []) if evlr.user_id != COPC_VLR_USER_ID]
+        for xmin, ymin, xmax, ymax in all_patch_bounds:
+            points = reader.query(bounds=laspy.copc.Bounds(mins=np.array([xmin, ymin]), maxs=np.array([xmax, ymax])))
+            # The query compares coordinates after rounding the bounds to the scale of the file: crop again with exact bounds.
+            yield crop_single_patch_from_LasData(LasData(header, points=points), header, (xmin, ymin, xmax, ymax))
+
+
+def extract_patches_by_streaming(
+    las_path: Path, all_patch_bounds: List[Tuple], chunk_size: int, max_num_writers: int = MAX_NUM_STREAMING_WRITERS
+) -> Generator[tempfile._TemporaryFileWrapper, None, None]:
+    """Reads the cloud by chunks of points, routing each chunk to the writers of the patches it intersects.
+
+    Memory usage is bounded by chunk_size, whatever the size of the cloud. Points of a patch may be anywhere in the file,
+    so a patch is complete only once the whole file is read. Each patch holds a writer and a temporary file open
+    while the file is read: patches are therefore extracted by groups of at most max_num_writers patches, with one pass
+    over the file per group, so that open files stay well under the usual limit of a process (`ulimit -n`, often 1024).
+    Patches hold the same points, in the same order, as with crop_patches_from_cloud.
+
+    """
+    for start in range(0, len(all_patch_bounds), max_num_writers):
+        tmp_lazs = stream_patches_to_tmp_files(las_path, all_patch_bounds[start : start + max_num_writers], chunk_size)
+        # Temporary files of the group are released as they are consumed.
+        while tmp_lazs:
+            yield tmp_lazs.pop(0)
+
+
+def stream_patches_to_tmp_files(las_path: Path, all_patch_bounds: List[Tuple], chunk_size: int) -> List[tempfile._TemporaryFileWrapper]:
+    """Reads the cloud once by chunks of points, and writes the patches to temporary files. See extract_patches_by_streaming."""
+    tmp_lazs = [
+        tempfile.NamedTemporaryFile(suffix=".laz", prefix="extracted_patch_without_color_information") for _ in all_patch_bounds
+    ]
+    with laspy.open(las_path) as reader, ExitStack() as writers_stack:
+        writers = [writers_stack.enter_context(laspy.open(tmp_laz.name, mode="w", header=reader.header)) for tmp_laz in tmp_lazs]
+        for points in reader.chunk_iterator(chunk_size):
+            x, y = points.x, points.y
+            point_index = PointGridIndex(x, y) if len(all_patch_bounds) >= MIN_NUM_PATCHES_FOR_POINT_INDEX else None
+            for writer, (xmin, ymin, xmax, ymax) in zip(writers, all_patch_bounds):
+                if point_index is None:
+                    patch_points = points[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)]
+                else:
+                    patch_points = points[point_index.query((xmin, ymin, xmax, ymax))]
+                if len(patch_points):
+                    writer.write_points(patch_points)
+    return tmp_lazs
+
+
+class PointGridIndex:
+    """Index of the points of a cloud by cells of a regular grid, to crop many patches from the same cloud.
 
-    Save to a tempfile since we will only keep colorized data, not this uncolorized data.
+    Points are sorted once by cell. A patch is then cropped from the few contiguous slices of points
+    of the cells it overlaps, instead of a scan of the whole cloud.
+
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, cell_size: float = POINT_INDEX_CELL_SIZE):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.cell_size = cell_size
+        self.x0 = self.x.min() if len(self.x) else 0.0
+        self.y0 = self.y.min() if len(self.y) else 0.0
+        cell_x, cell_y = self._cells(self.x, self.y)
+        self.num_cells_x = int(cell_x.max()) + 1 if len(cell_x) else 1
+        self.num_cells_y = int(cell_y.max()) + 1 if len(cell_y) else 1
+        num_cells = self.num_cells_x * self.num_cells_y
+        cell_ids = cell_x * self.num_cells_y + cell_y
+        if num_cells <= np.iinfo(np.uint16).max:
+            cell_ids = cell_ids.astype(np.uint16)  # numpy's stable sort of small integers is a (much faster) radix sort.
+        # Stable sort: points keep their original order within each cell.
+        self.order = np.argsort(cell_ids, kind="stable")
+        self.cell_offsets = np.concatenate([[0], np.cumsum(np.bincount(cell_ids, minlength=num_cells))])
+
+    def _cells(self, x, y):
+        cell_x = np.floor((np.asarray(x) - self.x0) / self.cell_size).astype(np.int64)
+        cell_y = np.floor((np.asarray(y) - self.y0) / self.cell_size).astype(np.int64)
+        return cell_x, cell_y
+
+    def query(self, bounds) -> np.ndarray:
+        """Indices of the points within the bounds (included), in their original order."""
+        xmin, ymin, xmax, ymax = bounds
+        (cell_xmin, cell_xmax), (cell_ymin, cell_ymax) = self._cells([xmin, xmax], [ymin, ymax])
+        cell_xmin, cell_ymin = max(cell_xmin, 0), max(cell_ymin, 0)
+        cell_xmax, cell_ymax = min(cell_xmax, self.num_cells_x - 1), min(cell_ymax, self.num_cells_y - 1)
+        if cell_xmin > cell_xmax or cell_ymin > cell_ymax:
+            return np.array([], dtype=np.int64)
+        # Cells of a same column of the grid are contiguous in the sorted points.
+        candidates = np.concatenate(
+            [
+                self.order[self.cell_offsets[cx * self.num_cells_y + cell_ymin] : self.cell_offsets[cx * self.num_cells_y + cell_ymax + 1]]
+                for cx in range(cell_xmin, cell_xmax + 1)
+            ]
+        )
+        x, y = self.x[candidates], self.y[candidates]
+        candidates = candidates[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)]
+        return np.sort(candidates)
 
-    Nota: using laspy and min/max conditions might not be efficient in case of many patches by file,
-    but it is expected that only a few patches will be selected by file.
-    Alternative could be using a KDTree.
+
+def crop_single_patch_from_LasData(cloud: LasData, header: LasHeader, patch_bounds, point_index: Optional[PointGridIndex] = None) -> LasData:
+    """Crops a single patch from a (laspy.LasData) cloud.
+
+    Points are selected with min/max conditions over the whole cloud, or via a PointGridIndex of the cloud
+    when many patches are extracted from the same cloud.
 
     """
     new_patch_cloud = LasData(header)
     xmin, ymin, xmax, ymax = patch_bounds
-    new_patch_cloud.points = cloud.points[(cloud.x >= xmin) & (cloud.x <= xmax) & (cloud.y >= ymin) & (cloud.y <= ymax)]
+    if point_index is None:
+        new_patch_cloud.points = cloud.points[(cloud.x >= xmin) & (cloud.x <= xmax) & (cloud.y >= ymin) & (cloud.y <= ymax)]
+    else:
+        new_patch_cloud.points = cloud.points[point_index.query(patch_bounds)]
+    return new_patch_cloud
+
 
+def write_patch_to_tmp_file(patch: LasData) -> tempfile._TemporaryFileWrapper:
     patch_tmp_file: tempfile._TemporaryFileWrapper = tempfile.NamedTemporaryFile(
         suffix=".laz", prefix="extracted_patch_without_color_information"
     )
-    new_patch_cloud.write(patch_tmp_file.name)
+    patch.write(patch_tmp_file.name)
     return patch_tmp_file
 
 
+def write_las_atomically(las: LasData, las_path: Path) -> Tuple[int, str]:
+    """Writes to a temporary file next to las_path, then renames it: an interrupted extraction never leaves a partial patch.
+
+    The file is encoded in memory: returns its size and SHA-1, so that it is not read again (e.g. over the network) to journal it.
+
+    """
+    encoded = io.BytesIO()
+    las.write(encoded, do_compress=las_path.suffix.lower() == ".laz")
+    content = encoded.getvalue()
+    with tempfile.NamedTemporaryFile(suffix=".laz", prefix=f".{las_path.stem}-", dir=las_path.parent, delete=False) as tmp_file:
+        tmp_path = Path(tmp_file.name)
+    try:
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, las_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return len(content), hashlib.sha1(content).hexdigest()
+
+
+def colorize_from_rgbnir(cloud: LasData, rgb_arr: np.ndarray, irc_arr: np.ndarray, transform: Affine) -> LasData:
+    """Colorizes a cloud from orthoimages (arrays of shape [bands, rows, cols]), sampled at the locations of the points.
+
+    Equivalent to PDAL's filters.colorization with dimensions "Infrared:1:256.0, Red:2:256.0, Green:3:256.0, Blue:4:256.0"
+    over the I-R-G-B image of the patch, written with point format 8: a point takes the values of the pixel that contains it,
+    and points outside of the image keep their colors. Extra dimensions named like colors (e.g. "Red" in point format 6)
+    are merged into the standard dimensions, as PDAL does.
+
+    """
+    colorized = laspy.convert(cloud, point_format_id=COLORIZED_POINT_FORMAT_ID, file_version="1.4")
+    color_dims = [dim for dim, _ in COLORIZATION_BANDS]
+    colliding_extra_dims = [name for name in colorized.point_format.extra_dimension_names if name.lower() in color_dims]
+    for name in colliding_extra_dims:
+        colorized[name.lower()] = colorized[name]
+    if colliding_extra_dims:
+        colorized.remove_extra_dims(colliding_extra_dims)
+
+    # Same arithmetic as GDAL's inverse geotransform of north-up images (used by PDAL), since many points lie on the edges of pixels.
+    cols = np.floor(-transform.c / transform.a + np.asarray(colorized.x) * (1.0 / transform.a)).astype(np.int64)
+    rows = np.floor(-transform.f / transform.e + np.asarray(colorized.y) * (1.0 / transform.e)).astype(np.int64)
+    num_rows, num_cols = rgb_arr.shape[1:]
+    is_in_image = (cols >= 0) & (cols < num_cols) & (rows >= 0) & (rows < num_rows)
+    cols, rows = cols[is_in_image], rows[is_in_image]
+    bands = {"Infrared": irc_arr[0], "Red": rgb_arr[0], "Green": rgb_arr[1], "Blue": rgb_arr[2]}
+    for dim, band_name in COLORIZATION_BANDS:
+        values = np.array(colorized[dim])
+        values[is_in_image] = bands[band_name][rows, cols].astype(np.float64) * COLORIZATION_SCALE
+        colorized[dim] = values
+    return colorized
+
+
 def colorize_single_patch(nocolor_patch: Union[str, Path], colorized_patch: Union[str, Path], srid: Optional[int] = None) -> None:
     """Colorizes single LAZ patch.
 
@@ -0,0 +1,186 @@
+"""
+Point-array output layout of LAZExtractor: instead of LAZ files, the points of all the patches of a split are saved as
+contiguous arrays (structure of arrays) in .npy files, which data loaders can memory-map and slice without decompression:
+
+dataset_root_path/
+├── train/
+│   ├── points/
+│   │   ├── xyz.npy              float32 (N, 3): coordinates relative to the origin of their patch
+│   │   ├── intensity.npy        uint16 (N,)
+│   │   ├── classification.npy   uint8 (N,)
+│   │   ├── rgbnir.npy           uint16 (N, 4): Red, Green, Blue, Infrared
+│   │   ├── patch_ids.npy        (P,): dtype of the patch ids of the sampling, e.g. int64, or unicode strings for LiPaC
+│   │   ├── origins.npy          float64 (P, 3): (xmin, ymin, 0) of each patch
+│   │   ├── offsets.npy          int64 (P + 1,): points of patch i are [offsets[i], offsets[i + 1])
+├── val/
+│   ├── ...
+
+Usage:
+    xyz = np.load("train/points/xyz.npy", mmap_mode="r")
+    offsets = np.load("train/points/offsets.npy")
+    patch_xyz = xyz[offsets[i] : offsets[i + 1]]  # a view: no copy, no decompression
+
+Coordinates are relative to their patch, since float32 absolute coordinates would lose centimeters in Lambert-93.
+
+During extraction, each process appends the arrays of its patches to raw files in a part of the split (`{split}/.parts/{uid}/`).
+A part is closed when its process ends: its patch index is written, and its patches are recorded in the journal of the dataset.
+At the end of the extraction, closed parts are gathered with the existing arrays of the split into new arrays, and deleted.
+Parts that were not closed (interrupted processes) are deleted: their patches are extracted again when resuming.
+
+"""
+
+import hashlib
+import os
+from pathlib import Path
+import shutil
+from typing import Dict, List
+import uuid
+import numpy as np
+from laspy import LasData
+
+from pacasam.extractors.journal import ExtractionJournal
+
+POINT_ARRAYS_LAYOUT = "npy"
+POINTS_DIRNAME = "points"
+PARTS_DIRNAME = ".parts"
+PART_INDEX_FILENAME = "index.npz"
+# Arrays of points, with their dtype and number of columns.
+POINT_FIELDS = {"xyz": (np.float32, 3), "intensity": (np.uint16, 1), "classification": (np.uint8, 1), "rgbnir": (np.uint16, 4)}
+RGBNIR_DIMENSIONS = ["red", "green", "blue", "nir"]
+
+
+def las_to_point_arrays(las: LasData, origin: np.ndarray) -> Dict[str, np.ndarray]:
+    """Arrays of the points of a (colorized) patch. Coordinates are relative to the origin of the patch."""
+    dimensions = set(las.point_format.dimension_names)
+    rgbnir = [las[dim] if dim in dimensions else np.zeros(len(las.points), dtype=np.uint16) for dim in RGBNIR_DIMENSIONS]
+    return {
+        "xyz": (np.stack([las.x, las.y, las.z], axis=1) - origin).astype(np.float32),
+        "intensity": np.asarray(las.intensity, dtype=np.uint16),
+        "classification": np.asarray(las.classification, dtype=np.uint8),
+        "rgbnir": np.stack([np.asarray(band, dtype=np.uint16) for band in rgbnir], axis=1),
+    }
+
+
+class PointArraysWriter:
+    """Appends the point arrays of patches to a part of a split, in raw files."""
+
+    def __init__(self, dataset_root_path: Path, split: str, journal: ExtractionJournal, patch_suffix: str):
+        self.dataset_root_path = dataset_root_path
+        self.split = split
+        self.journal = journal
+        self.patch_suffix = patch_suffix
+        self.part_dir = dataset_root_path / split / PARTS_DIRNAME / uuid.uuid4().hex[:12]
+        self.part_dir.mkdir(parents=True)
+        self.raw_files = {field: open(self.part_dir / f"{field}.raw", "wb") for field in POINT_FIELDS}
+        self.patch_ids: List = []
+        self.origins: List[np.ndarray] = []
+        self.num_points: List[int] = []
+        self.journal_entries = []
+
+    def add(self, patch_id, las: LasData, patch_bounds) -> None:
+        origin = np.array([patch_bounds[0], patch_bounds[1], 0.0])
+        arrays = las_to_point_arrays(las, origin)
+        checksum = hashlib.sha1()
+        for field, array in arrays.items():
+            data = np.ascontiguousarray(array).tobytes()
+            self.raw_files[field].write(data)
+            checksum.update(data)
+        self.patch_ids.append(patch_id)
+        self.origins.append(origin)
+        self.num_points.append(len(las.points))
+        patch_name = f"{self.split}/{self.split.upper()}-{patch_id}{self.patch_suffix}"
+        self.journal_entries.append((patch_name, sum(array.nbytes for array in arrays.values()), checksum.hexdigest()))
+
+    def close(self) -> None:
+        """Closes the part: writes its patch index (which marks the part as complete), then records its patches in the journal."""
+        for raw_file in self.raw_files.values():
+            raw_file.close()
+        tmp_index = self.part_dir / f".{PART_INDEX_FILENAME}"
+        with open(tmp_index, "wb") as f:
+            np.savez(
+                f,
+                # Patch ids keep the dtype inferred from the sampling (e.g. strings for LiPaC).
+                patch_ids=np.asarray(self.patch_ids),
+                origins=np.array(self.origins).reshape(-1, 3),
+                num_points=np.array(self.num_points, dtype=np.int64),
+            )
+        os.replace(tmp_index, self.part_dir / PART_INDEX_FILENAME)
+        self.journal.record_entries(self.journal_entries)
+
+
+class PointArraysWriters:
+    """Point-array writers of the current process, one per split. Workers forked with a copy of the writers write their own parts."""
+
+    def __init__(self, dataset_root_path: Path, journal: ExtractionJournal, patch_suffix: str):
+        self.dataset_root_path = Path(dataset_root_path)
+        self.journal = journal
+        self.patch_suffix = patch_suffix
+        self.pid = os.getpid()
+        self.writers: Dict[str, PointArraysWriter] = {}
+
+    def add(self, split: str, patch_id, las: LasData, patch_bounds) -> None:
+        if self.pid != os.getpid():
+            self.pid, self.writers = os.getpid(), {}
+        if split not in self.writers:
+            self.writers[split] = PointArraysWriter(self.dataset_root_path, split, self.journal, self.patch_suffix)
+        self.writers[split].add(patch_id, las, patch_bounds)
+
+    def close(self) -> None:
+        if self.pid != os.getpid():
+            return
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+def gather_point_arrays(split_dir: Path) -> None:
+    """Gathers the existing arrays of the split and its closed parts into new arrays, then deletes the parts."""
+    parts_dir = split_dir / PARTS_DIRNAME
+    if not parts_dir.exists():
+        return
+    parts = sorted(p for p in parts_dir.iterdir() if (p / PART_INDEX_FILENAME).exists())
+    points_dir = split_dir / POINTS_DIRNAME
+    sources = []  # (arrays by field, patch_ids, origins, num_points)
+    if (points_dir / "offsets.npy").exists():
+        offsets = np.load(points_dir / "offsets.npy")
+        existing_arrays = {field: np.load(points_dir / f"{field}.npy", mmap_mode="r") for field in POINT_FIELDS}
+        sources.append((existing_arrays, np.load(points_dir / "patch_ids.npy"), np.load(points_dir / "origins.npy"), np.diff(offsets)))
+    for part in parts:
+        with np.load(part / PART_INDEX_FILENAME) as index:
+            patch_ids, origins, num_points = index["patch_ids"], index["origins"], index["num_points"]
+        part_arrays = {field: read_raw_part(part, field, int(num_points.sum())) for field in POINT_FIELDS}
+        sources.append((part_arrays, patch_ids, origins, num_points))
+
+    if parts:
+        total_num_points = int(sum(source[3].sum() for source in sources))
+        tmp_points_dir = split_dir / f".{POINTS_DIRNAME}-{uuid.uuid4().hex[:12]}"
+        tmp_points_dir.mkdir()
+        for field, (dtype, num_columns) in POINT_FIELDS.items():
+            shape = (total_num_points, num_columns) if num_columns > 1 else (total_num_points,)
+            gathered = np.lib.format.open_memmap(tmp_points_dir / f"{field}.npy", mode="w+", dtype=dtype, shape=shape)
+            start = 0
+            for arrays, *_ in sources:
+                gathered[start : start + len(arrays[field])] = arrays[field]
+                start += len(arrays[field])
+            gathered.flush()
+            del gathered
+        np.save(tmp_points_dir / "patch_ids.npy", np.concatenate([source[1] for source in sources]))
+        np.save(tmp_points_dir / "origins.npy", np.concatenate([source[2] for source in sources]).astype(np.float64))
+        num_points = np.concatenate([source[3] for source in sources])
+        np.save(tmp_points_dir / "offsets.npy", np.concatenate([[0], np.cumsum(num_points)]).astype(np.int64))
+        del sources
+        # Replaces the arrays of the split: the previous arrays are gathered in the new ones.
+        if points_dir.exists():
+            old_points_dir = points_dir.rename(split_dir / f".{POINTS_DIRNAME}-old-{uuid.uuid4().hex[:12]}")
+            tmp_points_dir.rename(points_dir)
+            shutil.rmtree(old_points_dir)
+        else:
+            tmp_points_dir.rename(points_dir)
+    # Closed parts are now in the arrays, and parts that were not closed are incomplete.
+    shutil.rmtree(parts_dir)
+
+
+def read_raw_part(part: Path, field: str, num_points: int) -> np.ndarray:
+    dtype, num_columns = POINT_FIELDS[field]
+    array = np.memmap(part / f"{field}.raw", dtype=dtype, mode="r", shape=(num_points * num_columns,)) if num_points else np.empty(0, dtype)
+    return array.reshape(-1, num_columns) if num_columns > 1 else array
@@ -0,0 +1,97 @@
+"""
+Scheduling of the per-file tasks of LAZExtractor over its pool of workers.
+
+A task extracts the patches of a LAZ file, and tasks vary widely in cost: a dense urban tile holding hundreds of selected
+patches can keep a worker busy long after the others are done. Tasks are therefore:
+    - estimated from the size of their file (decompression) and their number of patches (cropping, colorization, writing);
+    - split into sub-tasks when a single file would exceed the mean load of a worker. Sub-tasks of a file are run concurrently
+      by several workers: each one decodes the file, and only keeps the points of the area of its patches in memory (see
+      laz.read_cloud_within_bounds). Sub-tasks are spatially compact strips of the patches of the file, when their bounds are known;
+    - submitted longest first (LPT scheduling), one at a time, so that the shortest tasks fill the end of the extraction.
+
+"""
+
+from collections import defaultdict
+import logging
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from geopandas import GeoDataFrame
+
+from pacasam.connectors.bbox import BBOX_COLNAMES, has_bboxes
+
+# Rough cost of decompressing a LAZ file, in units of the cost of extracting (and colorizing) a single patch.
+DECODING_COST_IN_PATCHES_PER_GB = 20
+BYTES_IN_A_GB = 1024**3
+
+
+def estimate_task_cost(file_size_bytes: int, num_patches: int) -> float:
+    """Cost of a task or sub-task, in units of the cost of extracting a single patch. Every sub-task decodes the whole file."""
+    return file_size_bytes / BYTES_IN_A_GB * DECODING_COST_IN_PATCHES_PER_GB + num_patches
+
+
+def schedule_tasks(file_samplings: List[Tuple[str, GeoDataFrame]], num_jobs: int) -> List[Tuple[str, GeoDataFrame, bool]]:
+    """Splits the heaviest tasks, and sorts tasks by decreasing cost.
+
+    Returns tasks as (file_path, sampling of the task, is_subtask). With a single worker, tasks are only sorted.
+
+    """
+    file_sizes = {file_path: os.path.getsize(file_path) for file_path, _ in file_samplings}
+    costs = [estimate_task_cost(file_sizes[file_path], len(sampling)) for file_path, sampling in file_samplings]
+    target_cost = sum(costs) / num_jobs
+    tasks = []
+    for (file_path, sampling), cost in zip(file_samplings, costs):
+        num_subtasks = num_subtasks_of_heavy_task(len(sampling), cost - len(sampling), target_cost, num_jobs) if cost > target_cost else 1
+        rows = spatial_order(sampling) if num_subtasks > 1 else np.arange(len(sampling))
+        for subtask_rows in np.array_split(rows, num_subtasks):
+            subtask_sampling = sampling.iloc[subtask_rows]
+            subtask_cost = estimate_task_cost(file_sizes[file_path], len(subtask_sampling))
+            tasks.append((subtask_cost, (file_path, subtask_sampling, num_subtasks > 1)))
+    tasks.sort(key=lambda cost_and_task: cost_and_task[0], reverse=True)
+    return [task for _, task in tasks]
+
+
+def num_subtasks_of_heavy_task(num_patches: int, decoding_cost: float, target_cost: float, num_jobs: int) -> int:
+    """Number of sub-tasks so that each one (decoding, then its share of the patches) fits the mean load of a worker, if possible."""
+    patches_cost_per_subtask = target_cost - decoding_cost
+    num_subtasks = math.ceil(num_patches / patches_cost_per_subtask) if patches_cost_per_subtask > 0 else num_jobs
+    return max(1, min(num_subtasks, num_jobs, num_patches))
+
+
+def spatial_order(sampling: GeoDataFrame) -> np.ndarray:
+    """Positions of the patches sorted by xmin then ymin, so that consecutive patches form strips of a compact area.
+
+    Patches keep their order if their bounds are unknown.
+
+    """
+    if not has_bboxes(sampling):
+        return np.arange(len(sampling))
+    return np.lexsort((sampling[BBOX_COLNAMES[1]].to_numpy(), sampling[BBOX_COLNAMES[0]].to_numpy()))
+
+
+def compute_worker_utilization(task_timings: List[Tuple[int, float]], wall_time_second: float, num_jobs: int) -> List[float]:
+    """Fraction of the wall time that each worker spent running tasks, from the (worker pid, duration) of each task.
+
+    Workers that ran no task have an utilization of 0. Utilizations are sorted in decreasing order.
+
+    """
+    busy_time_second: Dict[int, float] = defaultdict(float)
+    for pid, duration_second in task_timings:
+        busy_time_second[pid] += duration_second
+    utilization = sorted((busy / wall_time_second for busy in busy_time_second.values()), reverse=True)
+    return utilization + [0.0] * (num_jobs - len(utilization))
+
+
+def log_worker_utilization(
+    log: Optional[logging.Logger], task_timings: List[Tuple[int, float]], wall_time_second: float, num_jobs: int, num_subtasks: int
+) -> None:
+    if log is None or not task_timings:
+        return
+    utilization = compute_worker_utilization(task_timings, wall_time_second, num_jobs)
+    log.info(
+        f"Extracted {len(task_timings)} tasks ({num_subtasks} sub-tasks of heavy files) in {wall_time_second:.1f}s. "
+        f"Utilization of workers: mean {np.mean(utilization):.0%}, min {min(utilization):.0%}, max {max(utilization):.0%}."
+    )
+    for worker_rank, worker_utilization in enumerate(utilization):
+        log.info(f"Worker {worker_rank}: {worker_utilization:.0%}")
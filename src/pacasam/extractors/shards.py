@@ -0,0 +1,149 @@
+"""
+Sharded output layout: instead of one file per patch, each process streams its patches into tar shards of bounded size, one
+series of shards per split. Shards follow the WebDataset conventions (https://github.com/webdataset/webdataset): a member
+`TRAIN-{patch_id}.laz` is the sample `TRAIN-{patch_id}` with a `laz` field.
+
+dataset_root_path/
+├── train/
+│   ├── TRAIN-shard-{uid}.tar
+│   ├── TRAIN-shard-{uid}.parquet      (index of the shard)
+├── val/
+│   ├── ...
+├── index.parquet                      (index of all shards)
+
+The index maps each patch_id to its shard and to the offset and size of its data in the shard, so that a patch can be read
+with a single seek, without listing the tar. A shard is written to a hidden temporary file, then renamed when full (or at the
+end of the extraction). Only then are its index written and its patches recorded in the journal of the dataset: patches of a
+shard interrupted before completion are extracted again when the extraction is resumed.
+
+"""
+
+import hashlib
+import io
+import os
+from pathlib import Path
+import tarfile
+import tempfile
+from typing import Dict, List, Optional
+import uuid
+import pandas as pd
+
+from pacasam.connectors.connector import PATCH_ID_COLNAME
+from pacasam.extractors.journal import ExtractionJournal
+from pacasam.samplers.sampler import SPLIT_COLNAME
+
+FILES_LAYOUT = "files"
+SHARDS_LAYOUT = "shards"
+OUTPUT_LAYOUTS = [FILES_LAYOUT, SHARDS_LAYOUT]
+DEFAULT_MAX_SHARD_SIZE_GB = 1.0
+SHARD_SUFFIX = ".tar"
+SHARD_INDEX_SUFFIX = ".parquet"
+INDEX_FILENAME = "index.parquet"
+SHARD_COLNAME = "shard"
+MEMBER_COLNAME = "member"
+OFFSET_COLNAME = "offset"
+SIZE_COLNAME = "size"
+CHECKSUM_COLNAME = "sha1"
+INDEX_COLUMNS = [PATCH_ID_COLNAME, SPLIT_COLNAME, SHARD_COLNAME, MEMBER_COLNAME, OFFSET_COLNAME, SIZE_COLNAME, CHECKSUM_COLNAME]
+
+
+class ShardWriter:
+    """Writes the patches of a split to successive tar shards of at most max_shard_size_bytes (or a single patch if larger)."""
+
+    def __init__(self, dataset_root_path: Path, split: str, max_shard_size_bytes: float, journal: ExtractionJournal):
+        self.dataset_root_path = dataset_root_path
+        self.split = split
+        self.max_shard_size_bytes = max_shard_size_bytes
+        self.journal = journal
+        self.tar: Optional[tarfile.TarFile] = None
+        self.tmp_shard_path: Optional[Path] = None
+        self.entries: List[Dict] = []
+
+    def add(self, patch_id, patch_file: Path, member_name: str) -> None:
+        if self.tar is None:
+            self.open()
+        data = Path(patch_file).read_bytes()
+        info = tarfile.TarInfo(member_name)
+        info.size = len(data)
+        info.mtime = os.stat(patch_file).st_mtime
+        # The data of the member starts right after its header.
+        offset_data = self.tar.offset + len(info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors))
+        self.tar.addfile(info, io.BytesIO(data))
+        entry = {PATCH_ID_COLNAME: patch_id, MEMBER_COLNAME: member_name, OFFSET_COLNAME: offset_data, SIZE_COLNAME: info.size}
+        self.entries.append({**entry, CHECKSUM_COLNAME: hashlib.sha1(data).hexdigest()})
+        if self.tar.offset >= self.max_shard_size_bytes:
+            self.close()
+
+    def open(self) -> None:
+        shard_name = f"{self.split.upper()}-shard-{uuid.uuid4().hex[:12]}"
+        self.tmp_shard_path = self.dataset_root_path / self.split / f".{shard_name}{SHARD_SUFFIX}"
+        self.tar = tarfile.open(self.tmp_shard_path, "w", format=tarfile.USTAR_FORMAT)
+
+    def close(self) -> None:
+        """Completes the current shard: renames it, writes its index, and records its patches in the journal."""
+        if self.tar is None:
+            return
+        self.tar.close()
+        shard_path = self.tmp_shard_path.with_name(self.tmp_shard_path.name[1:])
+        os.replace(self.tmp_shard_path, shard_path)
+        index = pd.DataFrame(self.entries)
+        index[SPLIT_COLNAME] = self.split
+        index[SHARD_COLNAME] = shard_path.relative_to(self.dataset_root_path).as_posix()
+        write_parquet_atomically(index[INDEX_COLUMNS], shard_path.with_suffix(SHARD_INDEX_SUFFIX))
+        self.journal.record_entries([(f"{self.split}/{e[MEMBER_COLNAME]}", e[SIZE_COLNAME], e[CHECKSUM_COLNAME]) for e in self.entries])
+        self.tar, self.tmp_shard_path, self.entries = None, None, []
+
+
+class ShardWriters:
+    """Shard writers of the current process, one per split.
+
+    Workers forked with a copy of the writers start their own shards: shards are never shared by processes.
+
+    """
+
+    def __init__(self, dataset_root_path: Path, max_shard_size_gb: float, journal: ExtractionJournal):
+        self.dataset_root_path = Path(dataset_root_path)
+        self.max_shard_size_bytes = max_shard_size_gb * 1024**3
+        self.journal = journal
+        self.pid = os.getpid()
+        self.writers: Dict[str, ShardWriter] = {}
+
+    def add(self, split: str, patch_id, patch_file: Path, member_name: str) -> None:
+        if self.pid != os.getpid():
+            self.pid, self.writers = os.getpid(), {}
+        if split not in self.writers:
+            self.writers[split] = ShardWriter(self.dataset_root_path, split, self.max_shard_size_bytes, self.journal)
+        self.writers[split].add(patch_id, patch_file, member_name)
+
+    def close(self) -> None:
+        if self.pid != os.getpid():
+            return
+        for writer in self.writers.values():
+            writer.close()
+
+
+def write_index(dataset_root_path: Path) -> Optional[Path]:
+    """Gathers the indexes of all the shards of the dataset into a single index. Returns its path, or None if there are no shards."""
+    shard_indexes = sorted(p for p in Path(dataset_root_path).glob(f"*/*-shard-*{SHARD_INDEX_SUFFIX}") if not p.name.startswith("."))
+    if not shard_indexes:
+        return None
+    index_path = Path(dataset_root_path) / INDEX_FILENAME
+    write_parquet_atomically(pd.concat([pd.read_parquet(p) for p in shard_indexes], ignore_index=True), index_path)
+    return index_path
+
+
+def read_patch_from_shard(dataset_root_path: Path, index_row) -> bytes:
+    """Reads the data of a patch (a row of the index) from its shard, with a single seek."""
+    with open(Path(dataset_root_path) / getattr(index_row, SHARD_COLNAME), "rb") as shard:
+        shard.seek(getattr(index_row, OFFSET_COLNAME))
+        return shard.read(getattr(index_row, SIZE_COLNAME))
+
+
+def write_parquet_atomically(df: pd.DataFrame, path: Path) -> None:
+    with tempfile.NamedTemporaryFile(suffix=SHARD_INDEX_SUFFIX, prefix=f".{path.stem}-", dir=path.parent, delete=False) as tmp_file:
+        tmp_path = Path(tmp_file.name)
+    try:
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
@@ -0,0 +1,186 @@
+"""
+Concurrent downloads of orthoimages from a Web Map Service (WMS), by default the Géoplateforme.
+
+Requests are sent by an asyncio event loop, through a single HTTP session whose pool of keep-alive connections is shared by all
+requests. The number of requests in flight is bounded, requests can be rate limited, and failed requests are retried with an
+exponential backoff. When the server signals an overload (HTTP 429 or 503), all requests pause, for the duration given in
+the `Retry-After` header if any. Images can be read from and saved to a local cache (see `pacasam.extractors.wms_cache`).
+
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import email.utils
+import time
+from typing import Dict, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+
+from pacasam.extractors.wms_cache import WMSImageCache
+
+GEOPLATEFORME_WMS_URL = "https://data.geopf.fr/wms-r/wms"
+DEFAULT_MAX_IN_FLIGHT_REQUESTS = 16
+# Same retry policy as the blocking downloads (see bd_ortho_today.download_rgb_and_irc_orthoimages): 7 attempts, every 15s, 30s, ...
+DEFAULT_NUM_RETRIES = 6
+DEFAULT_BACKOFF_SECOND = 15
+DEFAULT_BACKOFF_FACTOR = 2
+OVERLOAD_STATUS_CODES = (429, 503)
+
+
+class WMSRequestError(Exception):
+    """A request that cannot succeed by retrying it (e.g. invalid parameters), or that failed after all retries."""
+
+
+async def gather_or_cancel(*coroutines):
+    """Like asyncio.gather, but cancels the other coroutines as soon as one fails, and waits for them before raising.
+
+    asyncio.TaskGroup does the same, from Python 3.11 on.
+
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def make_getmap_params(layer: str, srid: str, bounds: Tuple[float, float, float, float], pixel_per_meter: float) -> Dict[str, str]:
+    """GetMap parameters for a GeoTIFF image of the bounds. Identical to the requests of pdaltools.color.download_image_from_geoplateforme."""
+    xmin, ymin, xmax, ymax = bounds
+    # Give single-point extents a width/height of at least one pixel to have valid BBOX and SIZE.
+    if xmin == xmax:
+        xmax = xmin + 1 / pixel_per_meter
+    if ymin == ymax:
+        ymax = ymin + 1 / pixel_per_meter
+    return {
+        "LAYERS": layer,
+        "EXCEPTIONS": "text/xml",
+        "FORMAT": "image/geotiff",
+        "SERVICE": "WMS",
+        "VERSION": "1.3.0",
+        "REQUEST": "GetMap",
+        "STYLES": "",
+        "CRS": f"EPSG:{srid}",
+        "BBOX": f"{xmin},{ymin},{xmax},{ymax}",
+        "WIDTH": str(int((xmax - xmin) * pixel_per_meter)),
+        "HEIGHT": str(int((ymax - ymin) * pixel_per_meter)),
+    }
+
+
+class AsyncWMSDownloader:
+    """Downloads WMS images concurrently. To be used as an async context manager, which opens and closes the HTTP session.
+
+    Usage:
+        async with AsyncWMSDownloader(max_in_flight_requests=32) as downloader:
+            await downloader.download(layer, srid, bounds, pixel_per_meter, outfile)
+
+    """
+
+    def __init__(
+        self,
+        url: str = GEOPLATEFORME_WMS_URL,
+        max_in_flight_requests: int = DEFAULT_MAX_IN_FLIGHT_REQUESTS,
+        max_requests_per_second: Optional[float] = None,
+        num_retries: int = DEFAULT_NUM_RETRIES,
+        backoff_second: float = DEFAULT_BACKOFF_SECOND,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        timeout_second: float = 300,
+        cache: Optional[WMSImageCache] = None,
+    ):
+        self.url = url
+        self.max_in_flight_requests = max_in_flight_requests
+        self.min_interval_second = 1 / max_requests_per_second if max_requests_per_second else 0
+        self.num_retries = num_retries
+        self.backoff_second = backoff_second
+        self.backoff_factor = backoff_factor
+        self.timeout_second = timeout_second
+        self.cache = cache
+
+    async def __aenter__(self) -> "AsyncWMSDownloader":
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight_requests, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Blocking requests of the session are run by these threads, while the event loop waits for their responses.
+        self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight_requests, thread_name_prefix="wms")
+        self.in_flight = asyncio.Semaphore(self.max_in_flight_requests)
+        self.schedule_lock = asyncio.Lock()
+        self.next_request_time = 0.0  # in the time of the event loop: requests are paused until then.
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    async def download(self, layer: str, srid: str, bounds: tuple, pixel_per_meter: float, outfile: str) -> None:
+        """Downloads a GeoTIFF image of the bounds to outfile, from the cache if possible, else from the WMS."""
+        if self.cache is None:
+            await self.request_image(layer, srid, bounds, pixel_per_meter, outfile)
+            return
+        loop = asyncio.get_running_loop()
+        image = (layer, srid, bounds, pixel_per_meter)
+        if not await loop.run_in_executor(self.executor, self.cache.fetch, *image, outfile):
+            await self.request_image(*image, outfile)
+            await loop.run_in_executor(self.executor, self.cache.store, *image, outfile)
+
+    async def request_image(self, layer: str, srid: str, bounds: tuple, pixel_per_meter: float, outfile: str) -> None:
+        """Requests a GeoTIFF image of the bounds and writes it to outfile, retrying on server errors, timeouts and connection errors."""
+        params = make_getmap_params(layer, srid, bounds, pixel_per_meter)
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.num_retries + 1):
+            async with self.in_flight:
+                await self.wait_for_turn()
+                try:
+                    response = await loop.run_in_executor(self.executor, self.get, params)
+                except (requests.ConnectionError, requests.Timeout) as error:
+                    response, failure = None, error
+            if response is not None:
+                if response.ok and response.headers.get("Content-Type", "").startswith("image/"):
+                    with open(outfile, "wb") as f:
+                        f.write(response.content)
+                    return
+                if response.ok:
+                    # e.g. a ServiceException (text/xml) for invalid parameters: the same request would fail again.
+                    raise WMSRequestError(f"Request {response.url} returned no image: {response.text[:500]}")
+                failure = f"HTTP {response.status_code} {response.reason}: {response.text[:500]}"
+                if 400 <= response.status_code < 500 and response.status_code not in OVERLOAD_STATUS_CODES:
+                    raise WMSRequestError(f"Request {response.url} failed with {failure}")
+            if attempt == self.num_retries:
+                break
+            delay = self.backoff_second * self.backoff_factor**attempt
+            if response is not None and response.status_code in OVERLOAD_STATUS_CODES:
+                delay = parse_retry_after(response.headers.get("Retry-After"), default=delay)
+                self.pause_all_requests(delay)
+            await asyncio.sleep(delay)
+        raise WMSRequestError(f"Request for layer {layer} over {bounds} failed after {self.num_retries + 1} attempts: {failure}")
+
+    def get(self, params: Dict[str, str]) -> requests.Response:
+        return self.session.get(self.url, params=params, timeout=self.timeout_second)
+
+    async def wait_for_turn(self) -> None:
+        """Waits until requests are not paused, and until the minimal interval since the previous request has passed."""
+        loop = asyncio.get_running_loop()
+        async with self.schedule_lock:
+            while (wait := self.next_request_time - loop.time()) > 0:
+                await asyncio.sleep(wait)
+            self.next_request_time = loop.time() + self.min_interval_second
+
+    def pause_all_requests(self, delay: float) -> None:
+        self.next_request_time = max(self.next_request_time, asyncio.get_running_loop().time() + delay)
+
+
+def parse_retry_after(retry_after: Optional[str], default: float) -> float:
+    """Delay in seconds from a Retry-After header, which holds either a number of seconds or an HTTP date."""
+    if retry_after is None:
+        return default
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
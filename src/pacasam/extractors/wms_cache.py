@@ -0,0 +1,74 @@
+"""
+Local cache of orthoimages downloaded from a Web Map Service (WMS).
+
+Successive extractions of overlapping samplings request the same images again: the image of a patch for BDOrthoTodayExtractor,
+and the images used to colorize LAZ patches. Images are stored in a directory, under the hash of the parameters that define
+them: (layer, srid, bbox, pixel_per_meter). The cache can be shared by concurrent processes and extractions:
+    - images are written to temporary files, then renamed: an image in the cache is always complete;
+    - images are copied out of the cache, so that they can be evicted at any time.
+
+The cache is capped in size: least recently used images are evicted first, at the start and at the end of extractions.
+
+"""
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Optional
+
+from pacasam.extractors.cog_cache import BYTES_IN_A_GB, evict_least_recently_used
+
+IMAGE_SUFFIX = ".tiff"
+DEFAULT_WMS_CACHE_MAX_SIZE_GB = 100
+
+
+class WMSImageCache:
+    """Directory of WMS images, each identified by the hash of its (layer, srid, bbox, pixel_per_meter)."""
+
+    def __init__(self, cache_dir: Path, max_size_gb: float = DEFAULT_WMS_CACHE_MAX_SIZE_GB, log: Optional[logging.Logger] = None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_gb * BYTES_IN_A_GB
+        self.log = log
+
+    def image_path(self, layer: str, srid: str, bounds: tuple, pixel_per_meter: float) -> Path:
+        key = image_key(layer, srid, bounds, pixel_per_meter)
+        # Images are spread over subdirectories, to keep directories small.
+        return self.cache_dir / key[:2] / f"{key}{IMAGE_SUFFIX}"
+
+    def fetch(self, layer: str, srid: str, bounds: tuple, pixel_per_meter: float, outfile: str) -> bool:
+        """Copies the cached image to outfile. Returns False if the image is not in the cache."""
+        image_path = self.image_path(layer, srid, bounds, pixel_per_meter)
+        try:
+            shutil.copyfile(image_path, outfile)
+            os.utime(image_path)  # marks the image as recently used
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, layer: str, srid: str, bounds: tuple, pixel_per_meter: float, image_file: str) -> None:
+        """Copies the image to the cache. Atomic: concurrent writers of the same image each rename a complete copy."""
+        image_path = self.image_path(layer, srid, bounds, pixel_per_meter)
+        image_path.parent.mkdir(exist_ok=True)
+        with tempfile.NamedTemporaryFile(suffix=IMAGE_SUFFIX, prefix=f".{image_path.stem}-", dir=image_path.parent, delete=False) as tmp_file:
+            tmp_path = Path(tmp_file.name)
+        try:
+            shutil.copyfile(image_file, tmp_path)
+            os.replace(tmp_path, image_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def evict(self) -> None:
+        """Deletes the least recently used images until the cache fits its maximal size."""
+        cache_size = evict_least_recently_used(self.cache_dir.glob(f"*/*{IMAGE_SUFFIX}"), self.max_size_bytes)
+        if self.log is not None:
+            self.log.info(f"WMS cache {self.cache_dir} holds {cache_size / BYTES_IN_A_GB:.1f}GB of images.")
+
+
+def image_key(layer: str, srid: str, bounds: tuple, pixel_per_meter: float) -> str:
+    """Identifies an image by its parameters, normalized so that e.g. srid 2154 and "2154", or bounds 0 and 0.0, are the same."""
+    normalized_bounds = ",".join(repr(float(b)) for b in bounds)
+    return hashlib.sha1(f"{layer}|{int(srid)}|{normalized_bounds}|{float(pixel_per_meter)!r}".encode()).hexdigest()
@@ -13,6 +13,11 @@ from pacasam.extractors.extractor import Extractor
 from pacasam.extractors.laz import LAZExtractor
 from pacasam.extractors.bd_ortho_today import BDOrthoTodayExtractor
 from pacasam.extractors.bd_ortho_vintage import BDOrthoVintageExtractor
+from pacasam.extractors.cog_cache import DEFAULT_COG_CACHE_MAX_SIZE_GB
+from pacasam.extractors.failures import DEFAULT_NUM_RETRIES
+from pacasam.extractors.point_arrays import POINT_ARRAYS_LAYOUT
+from pacasam.extractors.shards import DEFAULT_MAX_SHARD_SIZE_GB, FILES_LAYOUT, OUTPUT_LAYOUTS
+from pacasam.extractors.wms_cache import DEFAULT_WMS_CACHE_MAX_SIZE_GB
 from pacasam.utils import EXTRACTORS_LIBRARY, set_log_text_handler, setup_custom_logger
 from pacasam._version import __version__
 
@@ -40,6 +45,71 @@ parser.add_argument(
     "--extractor_class", default="LAZExtractor", type=str, help="Name of class of Extractor to use.", choices=EXTRACTORS_LIBRARY.keys()
 )
 parser.add_argument("--num_jobs", default=1, type=int, help="Number of processes for extraction.")
+parser.add_argument(
+    "--output_layout",
+    default=FILES_LAYOUT,
+    type=str,
+    choices=OUTPUT_LAYOUTS + [POINT_ARRAYS_LAYOUT],
+    help=(
+        "'files': one file per patch in each split directory. "
+        "'shards': patches are streamed into tar shards (WebDataset format) in each split directory, indexed by index.parquet. "
+        "'npy' (LAZExtractor only): points of each split are saved as memory-mappable arrays in {split}/points/."
+    ),
+)
+parser.add_argument("--max_shard_size_gb", default=DEFAULT_MAX_SHARD_SIZE_GB, type=float, help="Maximal size of each shard.")
+parser.add_argument(
+    "--fault_tolerant",
+    action="store_true",
+    help=(
+        "Record errors raised by the extraction of a patch (or of a LAZ file) instead of aborting, retry failed patches at the end, "
+        "and report those that still fail in failures.parquet. The exit status is 1 if some patches still fail."
+    ),
+)
+parser.add_argument("--num_retries", default=DEFAULT_NUM_RETRIES, type=int, help="With --fault_tolerant: number of retries of failed patches.")
+parser.add_argument("--num_retry_jobs", default=1, type=int, help="With --fault_tolerant: maximal number of processes for retries.")
+parser.add_argument(
+    "--streaming_chunk_size",
+    default=None,
+    type=int,
+    help="LAZExtractor only: read LAZ files by chunks of this number of points, to bound memory usage by worker.",
+)
+parser.add_argument(
+    "--cog_cache_dir",
+    default=None,
+    type=lambda p: Path(p).absolute(),
+    help=(
+        "LAZExtractor and BDOrthoVintageExtractor only: local directory where orthoimagery files (e.g. jp2) are transcoded "
+        "to Cloud-Optimized GeoTIFFs before extraction."
+    ),
+)
+parser.add_argument("--cog_cache_max_size_gb", default=DEFAULT_COG_CACHE_MAX_SIZE_GB, type=float, help="Maximal size of the COG cache.")
+parser.add_argument(
+    "--batch_wms_requests",
+    action="store_true",
+    help="LAZExtractor only: for colorization from the Géoplateforme WMS, request orthoimages once per LAZ file instead of once per patch.",
+)
+parser.add_argument(
+    "--wms_cache_dir",
+    default=None,
+    type=lambda p: Path(p).absolute(),
+    help=(
+        "BDOrthoTodayExtractor and LAZExtractor only: local directory where orthoimages requested to the Géoplateforme WMS are "
+        "cached, to be reused by later extractions of overlapping samplings."
+    ),
+)
+parser.add_argument("--wms_cache_max_size_gb", default=DEFAULT_WMS_CACHE_MAX_SIZE_GB, type=float, help="Maximal size of the WMS cache.")
+parser.add_argument(
+    "--max_in_flight_requests",
+    default=None,
+    type=int,
+    help=(
+        "BDOrthoTodayExtractor only: request orthoimages concurrently, with at most this number of requests in flight. "
+        "Then --num_jobs is the number of processes that collate orthoimages into patches."
+    ),
+)
+parser.add_argument(
+    "--max_requests_per_second", default=None, type=float, help="BDOrthoTodayExtractor only: rate limit of concurrent requests."
+)
 
 
 def run_extraction(args):
@@ -57,19 +127,54 @@ def run_extraction(args):
             sampling_path=args.sampling_path,
             dataset_root_path=args.dataset_root_path,
             num_jobs=args.num_jobs,
+            output_layout=args.output_layout,
+            max_shard_size_gb=args.max_shard_size_gb,
+            fault_tolerant=args.fault_tolerant,
+            num_retries=args.num_retries,
+            num_retry_jobs=args.num_retry_jobs,
+            streaming_chunk_size=args.streaming_chunk_size,
+            batch_wms_requests=args.batch_wms_requests,
+            cog_cache_dir=args.cog_cache_dir,
+            cog_cache_max_size_gb=args.cog_cache_max_size_gb,
+            wms_cache_dir=args.wms_cache_dir,
+            wms_cache_max_size_gb=args.wms_cache_max_size_gb,
         )
     elif args.extractor_class == "BDOrthoTodayExtractor":
         extractor: Extractor = BDOrthoTodayExtractor(
-            log=log, sampling_path=args.sampling_path, dataset_root_path=args.dataset_root_path, num_jobs=args.num_jobs
+            log=log,
+            sampling_path=args.sampling_path,
+            dataset_root_path=args.dataset_root_path,
+            num_jobs=args.num_jobs,
+            output_layout=args.output_layout,
+            max_shard_size_gb=args.max_shard_size_gb,
+            fault_tolerant=args.fault_tolerant,
+            num_retries=args.num_retries,
+            num_retry_jobs=args.num_retry_jobs,
+            max_in_flight_requests=args.max_in_flight_requests,
+            max_requests_per_second=args.max_requests_per_second,
+            wms_cache_dir=args.wms_cache_dir,
+            wms_cache_max_size_gb=args.wms_cache_max_size_gb,
         )
     elif args.extractor_class == "BDOrthoVintageExtractor":
         extractor: Extractor = BDOrthoVintageExtractor(
-            log=log, sampling_path=args.sampling_path, dataset_root_path=args.dataset_root_path, num_jobs=args.num_jobs
+            log=log,
+            sampling_path=args.sampling_path,
+            dataset_root_path=args.dataset_root_path,
+            num_jobs=args.num_jobs,
+            output_layout=args.output_layout,
+            max_shard_size_gb=args.max_shard_size_gb,
+            fault_tolerant=args.fault_tolerant,
+            num_retries=args.num_retries,
+            num_retry_jobs=args.num_retry_jobs,
+            cog_cache_dir=args.cog_cache_dir,
+            cog_cache_max_size_gb=args.cog_cache_max_size_gb,
         )
     else:
         raise ValueError(f"Extractor {args.extractor_class} is unknown. See argparse choices with --help.")
     extractor.extract()
     log.info(f"Extracted data in {args.dataset_root_path}")
+    if extractor.failures_report is not None:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -12,6 +12,7 @@ sys.path.append(str(root_dir))
 from pacasam.utils import CONNECTORS_LIBRARY, SAMPLERS_LIBRARY, set_log_text_handler, load_sampling_config, setup_custom_logger
 from pacasam.analysis.stats import Comparer
 from pacasam.connectors.connector import Connector
+from pacasam.connectors.lipac import LazyLiPaCConnector
 from pacasam.samplers.sampler import Sampler, save_gpd_to_any_filesystem
 from pacasam._version import __version__
 
@@ -25,6 +26,9 @@ parser.add_argument("--config_file", default="configs/Lipac.yml", type=lambda p:
 parser.add_argument("--connector_class", default="LiPaCConnector", choices=CONNECTORS_LIBRARY.keys())
 parser.add_argument("--sampler_class", default="TripleSampler", choices=SAMPLERS_LIBRARY.keys())
 parser.add_argument("--output_path", default=None)
+parser.add_argument(
+    "--refresh_cache", action="store_true", help="LiPaCConnector only: request the database even if a valid local snapshot exists."
+)
 
 
 def run_sampling(args):
@@ -46,6 +50,10 @@ def run_sampling(args):
     log.info(f"CONFIGURATION: \n {yaml.dump(conf, indent=4)}\n")
 
     # Connector
+    if args.refresh_cache:
+        if args.connector_class != "LiPaCConnector":
+            parser.error(f"--refresh_cache is only supported by LiPaCConnector, not by {args.connector_class}.")
+        conf["connector_kwargs"]["refresh_cache"] = True
     connector_class = CONNECTORS_LIBRARY.get(args.connector_class)
     connector: Connector = connector_class(log=log, **conf["connector_kwargs"])
 
@@ -63,8 +71,11 @@ def run_sampling(args):
     save_gpd_to_any_filesystem(gdf, gpkg_path)
 
     # Get descriptive statistics by comparing the database and the sampling
-    comparer = Comparer(output_path=args.output_path / "stats")
-    comparer.compare(connector.db, gdf)
+    if isinstance(connector, LazyLiPaCConnector):
+        log.info("Lazy connector: the sampling is not compared with the database, since this would download the whole database.")
+    else:
+        comparer = Comparer(output_path=args.output_path / "stats")
+        comparer.compare(connector.db, gdf)
 
     return gpkg_path
 
@@ -12,6 +12,9 @@ from pacasam.exceptions import UnexpectedNaNValuesError
 GLOBAL_RANDOM_STATE = 0
 # To avoid DIV0 leading to nan values
 EPSILON = 10e-6
+DEFAULT_FPS_ENGINE = "inplace"
+DEFAULT_STRATIFICATION_METHOD = "round_robin"
+STRATIFICATION_METHODS = ["round_robin", "iterative"]
 
 
 def sample_randomly(patches: DataFrame, num_to_sample: int):
@@ -20,7 +23,40 @@ def sample_randomly(patches: DataFrame, num_to_sample: int):
     return patches.sample(n=num_to_sample, replace=False, random_state=GLOBAL_RANDOM_STATE)
 
 
-def sample_with_stratification(patches: DataFrame, num_to_sample: int, keys: Union[str, List[str]] = FILE_ID_COLNAME):
+def sample_with_stratification(
+    patches: DataFrame,
+    num_to_sample: int,
+    keys: Union[str, List[str]] = FILE_ID_COLNAME,
+    method: str = DEFAULT_STRATIFICATION_METHOD,
+):
+    """Spatial sampling by slab: patches are spread as evenly as possible across strata (e.g. slabs).
+
+    method: `round_robin` (default, single pass) or `iterative` (previous implementation, kept for reference).
+
+    """
+    if method not in STRATIFICATION_METHODS:
+        raise ValueError(f"Unknown stratification method: `{method}`. Choose among: {', '.join(STRATIFICATION_METHODS)}.")
+
+    if len(patches) <= num_to_sample:
+        return patches
+
+    if method == "iterative":
+        return sample_with_stratification_iteratively(patches, num_to_sample, keys=keys)
+
+    # Shuffle once, then rank patches within each strata. Taking patches by increasing rank means taking
+    # one patch in each strata in turn (round-robin), and strata with few patches are naturally exhausted first.
+    # Ties between strata at the same rank are broken by a random order of the strata, so that each rank draws strata uniformly
+    # (the shuffled order would favour large strata, which are more likely to have a patch early on).
+    shuffled = patches.sample(frac=1, random_state=GLOBAL_RANDOM_STATE)
+    strata = shuffled.groupby(keys, sort=False, dropna=False, observed=True)
+    rank_in_strata = strata.cumcount().values
+    strata_codes = strata.ngroup().values
+    strata_order = np.random.RandomState(GLOBAL_RANDOM_STATE).permutation(strata_codes.max() + 1)[strata_codes]
+    round_robin_order = np.lexsort((strata_order, rank_in_strata))
+    return shuffled.iloc[round_robin_order[:num_to_sample]]
+
+
+def sample_with_stratification_iteratively(patches: DataFrame, num_to_sample: int, keys: Union[str, List[str]] = FILE_ID_COLNAME):
     """Efficient spatial sampling by sampling in each slab, iteratively."""
 
     if len(patches) <= num_to_sample:
@@ -29,11 +65,11 @@ def sample_with_stratification(patches: DataFrame, num_to_sample: int, keys: Uni
     # Step 1: start by sampling in each strata the minimal number of patches by strata we would want.
     # Sample with replacement to avoid errors, dropping duplicates afterwards.
     # This leads us to be already close to our target num of samples.
-    nunique = len(patches[keys].value_counts())
+    nunique = patches.groupby(keys, observed=True).ngroups
     min_n_by_strata = floor(num_to_sample / nunique)
     min_n_by_strata = max(min_n_by_strata, 1)
     # Sample with replacement in case a strata has few patches (e.g. near a water surface).
-    sampled_patches = patches.groupby(keys).sample(n=min_n_by_strata, random_state=GLOBAL_RANDOM_STATE, replace=True)
+    sampled_patches = patches.groupby(keys, observed=True).sample(n=min_n_by_strata, random_state=GLOBAL_RANDOM_STATE, replace=True)
     sampled_patches = sampled_patches.drop_duplicates(subset=PATCH_ID_COLNAME)
 
     # Case where we  have all the sample we need (i.e. num_samples_to_sample < number of stratas, and we got 1 in each tile)
@@ -46,7 +82,7 @@ def sample_with_stratification(patches: DataFrame, num_to_sample: int, keys: Uni
     # loop to get every tile within (with a maximum of n~400 iterations since it is the max num of tile per strata.)
     while len(sampled_patches) < num_to_sample:
         remaining_ids = patches[~patches[PATCH_ID_COLNAME].isin(sampled_patches[PATCH_ID_COLNAME])]
-        add_these_ids = remaining_ids.groupby(keys).sample(n=1, random_state=GLOBAL_RANDOM_STATE)
+        add_these_ids = remaining_ids.groupby(keys, observed=True).sample(n=1, random_state=GLOBAL_RANDOM_STATE)
 
         if len(add_these_ids) + len(sampled_patches) > num_to_sample:
             add_these_ids = add_these_ids.sample(n=num_to_sample - len(sampled_patches), random_state=GLOBAL_RANDOM_STATE)
@@ -91,14 +127,73 @@ def normalize_df(df: DataFrame, columns: List[str], normalization="standardizati
     return df
 
 
-def fps(arr: np.ndarray, num_to_sample: int):
+def fps(arr: np.ndarray, num_to_sample: int, engine: str = DEFAULT_FPS_ENGINE):
+    """Farthest Point Sampling: returns the indices of `num_to_sample` points of `arr` that cover its space evenly.
+
+    arr: [N, D] array of points (e.g. normalized class histograms)
+    num_to_sample: number of indices to return, typically << N
+    engine: name of the FPS implementation, among the keys of FPS_ENGINES.
+
+    """
+    if engine not in FPS_ENGINES:
+        raise ValueError(f"Unknown FPS engine: `{engine}`. Choose among: {', '.join(FPS_ENGINES)}.")
+    return FPS_ENGINES[engine](arr, num_to_sample)
+
+
+def fps_inplace(arr: np.ndarray, num_to_sample: int):
+    """FPS with fixed-size float32 buffers, updated in place at each iteration.
+
+    Selected points are masked by setting their min-distance to -inf instead of being deleted, so that
+    no array is reallocated or re-indexed in the loop. Features are stored column by column to accumulate
+    squared distances over contiguous memory.
+    Ties are broken by the smallest index, like in fps_legacy. Due to float32 rounding, the selection may
+    still differ from fps_legacy where distances are almost equal.
+
+    """
+    num_to_sample = min(num_to_sample, len(arr))
+    sample_inds = np.zeros(max(num_to_sample, 0), dtype="int")  # [S]
+    if num_to_sample <= 0:
+        return sample_inds
+    arr_t = np.ascontiguousarray(np.asarray(arr, dtype=np.float32).reshape(len(arr), -1).T)  # [D, P]
+
+    # Buffers: min-distance to the selected points, distance to the last added point, and a scratch array.
+    min_dists = np.full(arr_t.shape[1], np.inf, dtype=np.float32)  # [P]
+    dists = np.empty_like(min_dists)  # [P]
+    scratch = np.empty_like(min_dists)  # [P]
+
+    # Start from the first point, like in fps_legacy.
+    selected = 0
+    min_dists[selected] = -np.inf
+
+    for i in range(1, num_to_sample):
+        # Squared distance to the last added point, accumulated feature by feature.
+        last_added = arr_t[:, selected]
+        np.subtract(arr_t[0], last_added[0], out=dists)
+        np.square(dists, out=dists)
+        for dim in range(1, len(last_added)):
+            np.subtract(arr_t[dim], last_added[dim], out=scratch)
+            np.square(scratch, out=scratch)
+            np.add(dists, scratch, out=dists)
+
+        # If closer, update distances. The -inf of already selected points are kept.
+        np.minimum(min_dists, dists, out=min_dists)
+
+        # We want to pick the one that has the largest nearest neighbour distance to the sampled points
+        selected = np.argmax(min_dists)
+        sample_inds[i] = selected
+        min_dists[selected] = -np.inf
+
+    return sample_inds
+
+
+def fps_legacy(arr: np.ndarray, num_to_sample: int):
     """
     Adapted from: https://minibatchai.com/sampling/2021/08/07/FPS.html
     points: [N, 3] array containing the whole point cloud
     n_samples: samples you want in the sampled point cloud typically << N
     Current perfs:  10k out of 100k takes around 30 seconds tops.
     15% of 75km² is 4500 samples, so this will work in the general case where targets account for most of the samples..
-    TODO: check the FPS algo below.
+    Kept as a reference implementation for fps_inplace: each iteration copies the remaining points.
     """
     arr = np.array(arr)
 
@@ -138,3 +233,7 @@ def fps(arr: np.ndarray, num_to_sample: int):
         points_left = np.delete(points_left, selected)
 
     return sample_inds
+
+
+# Implementations of Farthest Point Sampling, selectable via the `engine` argument of fps.
+FPS_ENGINES = {"inplace": fps_inplace, "legacy": fps_legacy}
@@ -1,9 +1,11 @@
 from typing import List
 from math import ceil
+import numpy as np
 import pandas as pd
+from mpire import WorkerPool
 
 from pacasam.connectors.connector import FILE_ID_COLNAME, PATCH_ID_COLNAME, PATCH_INFO
-from pacasam.samplers.algos import fps, normalize_df, yield_chunks
+from pacasam.samplers.algos import DEFAULT_FPS_ENGINE, fps, normalize_df, yield_chunks
 from pacasam.samplers.sampler import Sampler
 
 
@@ -35,6 +37,8 @@ class DiversitySampler(Sampler):
             max_chunk_size_for_fps (int): max num of (consecutive) patches to process by FPS.
                 Lower chunks means that we look for diversity in
             smaller sets of points, thus yielding a better spatial coverage.
+            fps_engine (str): FPS implementation, among `inplace` (default) and `legacy`. See samplers/algos.py.
+            num_workers (int): number of processes to run FPS on chunks in parallel. Defaults to 1 (serial).
 
         Returns:
             A pd.DataFrame with selected patches.
@@ -55,11 +59,10 @@ class DiversitySampler(Sampler):
 
         cols_for_fps = self.cf["DiversitySampler"]["columns"]
 
-        db = self.connector.db
+        db = self.connector.request_patches_with_columns(cols_for_fps)
         # We sort by id with the assumption that the chunks are consecutive patches, from consecutive slabs.
         # This enables FPS to have a notion of "diversity" that is spatially specific.
         db = db.sort_values(by=[FILE_ID_COLNAME, PATCH_ID_COLNAME])
-        db = db[PATCH_INFO + cols_for_fps]
         db = normalize_df(
             df=db,
             columns=cols_for_fps,
@@ -76,20 +79,44 @@ class DiversitySampler(Sampler):
         return patches
 
     def _get_patches_via_fps(self, df: pd.DataFrame, num_to_sample: int, cols_for_fps: List[str]):
+        """Yields diverse patches chunk by chunk, following the order of df.
+
+        Chunks are independent: FPS runs either serially, or in a pool of `num_workers` processes that
+        share the normalized features. Results are yielded in chunk order in both cases, so outputs are identical.
+
+        """
         max_chunk_size = self.cf["DiversitySampler"]["max_chunk_size_for_fps"]
-        if len(df) > max_chunk_size:
-            target_proportion = num_to_sample / len(df)
-            for chunk in yield_chunks(df, max_chunk_size):
-                num_to_sample_in_chunk = ceil(len(chunk) * target_proportion)
-                yield from self._get_patches_via_fps(chunk, num_to_sample=num_to_sample_in_chunk, cols_for_fps=cols_for_fps)
+        fps_engine = self.cf["DiversitySampler"].get("fps_engine", DEFAULT_FPS_ENGINE)
+        num_workers = self.cf["DiversitySampler"].get("num_workers", 1)
+
+        # An empty df is a single (empty) chunk, so that an empty sampling is yielded.
+        chunks = list(yield_chunks(df, max_chunk_size)) or [df]
+        target_proportion = num_to_sample / len(df) if len(chunks) > 1 else None
+        tasks = []
+        for chunk_rank, chunk in enumerate(chunks):
+            start = chunk_rank * max_chunk_size
+            num_to_sample_in_chunk = num_to_sample if len(chunks) == 1 else ceil(len(chunk) * target_proportion)
+            # We can't sample more that there is in the chunk, but we still use fps to order the points nicely
+            num_to_sample_in_chunk = min(num_to_sample_in_chunk, len(chunk))
+            tasks += [(start, start + len(chunk), num_to_sample_in_chunk, fps_engine)]
+
+        features = df[cols_for_fps].values
+        if num_workers > 1 and len(tasks) > 1:
+            # With the fork start method, shared objects are inherited by workers instead of being pickled for each task.
+            with WorkerPool(n_jobs=num_workers, shared_objects=features) as pool:
+                diverse_idx_by_chunk = pool.map(fps_in_chunk, tasks, concatenate_numpy_output=False, progress_bar=True)
         else:
-            # We can't sample more that there is in df, but we still use fps to order the points nicely
-            if num_to_sample > len(df):
-                num_to_sample = len(df)
-            diverse_idx = fps(arr=df[cols_for_fps].values, num_to_sample=num_to_sample)
+            diverse_idx_by_chunk = (fps_in_chunk(features, *task) for task in tasks)
+
+        for chunk, diverse_idx in zip(chunks, diverse_idx_by_chunk):
             # Reset index to be sure our np indices can index the dataframe.
-            diverse = df.reset_index(drop=True).loc[diverse_idx, PATCH_INFO]
+            diverse = chunk.reset_index(drop=True).loc[diverse_idx, PATCH_INFO]
             diverse["sampler"] = self.name
             diverse = self._set_validation_patches_with_stratification(patches=diverse, keys=FILE_ID_COLNAME)
             diverse = diverse[self.sampling_schema]
             yield diverse
+
+
+def fps_in_chunk(features: np.ndarray, start: int, stop: int, num_to_sample: int, engine: str):
+    """Runs FPS on the consecutive rows [start, stop) of the features. Returns indices relative to start."""
+    return fps(arr=features[start:stop], num_to_sample=num_to_sample, engine=engine)
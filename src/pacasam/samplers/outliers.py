@@ -33,8 +33,7 @@ class OutliersSampler(Sampler):
 
         cols_for_clustering = self.cf["OutliersSampler"]["columns"]
 
-        df = self.connector.db
-        df = df[PATCH_INFO + cols_for_clustering]
+        df = self.connector.request_patches_with_columns(cols_for_clustering)
         # Always use the default normalization method : standardization,
         # because it is the only one that gives good outliers.
         df = normalize_df(df=df, columns=self.cf["OutliersSampler"]["columns"])
@@ -1,4 +1,4 @@
-from typing import Iterable
+from typing import Iterable, Optional
 import geopandas as gpd
 from pacasam.connectors.connector import FILE_ID_COLNAME
 from pacasam.samplers.algos import sample_randomly
@@ -6,9 +6,13 @@ from pacasam.samplers.sampler import Sampler
 
 
 class RandomSampler(Sampler):
-    """Random sampling - With option to exclude ids via current_selection_ids."""
+    """Random sampling - With option to exclude ids via current_selection_ids.
 
-    def get_patches(self, num_to_sample: int = None, current_selection_ids: Iterable = {}, **kwargs) -> gpd.GeoDataFrame:
+    By default, patches of the connector's current selection are excluded.
+
+    """
+
+    def get_patches(self, num_to_sample: int = None, current_selection_ids: Optional[Iterable] = None, **kwargs) -> gpd.GeoDataFrame:
         # If num_to_sample was not defined, sample the full final dataset with this sampler.
         if not num_to_sample:
             num_to_sample = self.cf["target_total_num_patches"]
@@ -5,7 +5,9 @@ import shutil
 import tempfile
 from typing import Dict, List, Literal, Union
 from geopandas import GeoDataFrame
-from pacasam.samplers.algos import sample_with_stratification
+from pacasam.samplers.algos import DEFAULT_STRATIFICATION_METHOD, sample_with_stratification
+from pacasam.connectors.bbox import bbox_to_geometry
+from pacasam.connectors.compact import expand_compact_dtypes
 from pacasam.connectors.connector import FILE_ID_COLNAME, PATCH_ID_COLNAME, Connector
 
 # Created by samplers
@@ -32,6 +34,8 @@ class Sampler:
         self.connector = connector
         self.cf = sampling_config
         self.log = log
+        # `round_robin` (single pass) or `iterative`. See sample_with_stratification.
+        self.stratification_method = self.cf.get("stratification_method", DEFAULT_STRATIFICATION_METHOD)
 
     def get_patches(self, **kwargs) -> GeoDataFrame:
         """Get patches - output must have schema self.sampling_schema."""
@@ -39,11 +43,12 @@ class Sampler:
             "This is an abstract class. Use child class for specific sampling approaches."
         )
 
-    def drop_duplicates_by_id_and_log_sampling_attrition(self, gdf: GeoDataFrame):
+    def add_to_selection_and_log_sampling_attrition(self, gdf: GeoDataFrame):
+        """Adds patches to the connector's selection, dropping the ones that were already selected."""
         if not len(gdf):
             return gdf
         n_sampled = len(gdf)
-        gdf = gdf.drop_duplicates(subset=[PATCH_ID_COLNAME])
+        gdf = gdf[self.connector.selection.select(gdf[PATCH_ID_COLNAME].values)]
         n_distinct = len(gdf)
         self.log.info(
             f"{self.name}: {n_sampled} ids --> {n_distinct} distinct ids (uniqueness ratio: {n_distinct/n_sampled:.03f}) "
@@ -58,7 +63,7 @@ class Sampler:
         if self.cf["frac_validation_set"]:
             patches.loc[:, SPLIT_COLNAME] = "train"
             num_samples_val_set = floor(self.cf["frac_validation_set"] * len(patches))
-            val_patches_ids = sample_with_stratification(patches, num_samples_val_set, keys=keys)[
+            val_patches_ids = sample_with_stratification(patches, num_samples_val_set, keys=keys, method=self.stratification_method)[
                 PATCH_ID_COLNAME
             ]
             patches.loc[patches[PATCH_ID_COLNAME].isin(val_patches_ids), SPLIT_COLNAME] = "val"
@@ -80,6 +85,7 @@ def save_gpd_to_any_filesystem(gdf: GeoDataFrame, gpkg_path: Path):
 
     """
 
+    gdf = expand_compact_dtypes(bbox_to_geometry(gdf))
     with tempfile.NamedTemporaryFile(suffix=".gpkg", prefix="tmp_geopackage") as tmp_copy:
         gdf.to_file(tmp_copy)
         shutil.copy(tmp_copy.name, gpkg_path)
@@ -1,4 +1,4 @@
-from typing import Iterable
+from typing import Iterable, Optional
 import geopandas as gpd
 from pacasam.connectors.connector import FILE_ID_COLNAME
 from pacasam.samplers.algos import sample_with_stratification
@@ -6,15 +6,19 @@ from pacasam.samplers.sampler import Sampler
 
 
 class SpatialSampler(Sampler):
-    """Spatial sampling by slab - With option to exclude ids via current_selection_ids."""
+    """Spatial sampling by slab - With option to exclude ids via current_selection_ids.
 
-    def get_patches(self, num_to_sample: int = None, current_selection_ids: Iterable = {}, **kwargs) -> gpd.GeoDataFrame:
+    By default, patches of the connector's current selection are excluded.
+
+    """
+
+    def get_patches(self, num_to_sample: int = None, current_selection_ids: Optional[Iterable] = None, **kwargs) -> gpd.GeoDataFrame:
         # If num_to_sample was not defined, sample the full final dataset with this sampler.
         if not num_to_sample:
             num_to_sample = self.cf["target_total_num_patches"]
 
         patches = self.connector.request_all_other_patches(exclude_ids=current_selection_ids)
-        patches = sample_with_stratification(patches, num_to_sample, keys=[FILE_ID_COLNAME])
+        patches = sample_with_stratification(patches, num_to_sample, keys=[FILE_ID_COLNAME], method=self.stratification_method)
         self.log.info(f"{self.name}: N={min(num_to_sample, len(patches))}/{num_to_sample} patches.")
         patches["sampler"] = self.name
         self._set_validation_patches_with_stratification(patches=patches, keys=[FILE_ID_COLNAME])
@@ -3,7 +3,7 @@ import warnings
 import geopandas as gpd
 import pandas as pd
 from typing import Dict
-from pacasam.connectors.connector import FILE_ID_COLNAME, Connector, PATCH_ID_COLNAME
+from pacasam.connectors.connector import FILE_ID_COLNAME, Connector
 from pacasam.samplers.algos import sample_with_stratification
 from pacasam.samplers.sampler import Sampler, SPLIT_COLNAME
 from pacasam.samplers.spatial import SpatialSampler
@@ -28,33 +28,36 @@ class TargettedSampler(Sampler):
         super().__init__(connector, sampling_config, log)
 
     def get_patches(self) -> gpd.GeoDataFrame:
-        selection = []
-        # Meet target requirements for each criterium
-        targets = self.cf["TargettedSampler"]["targets"]
-        for descriptor_name, descriptor_objectives in self.sorted_targets(targets).items():
-            patches = self._get_matching_patches(descriptor_name, descriptor_objectives)
-            selection += [patches]
-        selection = pd.concat(selection, ignore_index=True)
-        selection = self.drop_duplicates_by_id_and_log_sampling_attrition(selection)
-        self.log.info(f"{self.name}: N={len(selection)} distinct patches selected to match TargettedSampler requirements.")
-
-        if len(selection) > self.cf["target_total_num_patches"]:
-            warnings.warn(
-                f"Selected more than the desired total of N={self.cf['target_total_num_patches']}."
-                "If this is not desired, please reconsider your targets.",
-            )
-        elif self.complete_with_spatial_sampling:
-            # Complete with spatial sampling and achieve the desired fraction of validation set
-            num_patches_to_add = self.cf["target_total_num_patches"] - len(selection)
-            final_num_patches_in_validation = floor(self.cf["frac_validation_set"] * self.cf["target_total_num_patches"])
-            num_patches_to_add_in_validation = final_num_patches_in_validation - len(selection[selection[SPLIT_COLNAME] == "val"])
-            self.cf["frac_validation_set"] = num_patches_to_add_in_validation / num_patches_to_add
-
-            # Complete with spatial sampling
-            ss = SpatialSampler(connector=self.connector, sampling_config=self.cf, log=self.log)
-            completion = ss.get_patches(num_to_sample=num_patches_to_add, current_selection_ids=selection[PATCH_ID_COLNAME])
-            selection = pd.concat([selection, completion])
-            self.log.info(f"{self.name}: completed targetted sampling with N={num_patches_to_add} additional patches.")
+        with self.connector.selection_session():
+            selection = []
+            # Meet target requirements for each criterium
+            targets = self.cf["TargettedSampler"]["targets"]
+            for descriptor_name, descriptor_objectives in self.sorted_targets(targets).items():
+                patches = self._get_matching_patches(descriptor_name, descriptor_objectives)
+                selection += [patches]
+            selection = pd.concat(selection, ignore_index=True)
+            selection = self.add_to_selection_and_log_sampling_attrition(selection)
+            self.log.info(f"{self.name}: N={len(selection)} distinct patches selected to match TargettedSampler requirements.")
+
+            if len(selection) > self.cf["target_total_num_patches"]:
+                warnings.warn(
+                    f"Selected more than the desired total of N={self.cf['target_total_num_patches']}."
+                    "If this is not desired, please reconsider your targets.",
+                )
+            elif self.complete_with_spatial_sampling:
+                # Complete with spatial sampling and achieve the desired fraction of validation set
+                num_patches_to_add = self.cf["target_total_num_patches"] - len(selection)
+                final_num_patches_in_validation = floor(self.cf["frac_validation_set"] * self.cf["target_total_num_patches"])
+                num_patches_to_add_in_validation = final_num_patches_in_validation - len(selection[selection[SPLIT_COLNAME] == "val"])
+                # Copy the configuration to avoid modifying the shared one.
+                completion_cf = {**self.cf, "frac_validation_set": num_patches_to_add_in_validation / num_patches_to_add}
+
+                # Complete with spatial sampling, excluding the patches of the current selection.
+                ss = SpatialSampler(connector=self.connector, sampling_config=completion_cf, log=self.log)
+                completion = ss.get_patches(num_to_sample=num_patches_to_add)
+                completion = ss.add_to_selection_and_log_sampling_attrition(completion)
+                selection = pd.concat([selection, completion])
+                self.log.info(f"{self.name}: completed targetted sampling with N={num_patches_to_add} additional patches.")
 
         return selection
 
@@ -65,7 +68,7 @@ class TargettedSampler(Sampler):
         num_samples_target = int(descriptor_objectives["target_min_samples_proportion"] * self.cf["target_total_num_patches"])
         num_samples_to_sample = min(num_samples_target, len(patches))  # cannot take more that there is.
 
-        patches = sample_with_stratification(patches, num_samples_to_sample, keys=[FILE_ID_COLNAME])
+        patches = sample_with_stratification(patches, num_samples_to_sample, keys=[FILE_ID_COLNAME], method=self.stratification_method)
 
         self.log.info(
             f"TargettedSampler: {descriptor_name} "
@@ -25,6 +25,9 @@ import sys
 from geopandas import GeoDataFrame
 import geopandas as gpd
 import numpy as np
+import rasterio
+from rasterio.transform import from_bounds as transform_from_bounds
+from rasterio.windows import from_bounds as window_from_bounds
 import shapely
 import pytest
 
@@ -41,10 +44,13 @@ from pacasam.samplers.sampler import SAMPLER_COLNAME, SPLIT_COLNAME
 from pacasam.connectors.connector import FILE_ID_COLNAME, GEOMETRY_COLNAME, PATCH_ID_COLNAME, SRID_COLNAME
 from pacasam.extractors.laz import FILE_PATH_COLNAME
 from pacasam.extractors.bd_ortho_vintage import IRC_COLNAME, RGB_COLNAME
+from pacasam.extractors.bd_ortho_today import IRC_LAYER, RGB_LAYER
 from pacasam.connectors.synthetic import SyntheticConnector
 
 
 LEFTY = "tests/data/laz/792000_6272000-50mx100m-left.laz"
+# Same points, in a COPC file (point format 7, octree of depth 2).
+LEFTY_COPC = "tests/data/laz/792000_6272000-50mx100m-left.copc.laz"
 LEFTY_UP_GEOMETRY = shapely.box(xmin=792000, ymin=6271171 + 50, xmax=792050, ymax=6271271)
 LEFTY_DOWN_GEOMETRY = shapely.box(xmin=792000, ymin=6271171, xmax=792050, ymax=6271271 - 50)
 
@@ -56,6 +62,24 @@ RIGHTY_DOWN_GEOMETRY = shapely.box(xmin=792050, ymin=6271171, xmax=792100, ymax=
 NUM_TEST_FILES = 2
 NUM_PATCHED_IN_EACH_FILE = 2
 
+# Orthoimages of the test data (covering LEFTY only), served by stand-ins for the Géoplateforme WMS.
+STAND_IN_WMS_SOURCES = {
+    RGB_LAYER: "tests/data/bd_ortho_vintage/rgb/D30-2021.vrt",
+    IRC_LAYER: "tests/data/bd_ortho_vintage/irc/D30-2021.vrt",
+}
+
+
+def write_stand_in_orthoimage(layer: str, bounds: tuple, pixel_per_meter: float, outfile) -> None:
+    """Writes the GeoTIFF image of a WMS layer over the bounds, from the test orthoimages (zeros beyond them)."""
+    minx, miny, maxx, maxy = bounds
+    width, height = int((maxx - minx) * pixel_per_meter), int((maxy - miny) * pixel_per_meter)
+    with rasterio.open(STAND_IN_WMS_SOURCES[layer]) as src:
+        window = window_from_bounds(minx, miny, maxx, maxy, transform=src.transform)
+        data = src.read(window=window, out_shape=(src.count, height, width), boundless=True, fill_value=0)
+        options = {"driver": "GTiff", "count": src.count, "dtype": src.dtypes[0], "crs": src.crs, "width": width, "height": height}
+    with rasterio.open(outfile, "w", transform=transform_from_bounds(minx, miny, maxx, maxy, width, height), **options) as dst:
+        dst.write(data)
+
 
 @pytest.fixture(scope="session")
 def toy_sampling_file() -> tempfile._TemporaryFileWrapper:
@@ -1,6 +1,9 @@
 from pathlib import Path
 import tempfile
-from pacasam.analysis.stats import Comparer
+import numpy as np
+import pandas as pd
+from pacasam.analysis.stats import SURFACE_OF_A_KM2, Comparer
+from pacasam.connectors.bbox import geometry_to_bbox
 
 
 def test_Comparer(synthetic_sampling):
@@ -19,3 +22,14 @@ def test_Comparer(synthetic_sampling):
                 "comparison-sizes-by_split.csv",
             ]
         )
+
+
+def test_Comparer_reads_areas_from_bounds(synthetic_sampling):
+    """Areas are the same whether the database holds shapely geometries or only their bounds."""
+    with tempfile.TemporaryDirectory() as tmp_path:
+        comparer = Comparer(output_path=Path(tmp_path))
+        comparer.compare(geometry_to_bbox(synthetic_sampling), synthetic_sampling)
+        comparison = pd.read_csv(Path(tmp_path) / "comparison-sizes-by_split.csv")
+        assert (comparison.groupby("descriptor")["df_database"].first() > 0).all()
+        areas = comparison[comparison["descriptor"] == "area_km2"]
+        assert np.allclose(areas["df_database"], synthetic_sampling.area.sum() / SURFACE_OF_A_KM2)
@@ -0,0 +1,49 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from pacasam.connectors.bbox import BBOX_COLNAMES, bbox_to_geometry, geometry_to_bbox, get_areas, get_bounds
+from pacasam.connectors.geopandas import GeopandasConnector
+from pacasam.samplers.triple import TripleSampler
+from pacasam.utils import load_sampling_config
+
+
+def make_patches() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        {"patch_id": [0, 1]}, geometry=[shapely.box(0, 0, 50, 50), shapely.box(50, 100, 150, 200)], crs="EPSG:2154"
+    )
+
+
+def test_bbox_representation_round_trip():
+    patches = make_patches()
+    bboxes = geometry_to_bbox(patches)
+    assert not isinstance(bboxes, gpd.GeoDataFrame)
+    assert list(bboxes.columns) == ["patch_id"] + BBOX_COLNAMES
+    np.testing.assert_array_equal(get_bounds(bboxes), get_bounds(patches))
+    np.testing.assert_array_equal(get_areas(bboxes), [2500, 10000])
+    np.testing.assert_array_equal(get_areas(bboxes), get_areas(patches))
+
+    materialized = bbox_to_geometry(bboxes, crs=patches.crs)
+    assert materialized.crs == patches.crs
+    assert materialized.geom_equals(patches.geometry).all()
+    # No-op when geometries are already there.
+    assert bbox_to_geometry(patches) is patches
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+def test_bbox_mode_gives_the_same_sampling(synthetic_connector, session_logger, tmp_path):
+    gpkg_path = tmp_path / "synthetic.gpkg"
+    synthetic_connector.db.set_crs("EPSG:2154", allow_override=True).to_file(gpkg_path)
+    conf = load_sampling_config("configs/Synthetic.yml")
+    samplings = []
+    for geometry_as_bbox in [False, True]:
+        connector = GeopandasConnector(log=session_logger, gpd_database_path=gpkg_path, split="any", geometry_as_bbox=geometry_as_bbox)
+        sampler = TripleSampler(connector=connector, sampling_config=conf, log=session_logger)
+        samplings += [connector.extract(sampler.get_patches())]
+    assert "geometry" not in connector.db.columns
+    assert samplings[1].crs == samplings[0].crs
+    assert samplings[1].geom_equals(samplings[0].geometry).all()
+    other_columns = samplings[0].columns.drop("geometry")
+    pd.testing.assert_frame_equal(pd.DataFrame(samplings[0][other_columns]), pd.DataFrame(samplings[1][other_columns]))
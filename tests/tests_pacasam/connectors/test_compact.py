@@ -0,0 +1,86 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from pacasam.connectors.compact import compact_database, concat_compact_chunks, expand_compact_dtypes
+from pacasam.connectors.geopandas import GeopandasConnector
+from pacasam.samplers.sampler import save_gpd_to_any_filesystem
+from pacasam.samplers.triple import TripleSampler
+from pacasam.utils import load_sampling_config
+
+
+def make_database() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        {
+            "patch_id": ["a-0", "a-1", "b-0"],
+            "file_id": ["a", "a", "b"],
+            "file_path": ["/mnt/a.laz", "/mnt/a.laz", "/mnt/b.laz"],
+            "nb_total": [10, 300, 20],
+            "nb_eau": [0.0, np.nan, 5.0],
+            "nb_signed": [-1, 0, 1],
+            "pont": [True, None, False],
+        },
+        geometry=[shapely.box(0, 0, 50, 50)] * 3,
+        crs="EPSG:2154",
+    )
+
+
+def test_compact_database_dtypes():
+    db = compact_database(make_database(), categorical_columns=["file_id", "file_path", "absent_column"])
+    assert db["nb_total"].dtype == np.uint16
+    assert db["nb_eau"].dtype == "UInt8"
+    assert db["nb_signed"].dtype == np.int64  # not a valid count: left as is
+    assert db["pont"].dtype == "boolean"
+    assert isinstance(db["file_id"].dtype, pd.CategoricalDtype)
+    assert isinstance(db["file_path"].dtype, pd.CategoricalDtype)
+    assert db["patch_id"].dtype == object
+    assert db["pont"].sum() == 1
+
+
+def test_compact_chunks_give_the_compact_database():
+    """Chunks compacted one by one (with different categories and dtypes) give the same database as compacting it whole."""
+    categorical_columns = ["file_id", "file_path"]
+    db = make_database()
+    compact_chunks = [compact_database(chunk.copy(), categorical_columns) for chunk in [db.iloc[:2], db.iloc[2:]]]
+    concatenated = concat_compact_chunks(compact_chunks, categorical_columns)
+    compact_db = compact_database(make_database(), categorical_columns)
+    assert isinstance(concatenated["file_path"].dtype, pd.CategoricalDtype)
+    assert sorted(concatenated["file_path"].cat.categories) == ["/mnt/a.laz", "/mnt/b.laz"]
+    assert (concatenated.dtypes == compact_db.dtypes).all()
+    assert concatenated.equals(compact_db)
+
+
+def test_compact_chunks_sort_like_the_original_values():
+    """Categories of chunks that are not in lexical order (e.g. from parallel reads) are sorted, so that sorting is unchanged."""
+    categorical_columns = ["file_id", "file_path"]
+    db = make_database()
+    compact_chunks = [compact_database(chunk.copy(), categorical_columns) for chunk in [db.iloc[2:], db.iloc[:2]]]
+    concatenated = concat_compact_chunks(compact_chunks, categorical_columns)
+    assert list(concatenated["file_id"].cat.categories) == ["a", "b"]
+    sort_keys = ["file_id", "patch_id"]
+    assert concatenated.sort_values(sort_keys)["patch_id"].tolist() == db.sort_values(sort_keys)["patch_id"].tolist()
+
+
+def test_compact_database_can_be_saved(tmp_path):
+    gpkg_path = tmp_path / "compact.gpkg"
+    db = compact_database(make_database(), categorical_columns=["file_id", "file_path"])
+    save_gpd_to_any_filesystem(db, gpkg_path)
+    saved = gpd.read_file(gpkg_path)
+    assert list(saved["file_path"]) == ["/mnt/a.laz", "/mnt/a.laz", "/mnt/b.laz"]
+    assert expand_compact_dtypes(db)["nb_eau"].isna().sum() == 1
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+def test_compact_mode_gives_the_same_sampling(synthetic_connector, session_logger, tmp_path):
+    gpkg_path = tmp_path / "synthetic.gpkg"
+    synthetic_connector.db.to_file(gpkg_path)
+    conf = load_sampling_config("configs/Synthetic.yml")
+    samplings = []
+    for compact in [False, True]:
+        connector = GeopandasConnector(log=session_logger, gpd_database_path=gpkg_path, split="any", compact=compact)
+        sampler = TripleSampler(connector=connector, sampling_config=conf, log=session_logger)
+        samplings += [connector.extract(sampler.get_patches())]
+    assert samplings[1]["file_id"].dtype == "category"
+    pd.testing.assert_frame_equal(samplings[0], expand_compact_dtypes(samplings[1]), check_dtype=False)
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from geopandas import GeoDataFrame
+
+from pacasam.connectors.connector import FILE_ID_COLNAME, PATCH_ID_COLNAME, Connector, SelectionState
+
+NUM_PATCHES = 10
+
+
+@pytest.fixture()
+def tiny_connector(session_logger) -> Connector:
+    connector = Connector(log=session_logger)
+    # Patch ids are not positions, to make sure that the selection relies on the id->position index.
+    connector.db = GeoDataFrame({PATCH_ID_COLNAME: range(100, 100 + NUM_PATCHES), FILE_ID_COLNAME: ["a", "b"] * (NUM_PATCHES // 2)})
+    return connector
+
+
+def test_selection_state_drops_already_selected_and_repeated_ids():
+    state = SelectionState(np.arange(100, 100 + NUM_PATCHES))
+    assert list(state.select([100, 101, 101])) == [True, True, False]
+    assert list(state.select([101, 102])) == [False, True]
+    assert state.num_selected == 3
+    state.reset()
+    assert state.num_selected == 0
+
+
+def test_selection_state_with_unknown_ids_raises_error():
+    state = SelectionState(np.arange(NUM_PATCHES))
+    with pytest.raises(KeyError):
+        state.select([NUM_PATCHES + 1])
+
+
+def test_request_all_other_patches_excludes_ids_or_current_selection(tiny_connector):
+    others = tiny_connector.request_all_other_patches(exclude_ids=[100, 105])
+    assert len(others) == NUM_PATCHES - 2
+    assert not others[PATCH_ID_COLNAME].isin([100, 105]).any()
+    # Ids that are not in the database (e.g. from another sampling) are ignored, as with isin.
+    others = tiny_connector.request_all_other_patches(exclude_ids=[100, -1, 10**9])
+    assert len(others) == NUM_PATCHES - 1
+
+    with tiny_connector.selection_session() as selection:
+        selection.select([101, 102, 103])
+        others = tiny_connector.request_all_other_patches()
+        assert len(others) == NUM_PATCHES - 3
+        assert not others[PATCH_ID_COLNAME].isin([101, 102, 103]).any()
+
+
+def test_nested_selection_sessions_share_the_selection(tiny_connector):
+    with tiny_connector.selection_session() as outer:
+        outer.select([100])
+        with tiny_connector.selection_session() as inner:
+            assert inner.num_selected == 1
+            inner.select([101])
+        assert outer.num_selected == 2
+    # The selection is emptied when leaving the outermost session.
+    assert len(tiny_connector.request_all_other_patches()) == NUM_PATCHES
@@ -1,7 +1,21 @@
+import os
+import time
+from unittest.mock import MagicMock
+import pandas as pd
 import pytest
+import shapely
 from geopandas import GeoDataFrame
 
-from pacasam.connectors.lipac import filter_lipac_patches_on_split
+from pacasam.connectors import lipac
+from pacasam.connectors.lipac import (
+    LazyLiPaCConnector,
+    LiPaCConnector,
+    RANGE_FILTER_MARKER,
+    filter_lipac_patches_on_split,
+    make_range_filters,
+    make_split_filter,
+)
+from pacasam.connectors.snapshot import SNAPSHOT_SUFFIX, snapshot_is_valid
 
 # Mock data for testing
 MOCK_TEST_COLNAME = "test"
@@ -34,3 +48,184 @@ def test_filter_lipac_patches_on_split_with_invalid_split():
     desired_split = "invalid"
     with pytest.raises(ValueError):
         filter_lipac_patches_on_split(mock_db, MOCK_TEST_COLNAME, desired_split)
+
+
+# Snapshots of LiPaC, with a mocked PostGIS database.
+
+
+def make_mock_lipac_query_result() -> GeoDataFrame:
+    return GeoDataFrame(
+        {
+            "patch_id": ["b-000000002", "a-000000001"],
+            "file_id": ["b", "a"],
+            "file_path": ["//store.ign.fr/store-lidarhd/b.laz", "//store.ign.fr/store-lidarhd/a.laz"],
+            "rgb_file": ["//store.ign.fr/store-lidarhd/b_rgb.jp2", "//store.ign.fr/store-lidarhd/a_rgb.jp2"],
+            "irc_file": ["//store.ign.fr/store-lidarhd/b_irc.jp2", "//store.ign.fr/store-lidarhd/a_irc.jp2"],
+            "test": [None, True],
+            "nb_total": [10, 20],
+        },
+        geometry=[shapely.box(50, 0, 100, 50), shapely.box(0, 0, 50, 50)],
+    )
+
+
+@pytest.fixture()
+def mocked_read_postgis(monkeypatch):
+    """Mock the PostGIS database: no engine is created, and read_postgis returns the mock query result in one chunk."""
+    read_postgis = MagicMock(side_effect=lambda *args, **kwargs: iter([make_mock_lipac_query_result()]))
+    monkeypatch.setattr(lipac, "create_engine", MagicMock())
+    monkeypatch.setattr(lipac.gpd, "read_postgis", read_postgis)
+    return read_postgis
+
+
+def make_lipac_connector(session_logger, sql_query_path, cache_dir, password="password", **kwargs) -> LiPaCConnector:
+    return LiPaCConnector(
+        log=session_logger,
+        username="username",
+        password=password,
+        db_lipac_host="host",
+        db_lipac_name="lidar_patch_catalogue",
+        extraction_sql_query_path=sql_query_path,
+        split="any",
+        snapshot_cache_dir=cache_dir,
+        **kwargs,
+    )
+
+
+@pytest.fixture()
+def sql_query_path(tmp_path):
+    sql_query_path = tmp_path / "query.sql"
+    sql_query_path.write_text("SELECT * FROM VIGNETTE;")
+    return sql_query_path
+
+
+def test_lipac_snapshot_is_reused(mocked_read_postgis, session_logger, sql_query_path, tmp_path):
+    cache_dir = tmp_path / "cache"
+    first = make_lipac_connector(session_logger, sql_query_path, cache_dir)
+    assert mocked_read_postgis.call_count == 1
+    assert len(list(cache_dir.glob(f"*{SNAPSHOT_SUFFIX}"))) == 1
+
+    second = make_lipac_connector(session_logger, sql_query_path, cache_dir)
+    assert mocked_read_postgis.call_count == 1
+    assert second.db.equals(first.db)
+    assert second.db["file_path"].iloc[0] == "/mnt/store-lidarhd/a.laz"
+
+
+def test_lipac_snapshot_is_invalidated(mocked_read_postgis, session_logger, sql_query_path, tmp_path):
+    cache_dir = tmp_path / "cache"
+    make_lipac_connector(session_logger, sql_query_path, cache_dir)
+
+    # Explicit refresh
+    make_lipac_connector(session_logger, sql_query_path, cache_dir, refresh_cache=True)
+    assert mocked_read_postgis.call_count == 2
+
+    # Different query
+    sql_query_path.write_text("SELECT * FROM VIGNETTE WHERE EN_FRANCE;")
+    make_lipac_connector(session_logger, sql_query_path, cache_dir)
+    assert mocked_read_postgis.call_count == 3
+    assert len(list(cache_dir.glob(f"*{SNAPSHOT_SUFFIX}"))) == 2
+
+    # Expired snapshot
+    for snapshot_path in cache_dir.glob(f"*{SNAPSHOT_SUFFIX}"):
+        two_hours_ago = time.time() - 2 * 3600
+        os.utime(snapshot_path, (two_hours_ago, two_hours_ago))
+        assert not snapshot_is_valid(snapshot_path, ttl_hours=1)
+    make_lipac_connector(session_logger, sql_query_path, cache_dir, snapshot_ttl_hours=1)
+    assert mocked_read_postgis.call_count == 4
+
+    # Another database on the same host, but not with another password.
+    make_lipac_connector(session_logger, sql_query_path, cache_dir, db_lipac_port=5433)
+    assert mocked_read_postgis.call_count == 5
+    make_lipac_connector(session_logger, sql_query_path, cache_dir, db_lipac_port=5433, password="other_password")
+    assert mocked_read_postgis.call_count == 5
+
+
+# Parallel reads by ranges of a base-table key, with a mocked PostGIS database.
+
+
+def test_make_range_filters():
+    assert make_range_filters("vignette_id", []) == [("TRUE", {})]
+    range_filters = make_range_filters("vignette_id", ["b", "d"])
+    assert [params for _, params in range_filters] == [{"upper": "b"}, {"lower": "b", "upper": "d"}, {"lower": "d"}]
+    # NULL values belong to the first range.
+    assert range_filters[0][0] == "vignette_id < :upper OR vignette_id IS NULL"
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_lipac_parallel_reads_give_the_same_database(monkeypatch, session_logger, sql_query_path, compact):
+    query_result = make_mock_lipac_query_result()
+    sql_query_path.write_text(f"SELECT * FROM VIGNETTE WHERE {RANGE_FILTER_MARKER};")
+
+    def read_postgis_range(sql, connection, params, **kwargs):
+        # The range filter is applied inside the query, in place of its marker.
+        assert "(STAT_VIGNETTE_LIDAR.VIGNETTE_ID " in str(sql) and RANGE_FILTER_MARKER not in str(sql)
+        # Mimic the range filter (open bounds are replaced by extreme strings), in two chunks.
+        patch_ids = query_result["patch_id"]
+        selected = query_result[(patch_ids >= params.get("lower", "")) & (patch_ids < params.get("upper", "~"))]
+        return iter([selected.iloc[:1], selected.iloc[1:]])
+
+    engine = MagicMock()
+    # The quantile that splits the mock result in two ranges.
+    engine.connect.return_value.__enter__.return_value.execute.return_value.scalar.return_value = ["b-000000002"]
+    monkeypatch.setattr(lipac, "create_engine", MagicMock(return_value=engine))
+    read_postgis = MagicMock(side_effect=read_postgis_range)
+    monkeypatch.setattr(lipac.gpd, "read_postgis", read_postgis)
+
+    connector = make_lipac_connector(session_logger, sql_query_path, cache_dir=None, num_parallel_reads=2, compact=compact)
+    assert read_postgis.call_count == 2
+    assert list(connector.db["patch_id"]) == sorted(query_result["patch_id"])
+    # Chunks are compacted as they are read, with the categories of all chunks.
+    assert isinstance(connector.db["file_id"].dtype, pd.CategoricalDtype) == compact
+    assert list(connector.db["file_path"]) == ["/mnt/store-lidarhd/a.laz", "/mnt/store-lidarhd/b.laz"]
+
+
+def test_lipac_parallel_reads_need_the_range_filter_marker(monkeypatch, session_logger, sql_query_path):
+    monkeypatch.setattr(lipac, "create_engine", MagicMock())
+    with pytest.raises(ValueError, match="RANGE_FILTER"):
+        make_lipac_connector(session_logger, sql_query_path, cache_dir=None, num_parallel_reads=2)
+
+
+# Lazy connector with requests pushed down to a mocked PostGIS database.
+
+
+def test_make_split_filter():
+    assert make_split_filter("test", "any") == "TRUE"
+    assert make_split_filter("test", "test") == "test IS TRUE"
+    assert make_split_filter("test", "train") == "test IS NOT TRUE"
+    with pytest.raises(ValueError):
+        make_split_filter("test", "invalid")
+
+
+def test_lazy_lipac_only_requests_what_samplers_need(monkeypatch, mocked_read_postgis, session_logger, sql_query_path):
+    query_result = make_mock_lipac_query_result()
+    read_sql = MagicMock(side_effect=lambda sql, connection, params=None: query_result[["patch_id", "file_id"]].copy())
+    monkeypatch.setattr(lipac.pd, "read_sql", read_sql)
+    connector = LazyLiPaCConnector(
+        log=session_logger,
+        username="username",
+        password="password",
+        db_lipac_host="host",
+        db_lipac_name="lidar_patch_catalogue",
+        extraction_sql_query_path=sql_query_path,
+        split="train",
+    )
+    # Nothing is downloaded at initialization.
+    assert mocked_read_postgis.call_count == 0
+
+    # Ids of all patches are requested once, sorted like the full database.
+    assert connector.db_size == 2
+    assert list(connector.request_all_other_patches()["patch_id"]) == ["a-000000001", "b-000000002"]
+    assert read_sql.call_count == 1
+    sql = str(read_sql.call_args.args[0])
+    assert sql.startswith("SELECT patch_id, file_id FROM (SELECT * FROM VIGNETTE) AS lipac_query")
+    assert "test IS NOT TRUE" in sql
+
+    with pytest.raises(ValueError):
+        connector.request_patches_with_columns(["nb_total; DROP TABLE VIGNETTE"])
+
+    # Full rows are requested for the selected patches only.
+    selection = GeoDataFrame({"patch_id": ["a-000000001"], "split": ["train"], "sampler": ["RandomSampler"]})
+    extract = connector.extract(selection)
+    assert mocked_read_postgis.call_args.kwargs["params"] == {"selected_ids": ["a-000000001"]}
+    assert len(extract) == 1
+    assert extract["file_path"].iloc[0] == "/mnt/store-lidarhd/a.laz"
+    assert extract["split"].iloc[0] == "train"
@@ -0,0 +1,56 @@
+import shutil
+import numpy as np
+import pandas as pd
+
+from pacasam.connectors import synthetic
+from pacasam.connectors.synthetic import SyntheticConnector, make_synthetic_patches
+
+PREVALENCES = [0.1, 0.5]
+
+
+def make_synthetic_connector(**kwargs) -> SyntheticConnector:
+    return SyntheticConnector(log=None, binary_descriptors_prevalence=PREVALENCES, split="any", **kwargs)
+
+
+def test_synthetic_database_is_reproducible_with_a_seed():
+    db = make_synthetic_connector(db_size=1000, seed=0).db
+    pd.testing.assert_frame_equal(db, make_synthetic_connector(db_size=1000, seed=0).db)
+    assert list(db["patch_id"]) == list(range(1000))
+    assert db["C0"].sum() == 100
+    assert db["test"].notna().sum() == 200
+    # 32x32 grid of 50m patches: the first slab (1000m x 1000m) has 20 x 20 patches.
+    assert (db["file_id"] == "0_0").sum() == 400
+    assert db.geometry.iloc[0].bounds == (0, 0, 50, 50)
+
+
+def test_make_synthetic_patches_by_chunks_gives_the_same_patches():
+    rng = np.random.default_rng(0)
+    full = make_synthetic_patches(0, 1000, 1000, PREVALENCES, rng=rng)
+    chunks = pd.concat([make_synthetic_patches(start, start + 300, 1000, PREVALENCES, rng=rng) for start in [0, 300, 600]])
+    chunks = pd.concat([chunks, make_synthetic_patches(900, 1000, 1000, PREVALENCES, rng=rng)], ignore_index=True)
+    for col in ["patch_id", "file_id", "geometry"]:
+        assert full[col].equals(chunks[col])
+
+
+def test_synthetic_database_streamed_to_geoparquet(tmp_path, monkeypatch):
+    geoparquet_path = tmp_path / "synthetic"
+    db = make_synthetic_connector(db_size=1000, seed=0, geoparquet_path=geoparquet_path, chunk_size=300).db
+    assert len(list(geoparquet_path.glob("*.parquet"))) == 4
+    assert not (tmp_path / "synthetic.tmp").exists()
+    assert list(db["patch_id"]) == list(range(1000))
+    assert db.crs == "EPSG:2154"
+
+    # The dataset is reused.
+    make_synthetic_patches = synthetic.make_synthetic_patches
+    monkeypatch.setattr(synthetic, "make_synthetic_patches", None)
+    reloaded = make_synthetic_connector(db_size=1000, seed=0, geoparquet_path=geoparquet_path).db
+    pd.testing.assert_frame_equal(db, reloaded)
+
+    # The dataset is regenerated with other parameters.
+    monkeypatch.setattr(synthetic, "make_synthetic_patches", make_synthetic_patches)
+    for other_parameters in [{"db_size": 500, "seed": 0}, {"db_size": 500, "seed": 1}]:
+        regenerated = make_synthetic_connector(geoparquet_path=geoparquet_path, chunk_size=300, **other_parameters).db
+        expected = make_synthetic_connector(geoparquet_path=tmp_path / "expected", chunk_size=300, **other_parameters).db
+        pd.testing.assert_frame_equal(regenerated, expected)
+        shutil.rmtree(tmp_path / "expected")
+        assert len(list(geoparquet_path.glob("*.parquet"))) == 2
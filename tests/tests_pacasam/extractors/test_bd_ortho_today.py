@@ -0,0 +1,194 @@
+import asyncio
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+import pytest
+import rasterio
+
+from pacasam.extractors.bd_ortho_today import IRC_LAYER, RGB_LAYER, BDOrthoTodayExtractor
+from pacasam.extractors.wms import AsyncWMSDownloader, WMSRequestError, gather_or_cancel, make_getmap_params
+from conftest import LEFTY_UP_GEOMETRY, write_stand_in_orthoimage
+
+PIXEL_PER_METER = 5
+RESPONSE_DELAY_SECOND = 0.1
+# Layer for which the stand-in WMS answers with a ServiceException, with a status 200 (like some WMS servers).
+SERVICE_EXCEPTION_LAYER = "SERVICE.EXCEPTION"
+
+
+class StandInWMS(ThreadingHTTPServer):
+    """Local stand-in for the Géoplateforme WMS, serving GetMap requests from the test orthoimages.
+
+    The first `num_failures_per_image` requests of each image are answered with HTTP 503 (with a `Retry-After: 0` header).
+
+    """
+
+    def __init__(self, num_failures_per_image: int = 0):
+        super().__init__(("127.0.0.1", 0), StandInWMSHandler)
+        self.num_failures_per_image = num_failures_per_image
+        self.requests_per_image = Counter()
+        self.lock = threading.Lock()
+        self.num_in_flight = 0
+        self.max_num_in_flight = 0
+        self.connections = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/wms"
+
+
+class StandInWMSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive connections
+
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query, keep_blank_values=True).items()}
+        image = (params["LAYERS"], params["BBOX"])
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+            self.server.requests_per_image[image] += 1
+            self.server.num_in_flight += 1
+            self.server.max_num_in_flight = max(self.server.max_num_in_flight, self.server.num_in_flight)
+            fails = self.server.requests_per_image[image] <= self.server.num_failures_per_image
+        time.sleep(RESPONSE_DELAY_SECOND)
+        if fails:
+            self.respond(503, "text/plain", b"Overloaded", {"Retry-After": "0"})
+        elif params["LAYERS"] == SERVICE_EXCEPTION_LAYER:
+            self.respond(200, "text/xml", b"<ServiceExceptionReport>InvalidDimensionValue</ServiceExceptionReport>")
+        elif params["LAYERS"] not in (RGB_LAYER, IRC_LAYER):
+            self.respond(400, "text/xml", b"<ServiceExceptionReport>LayerNotDefined</ServiceExceptionReport>")
+        else:
+            bounds = tuple(float(v) for v in params["BBOX"].split(","))
+            with tempfile.NamedTemporaryFile(suffix=".tiff") as image_file:
+                write_stand_in_orthoimage(params["LAYERS"], bounds, PIXEL_PER_METER, image_file.name)
+                self.respond(200, "image/geotiff", Path(image_file.name).read_bytes())
+        with self.server.lock:
+            self.server.num_in_flight -= 1
+
+    def respond(self, status: int, content_type: str, body: bytes, headers: dict = {}):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_wms(request):
+    server = StandInWMS(num_failures_per_image=getattr(request, "param", 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def download(downloader_kwargs: dict, layer: str, outfile: str):
+    async def download_with_a_new_downloader():
+        async with AsyncWMSDownloader(**downloader_kwargs) as downloader:
+            await downloader.download(layer, "2154", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER, outfile)
+
+    asyncio.run(download_with_a_new_downloader())
+
+
+@pytest.mark.parametrize("stand_in_wms", [2], indirect=True)
+def test_download_retries_after_server_errors(stand_in_wms):
+    with tempfile.NamedTemporaryFile(suffix=".tiff") as outfile:
+        download({"url": stand_in_wms.url, "backoff_second": 60}, RGB_LAYER, outfile.name)
+        # Waiting times of Retry-After are used instead of the (long) backoff.
+        assert list(stand_in_wms.requests_per_image.values()) == [3]
+        with rasterio.open(outfile.name) as image:
+            assert image.count == 3 and image.width == 50 * PIXEL_PER_METER
+
+
+@pytest.mark.parametrize("stand_in_wms", [2], indirect=True)
+def test_download_fails_after_all_retries(stand_in_wms):
+    with tempfile.NamedTemporaryFile(suffix=".tiff") as outfile, pytest.raises(WMSRequestError, match="503"):
+        download({"url": stand_in_wms.url, "num_retries": 1}, RGB_LAYER, outfile.name)
+
+
+def test_download_does_not_retry_client_errors(stand_in_wms):
+    with tempfile.NamedTemporaryFile(suffix=".tiff") as outfile, pytest.raises(WMSRequestError, match="LayerNotDefined"):
+        download({"url": stand_in_wms.url}, "UNKNOWN.LAYER", outfile.name)
+    assert list(stand_in_wms.requests_per_image.values()) == [1]
+
+
+def test_download_does_not_retry_service_exceptions(stand_in_wms):
+    with tempfile.NamedTemporaryFile(suffix=".tiff") as outfile, pytest.raises(WMSRequestError, match="InvalidDimensionValue"):
+        download({"url": stand_in_wms.url, "backoff_second": 60}, SERVICE_EXCEPTION_LAYER, outfile.name)
+    assert list(stand_in_wms.requests_per_image.values()) == [1]
+
+
+def test_gather_or_cancel_cancels_the_other_coroutines():
+    cancelled = []
+
+    async def fail():
+        raise WMSRequestError("Failed request")
+
+    async def wait():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    start = time.perf_counter()
+    with pytest.raises(WMSRequestError):
+        asyncio.run(gather_or_cancel(wait(), fail(), wait()))
+    assert cancelled == [True, True] and time.perf_counter() - start < 10
+
+
+def test_make_getmap_params():
+    params = make_getmap_params(RGB_LAYER, "2154", (792000, 6271221, 792050, 6271271), PIXEL_PER_METER)
+    assert params["BBOX"] == "792000,6271221,792050,6271271"
+    assert params["CRS"] == "EPSG:2154" and params["WIDTH"] == params["HEIGHT"] == "250"
+
+
+@pytest.mark.parametrize("stand_in_wms", [1], indirect=True)
+def test_extract_concurrently(toy_sampling_file, stand_in_wms):
+    """Patches are extracted with concurrent requests over keep-alive connections, despite server errors."""
+    max_in_flight_requests = 4
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        extractor = BDOrthoTodayExtractor(None, toy_sampling_file.name, Path(tmp_dir), max_in_flight_requests=max_in_flight_requests)
+        extractor.wms_url = stand_in_wms.url
+        extractor.pixel_per_meter = PIXEL_PER_METER
+        extractor.extract()
+
+        num_patches = len(extractor.sampling)
+        # RGB and IRC of each patch, each requested twice.
+        assert len(stand_in_wms.requests_per_image) == 2 * num_patches
+        assert set(stand_in_wms.requests_per_image.values()) == {2}
+        assert 1 < stand_in_wms.max_num_in_flight <= max_in_flight_requests
+        assert len(stand_in_wms.connections) <= max_in_flight_requests
+        for patch_info in extractor.sampling.itertuples():
+            with rasterio.open(extractor._patch_path(patch_info)) as patch:
+                assert patch.count == 4 and patch.descriptions == ("Infrared", "Red", "Green", "Blue")
+                is_covered_by_stand_in = "left" in patch_info.file_path
+                assert (patch.read() > 0).any() if is_covered_by_stand_in else (patch.read() == 0).all()
+        assert len(list(Path(tmp_dir).glob("*/*.tiff"))) == num_patches  # and no temporary files
+        # Existing patches are not requested again.
+        extractor.extract()
+        assert sum(stand_in_wms.requests_per_image.values()) == 2 * 2 * num_patches
+
+
+def test_extract_concurrently_with_wms_cache(toy_sampling_file, stand_in_wms):
+    """Orthoimages requested by an extraction are reused by the next extractions of the same patches."""
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as tmp_dir:
+        for dataset_dir in ["first", "second"]:
+            extractor = BDOrthoTodayExtractor(
+                None, toy_sampling_file.name, Path(tmp_dir) / dataset_dir, max_in_flight_requests=4, wms_cache_dir=Path(cache_dir)
+            )
+            extractor.wms_url = stand_in_wms.url
+            extractor.extract()
+            assert sum(stand_in_wms.requests_per_image.values()) == 2 * len(extractor.sampling)
+        for patch_info in extractor.sampling.itertuples():
+            first_patch = Path(tmp_dir) / "first" / extractor._patch_path(patch_info).relative_to(Path(tmp_dir) / "second")
+            with rasterio.open(first_patch) as first, rasterio.open(extractor._patch_path(patch_info)) as second:
+                assert (first.read() == second.read()).all()
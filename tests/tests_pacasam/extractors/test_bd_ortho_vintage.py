@@ -0,0 +1,46 @@
+import numpy as np
+import rasterio
+from rasterio.mask import mask
+
+from pacasam.extractors.bd_ortho_vintage import (
+    BDORTHO_PIXELS_PER_METER,
+    DatasetReadersCache,
+    extract_patch_as_geotiffs,
+)
+from conftest import LEFTY_DOWN_GEOMETRY, LEFTY_UP_GEOMETRY
+
+RGB_VRT = "tests/data/bd_ortho_vintage/rgb/D30-2021.vrt"
+IRC_VRT = "tests/data/bd_ortho_vintage/irc/D30-2021.vrt"
+PATCH_WIDTH_PIXELS = 50 * BDORTHO_PIXELS_PER_METER
+
+
+def test_window_read_gives_the_same_patch_as_a_mask():
+    """Reading the window of a square patch gives the same pixels as masking the raster with the patch geometry."""
+    with rasterio.open(RGB_VRT) as rgb_open:
+        masked, _ = mask(rgb_open, [LEFTY_UP_GEOMETRY], crop=True)
+        windowed = extract_patch_as_geotiffs(rgb_open, LEFTY_UP_GEOMETRY.bounds, PATCH_WIDTH_PIXELS)
+    assert windowed.shape == (3, PATCH_WIDTH_PIXELS, PATCH_WIDTH_PIXELS)
+    assert np.array_equal(masked[:, :PATCH_WIDTH_PIXELS, :PATCH_WIDTH_PIXELS], windowed)
+
+
+def test_window_read_beyond_the_raster_is_padded_with_zeros():
+    """The raster ends before the bottom of the patch: the patch image keeps its size, and pixels beyond the raster are zeros."""
+    with rasterio.open(RGB_VRT) as rgb_open:
+        masked, _ = mask(rgb_open, [LEFTY_DOWN_GEOMETRY], crop=True)
+        windowed = extract_patch_as_geotiffs(rgb_open, LEFTY_DOWN_GEOMETRY.bounds, PATCH_WIDTH_PIXELS)
+    num_rows_in_raster = masked.shape[1]
+    assert num_rows_in_raster < PATCH_WIDTH_PIXELS
+    assert windowed.shape == (3, PATCH_WIDTH_PIXELS, PATCH_WIDTH_PIXELS)
+    assert np.array_equal(masked[:, :, :PATCH_WIDTH_PIXELS], windowed[:, :num_rows_in_raster])
+    assert (windowed[:, num_rows_in_raster:] == 0).all()
+
+
+def test_dataset_readers_cache():
+    """Rasters are opened once, and the least recently used dataset is closed beyond the size of the cache."""
+    cache = DatasetReadersCache(maxsize=1)
+    rgb_open = cache.open(RGB_VRT)
+    assert cache.open(RGB_VRT) is rgb_open
+    irc_open = cache.open(IRC_VRT)
+    assert rgb_open.closed and not irc_open.closed
+    cache.discard([IRC_VRT])
+    assert irc_open.closed
@@ -0,0 +1,60 @@
+import os
+from pathlib import Path
+import tempfile
+import numpy as np
+import geopandas as gpd
+import rasterio
+
+from pacasam.connectors.bbox import add_bbox_columns
+from pacasam.extractors.bd_ortho_vintage import BDORTHO_PIXELS_PER_METER, IRC_COLNAME, RGB_COLNAME, extract_rgbnir_patch_as_arrays
+from pacasam.extractors.cog_cache import COGCache, list_vrt_sources_overlapping_patches, stage_orthoimagery_sources
+from conftest import LEFTY_DOWN_GEOMETRY, LEFTY_UP_GEOMETRY
+
+RGB_VRT = "tests/data/bd_ortho_vintage/rgb/D30-2021.vrt"
+
+
+def test_list_vrt_sources_overlapping_patches():
+    """Only the sources of the VRT that overlap patches are listed (each once per band of the VRT)."""
+    up_patch_bounds = np.array([LEFTY_UP_GEOMETRY.bounds])
+    sources = set(list_vrt_sources_overlapping_patches(RGB_VRT, up_patch_bounds))
+    assert sources == {str(Path("tests/data/bd_ortho_vintage/rgb/792000_6272000-50mx100m-left-patch-0000000.tiff").resolve())}
+    all_patch_bounds = np.array([LEFTY_UP_GEOMETRY.bounds, LEFTY_DOWN_GEOMETRY.bounds])
+    assert len(set(list_vrt_sources_overlapping_patches(RGB_VRT, all_patch_bounds))) == 2
+
+
+def test_stage_orthoimagery_sources(toy_sampling_file_with_orthoimagery_filepaths):
+    """Patches read from the staged COGs (and local VRT) are identical to patches read from the sources."""
+    sampling = add_bbox_columns(gpd.read_file(toy_sampling_file_with_orthoimagery_filepaths.name))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = COGCache(Path(cache_dir))
+        staged = stage_orthoimagery_sources(sampling, [RGB_COLNAME, IRC_COLNAME], cache)
+        # 2 sources of the RGB VRT, and 2 IRC files.
+        assert len(list(Path(cache_dir).glob("*.tif"))) == 4
+        assert all(Path(path).parent == Path(cache_dir) for path in staged[RGB_COLNAME].tolist() + staged[IRC_COLNAME].tolist())
+        with rasterio.open(staged[IRC_COLNAME].iloc[0]) as cog:
+            assert cog.profile["tiled"] and cog.compression.value == "DEFLATE"
+        for patch, staged_patch in zip(sampling.itertuples(), staged.itertuples()):
+            bounds = patch.xmin, patch.ymin, patch.xmax, patch.ymax
+            arrays = extract_rgbnir_patch_as_arrays(patch.rgb_file, patch.irc_file, BDORTHO_PIXELS_PER_METER, bounds)
+            staged_arrays = extract_rgbnir_patch_as_arrays(staged_patch.rgb_file, staged_patch.irc_file, BDORTHO_PIXELS_PER_METER, bounds)
+            assert np.array_equal(arrays[0], staged_arrays[0]) and np.array_equal(arrays[1], staged_arrays[1])
+
+        # Staging again reuses the COGs.
+        cog_mtimes = {cog: cog.stat().st_mtime_ns for cog in Path(cache_dir).glob("*.tif")}
+        assert stage_orthoimagery_sources(sampling, [RGB_COLNAME, IRC_COLNAME], cache).equals(staged)
+        assert {cog: cog.stat().st_mtime_ns for cog in Path(cache_dir).glob("*.tif")}.keys() == cog_mtimes.keys()
+
+
+def test_cog_cache_evicts_least_recently_used_cogs():
+    irc_files = [
+        "tests/data/bd_ortho_vintage/irc/792000_6272000-50mx100m-left-patch-0000000.tiff",
+        "tests/data/bd_ortho_vintage/irc/792000_6272000-50mx100m-left-patch-0000001.tiff",
+    ]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = COGCache(Path(cache_dir), max_size_gb=0)
+        older_cog, newer_cog = [cache.transcode(irc_file) for irc_file in irc_files]
+        os.utime(older_cog, (0, 0))
+        cache.evict(keep=[newer_cog])
+        assert not older_cog.exists() and newer_cog.exists()
+        cache.evict()
+        assert not newer_cog.exists()
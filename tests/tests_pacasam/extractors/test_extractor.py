@@ -0,0 +1,26 @@
+from pathlib import Path
+import tempfile
+import pytest
+
+from pacasam.extractors.bd_ortho_vintage import RGB_COLNAME, BDOrthoVintageExtractor
+from pacasam.extractors.extractor import make_chunks, make_patch_records
+
+
+@pytest.mark.parametrize("num_patches,num_chunks,max_chunk_size", [(10, 4, 1000), (2, 8, 1000), (10_000, 4, 1000), (0, 4, 1000)])
+def test_make_chunks(num_patches, num_chunks, max_chunk_size):
+    chunks = make_chunks(num_patches, num_chunks, max_chunk_size)
+    assert [i for start, stop in chunks for i in range(start, stop)] == list(range(num_patches))
+    assert all(0 < stop - start <= max_chunk_size for start, stop in chunks)
+    assert len(chunks) >= min(num_patches, num_chunks)
+
+
+def test_patch_records_are_lightweight(toy_sampling_file_with_orthoimagery_filepaths):
+    """Workers receive records of the columns they read, without geometries."""
+    with tempfile.TemporaryDirectory() as dataset_root:
+        extractor = BDOrthoVintageExtractor(None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root))
+        records = make_patch_records(extractor.sampling, extractor.patch_record_columns)
+        assert list(records.columns) == extractor.patch_record_columns
+        assert (records[RGB_COLNAME].to_numpy() == extractor.sampling[RGB_COLNAME].to_numpy()).all()
+        # Chunks report their number of patches to the progress bar.
+        assert extractor._extract_chunk(records, 0, len(records)) == len(records)
+        assert len(extractor.journal.extracted_patches()) == len(extractor.sampling)
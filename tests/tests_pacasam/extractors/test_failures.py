@@ -0,0 +1,132 @@
+from pathlib import Path
+import tempfile
+import pandas as pd
+import pytest
+
+from pacasam.connectors.connector import PATCH_ID_COLNAME
+from pacasam.extractors.bd_ortho_vintage import BDOrthoVintageExtractor
+from pacasam.extractors.failures import FAILURES_DIRNAME, FailureLog
+from pacasam.extractors.laz import FILE_PATH_COLNAME, LAZExtractor
+
+
+class FlakyRasterError(Exception):
+    pass
+
+
+def make_flaky(extract_single_patch, failing_patch_id, num_failures: int, attempts_dir: Path):
+    """Wraps extract_single_patch so that it fails num_failures times for a patch. Attempts are counted in files, across workers."""
+
+    def flaky_extract_single_patch(self, patch_info):
+        if getattr(patch_info, PATCH_ID_COLNAME) == failing_patch_id:
+            attempt_file = attempts_dir / f"attempt-{len(list(attempts_dir.iterdir()))}"
+            attempt_file.touch()
+            if len(list(attempts_dir.iterdir())) <= num_failures:
+                raise FlakyRasterError(f"Corrupt raster for patch {failing_patch_id}")
+        extract_single_patch(self, patch_info)
+
+    return flaky_extract_single_patch
+
+
+@pytest.mark.parametrize("num_failures,num_retries", [(1, 2), (3, 2)])
+def test_failures_are_retried_then_reported(toy_sampling_file_with_orthoimagery_filepaths, monkeypatch, num_failures, num_retries):
+    with tempfile.TemporaryDirectory() as dataset_root, tempfile.TemporaryDirectory() as attempts_dir:
+        extractor = BDOrthoVintageExtractor(
+            None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root), fault_tolerant=True, num_retries=num_retries
+        )
+        failing_patch_id = extractor.sampling[PATCH_ID_COLNAME].iloc[0]
+        flaky = make_flaky(BDOrthoVintageExtractor.extract_single_patch, failing_patch_id, num_failures, Path(attempts_dir))
+        monkeypatch.setattr(BDOrthoVintageExtractor, "extract_single_patch", flaky)
+        extractor.extract()
+
+        assert len(list(Path(attempts_dir).iterdir())) == min(num_failures + 1, num_retries + 1)
+        assert not (Path(dataset_root) / FAILURES_DIRNAME).exists()
+        if num_failures <= num_retries:
+            assert extractor.failures_report is None
+            assert extractor.select_patches_to_extract().empty
+            return
+        # The other patches are extracted, and the failing one is reported with its traceback.
+        assert extractor.select_patches_to_extract()[PATCH_ID_COLNAME].tolist() == [failing_patch_id]
+        report = pd.read_parquet(extractor.failures_report)
+        assert report[PATCH_ID_COLNAME].tolist() == [failing_patch_id] and report["attempt"].tolist() == [num_retries]
+        assert "FlakyRasterError" in report["error"].iloc[0] and "flaky_extract_single_patch" in report["traceback"].iloc[0]
+
+
+def test_failures_abort_the_extraction_by_default(toy_sampling_file_with_orthoimagery_filepaths, monkeypatch):
+    with tempfile.TemporaryDirectory() as dataset_root, tempfile.TemporaryDirectory() as attempts_dir:
+        extractor = BDOrthoVintageExtractor(None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root))
+        failing_patch_id = extractor.sampling[PATCH_ID_COLNAME].iloc[0]
+        flaky = make_flaky(BDOrthoVintageExtractor.extract_single_patch, failing_patch_id, 1, Path(attempts_dir))
+        monkeypatch.setattr(BDOrthoVintageExtractor, "extract_single_patch", flaky)
+        with pytest.raises(FlakyRasterError):
+            extractor.extract()
+
+
+def test_failures_of_a_laz_file_are_recorded_for_all_its_patches(toy_sampling_file_with_orthoimagery_filepaths, monkeypatch):
+    with tempfile.TemporaryDirectory() as dataset_root:
+        extractor = LAZExtractor(None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root), fault_tolerant=True)
+        extractor.failure_log.reset()
+
+        def unreadable_file(self, single_file_path, single_file_sampling, is_subtask=False):
+            raise OSError(f"Cannot read {single_file_path}")
+
+        monkeypatch.setattr(LAZExtractor, "_extract_from_single_file", unreadable_file)
+        for single_file_path, single_file_sampling in extractor.sampling.groupby(FILE_PATH_COLNAME):
+            extractor._run_task(single_file_path, single_file_sampling, False)
+        failures = extractor.failure_log.failures()
+        assert sorted(failures[PATCH_ID_COLNAME]) == sorted(extractor.sampling[PATCH_ID_COLNAME])
+        assert failures["error"].str.startswith("OSError").all()
+
+
+def test_patches_saved_before_the_failure_of_a_laz_file_are_not_reported(toy_sampling_file_with_orthoimagery_filepaths, monkeypatch):
+    with tempfile.TemporaryDirectory() as dataset_root:
+        extractor = LAZExtractor(
+            None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root), fault_tolerant=True, num_retries=0
+        )
+        colorize_and_save_patch = LAZExtractor._colorize_and_save_patch
+        saved_patch_ids = []
+
+        def fails_after_the_first_patch_of_a_file(self, patch_info, patch, wms_orthoimages=None):
+            if saved_patch_ids and saved_patch_ids[-1][0] == getattr(patch_info, FILE_PATH_COLNAME):
+                raise OSError("Truncated file")
+            colorize_and_save_patch(self, patch_info, patch, wms_orthoimages=wms_orthoimages)
+            saved_patch_ids.append((getattr(patch_info, FILE_PATH_COLNAME), getattr(patch_info, PATCH_ID_COLNAME)))
+
+        def extract_patches_in_this_process(self, sampling):
+            for single_file_path, single_file_sampling in sampling.groupby(FILE_PATH_COLNAME):
+                self._run_task(single_file_path, single_file_sampling, False)
+
+        monkeypatch.setattr(LAZExtractor, "_colorize_and_save_patch", fails_after_the_first_patch_of_a_file)
+        monkeypatch.setattr(LAZExtractor, "extract_patches", extract_patches_in_this_process)
+        extractor.extract_and_retry_failures(extractor.sampling)
+
+        # Failures of the files are recorded for all their patches, but only the patches that were not saved are reported.
+        report = pd.read_parquet(extractor.failures_report)
+        saved = {patch_id for _, patch_id in saved_patch_ids}
+        assert saved and not saved & set(report[PATCH_ID_COLNAME])
+        assert sorted(report[PATCH_ID_COLNAME]) == sorted(extractor.select_patches_to_extract()[PATCH_ID_COLNAME])
+
+
+def test_failure_log_ignores_incomplete_lines():
+    with tempfile.TemporaryDirectory() as dataset_root:
+        failure_log = FailureLog(Path(dataset_root))
+        failure_log.reset()
+        (failure_log.failures_dir / "host-1.jsonl").write_text('{"patch_id": 1, "split": "tr')
+        assert failure_log.failures().empty
+        assert failure_log.write_report() is None and not failure_log.report_path.exists()
+
+
+def test_failures_of_lipac_patches_are_recorded_with_their_string_ids(toy_sampling_file_with_orthoimagery_filepaths, monkeypatch):
+    with tempfile.TemporaryDirectory() as dataset_root:
+        extractor = LAZExtractor(None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root), fault_tolerant=True)
+        # Patch ids of LiPaC, e.g. `0793_6272-000000123`.
+        extractor.sampling[PATCH_ID_COLNAME] = "0793_6272-" + extractor.sampling[PATCH_ID_COLNAME].astype(str).str.zfill(9)
+        extractor.failure_log.reset()
+
+        def unreadable_file(self, single_file_path, single_file_sampling, is_subtask=False):
+            raise OSError(f"Cannot read {single_file_path}")
+
+        monkeypatch.setattr(LAZExtractor, "_extract_from_single_file", unreadable_file)
+        for single_file_path, single_file_sampling in extractor.sampling.groupby(FILE_PATH_COLNAME):
+            extractor._run_task(single_file_path, single_file_sampling, False)
+        report = pd.read_parquet(extractor.failure_log.write_report(pending_patch_ids=extractor.sampling[PATCH_ID_COLNAME]))
+        assert sorted(report[PATCH_ID_COLNAME]) == sorted(extractor.sampling[PATCH_ID_COLNAME])
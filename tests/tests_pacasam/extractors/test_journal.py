@@ -0,0 +1,74 @@
+from pathlib import Path
+import tempfile
+import pytest
+
+from pacasam.connectors.connector import PATCH_ID_COLNAME
+from pacasam.extractors import journal
+from pacasam.extractors.bd_ortho_vintage import BDOrthoVintageExtractor
+from pacasam.extractors.journal import JOURNAL_DIRNAME, UNKNOWN_CHECKSUM, ExtractionJournal, sha1sum
+from pacasam.extractors.laz import FILE_PATH_COLNAME, LAZExtractor
+
+
+def test_journal_records_extracted_patches():
+    with tempfile.TemporaryDirectory() as dataset_root:
+        dataset_root = Path(dataset_root)
+        journal = ExtractionJournal(dataset_root)
+        journal.create()
+        assert journal.extracted_patches() == set()
+        (dataset_root / "train").mkdir()
+        patch_path = dataset_root / "train" / "TRAIN-0.laz"
+        patch_path.write_bytes(b"patch")
+        journal.record(patch_path)
+        # A line interrupted while being written is ignored.
+        with open(next((dataset_root / JOURNAL_DIRNAME).iterdir()), "a") as log:
+            log.write("train/TRAIN-1.laz\t5")
+        assert journal.extracted_patches() == {"train/TRAIN-0.laz"}
+        patch_line = next((dataset_root / JOURNAL_DIRNAME).iterdir()).read_text().splitlines()[0]
+        assert patch_line == f"train/TRAIN-0.laz\t5\t{sha1sum(patch_path)}"
+
+
+def test_journal_records_patches_of_a_dataset_extracted_without_journal():
+    with tempfile.TemporaryDirectory() as dataset_root:
+        dataset_root = Path(dataset_root)
+        (dataset_root / "val").mkdir()
+        (dataset_root / "val" / "VAL-3.laz").write_bytes(b"patch")
+        (dataset_root / "val" / ".VAL-4-tmp.laz").write_bytes(b"interrupted")
+        journal = ExtractionJournal(dataset_root)
+        journal.create()
+        assert journal.extracted_patches() == {"val/VAL-3.laz"}
+        assert f"val/VAL-3.laz\t5\t{UNKNOWN_CHECKSUM}" in (dataset_root / JOURNAL_DIRNAME).joinpath("existing.tsv").read_text()
+
+
+def test_extraction_resumes_from_the_journal(toy_sampling_file_with_orthoimagery_filepaths):
+    """Patches in the journal are not extracted again, even if their files are not checked."""
+    with tempfile.TemporaryDirectory() as dataset_root:
+        extractor = BDOrthoVintageExtractor(None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root))
+        assert len(extractor.select_patches_to_extract()) == len(extractor.sampling)
+        extractor.extract()
+        assert len(extractor.journal.extracted_patches()) == len(extractor.sampling)
+        resumed_extractor = BDOrthoVintageExtractor(None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root))
+        assert resumed_extractor.select_patches_to_extract().empty
+
+
+@pytest.mark.parametrize("extractor_class", [BDOrthoVintageExtractor, LAZExtractor])
+def test_patches_are_journaled_without_being_read_again(toy_sampling_file_with_orthoimagery_filepaths, monkeypatch, extractor_class):
+    """Sizes and checksums are those of the local copy (or of the patch in memory): saved patches (e.g. on a network share) are not read."""
+    with tempfile.TemporaryDirectory() as dataset_root:
+        extractor = extractor_class(None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root))
+        monkeypatch.setattr(journal, "sha1sum", None)  # used by ExtractionJournal.record only
+        sampling = extractor.sampling.iloc[:2]
+        if extractor_class is LAZExtractor:
+            for single_file_path, single_file_sampling in sampling.groupby(FILE_PATH_COLNAME):
+                extractor._extract_from_single_file(single_file_path, single_file_sampling)
+        else:
+            for patch_info in sampling.itertuples():
+                extractor.extract_single_patch(patch_info)
+        monkeypatch.undo()
+        lines = [line.split("\t") for log in (Path(dataset_root) / JOURNAL_DIRNAME).glob("*.tsv") for line in log.read_text().splitlines()]
+        assert sorted(patch for patch, _, _ in lines) == sorted(
+            extractor.journal.relative_path(extractor.make_new_patch_path(getattr(patch_info, PATCH_ID_COLNAME), patch_info.split))
+            for patch_info in sampling.itertuples()
+        )
+        for patch, size, checksum in lines:
+            patch_path = Path(dataset_root) / patch
+            assert int(size) == patch_path.stat().st_size and checksum == sha1sum(patch_path)
@@ -1,9 +1,12 @@
+from functools import partial
 from pathlib import Path
 import tempfile
 import numpy as np
 import laspy
 import pytest
 import requests
+from pacasam.connectors.connector import GEOMETRY_COLNAME
+from pacasam.extractors import bd_ortho_today, laz
 from pacasam.extractors.extractor import (
     check_all_files_exist,
     check_sampling_format,
@@ -11,17 +14,30 @@ from pacasam.extractors.extractor import (
 )
 
 from pacasam.extractors.laz import (
-    GEOMETRY_COLNAME,
+    FILE_PATH_COLNAME,
+    LAZExtractor,
+    PointGridIndex,
+    colorize_from_rgbnir,
     colorize_single_patch,
-    extract_single_patch_from_LasData,
+    crop_patches_from_cloud,
+    crop_patches_from_copc,
+    crop_single_patch_from_LasData,
+    extract_patches_by_streaming,
+    is_copc,
+    write_las_atomically,
+    write_patch_to_tmp_file,
 )
+from pacasam.extractors.bd_ortho_vintage import BDORTHO_PIXELS_PER_METER, extract_rgbnir_patch_as_arrays
 from conftest import (
+    NUM_TEST_FILES,
     LEFTY,
+    LEFTY_COPC,
     LEFTY_DOWN_GEOMETRY,
     LEFTY_UP_GEOMETRY,
     RIGHTY,
     RIGHTY_DOWN_GEOMETRY,
     RIGHTY_UP_GEOMETRY,
+    write_stand_in_orthoimage,
 )
 from pacasam.samplers.sampler import SPLIT_COLNAME
 
@@ -81,18 +97,171 @@ def test_load_sampling(toy_sampling_file):
     ],
 )
 @pytest.mark.slow  # This tests is somewhat slow
-def test_extract_single_patch_from_LasData(cloud_path_and_bounds):
+def test_crop_single_patch_from_LasData(cloud_path_and_bounds):
     cloud_path, patch_bounds = cloud_path_and_bounds
-    """Test the extraction of a single patch to the tmp file, based on bounds."""
+    """Test the cropping of a single patch, based on bounds."""
     cloud = laspy.read(cloud_path)
-    nocolor_patch_tmp_file: tempfile._TemporaryFileWrapper = extract_single_patch_from_LasData(cloud, cloud.header, patch_bounds)
-    patch_data = laspy.read(nocolor_patch_tmp_file.name)
+    patch_data = crop_single_patch_from_LasData(cloud, cloud.header, patch_bounds)
     # Test that non empty and the right size
     assert len(patch_data) > 0
     for dim in ["x", "y"]:
         assert patch_data[dim].max() - patch_data[dim].min() == pytest.approx(PATCH_WIDTH_METERS, abs=ONE_METER_ABS_TOLERANCE)
 
 
+@pytest.mark.parametrize(
+    "patch_bounds",
+    [
+        LEFTY_UP_GEOMETRY.bounds,
+        LEFTY_DOWN_GEOMETRY.bounds,
+        (792010.5, 6271180.25, 792033, 6271199),  # not aligned with the grid of the index
+        (792040, 6271250, 792090, 6271300),  # partly outside of the cloud
+        (0, 0, 50, 50),  # outside of the cloud
+    ],
+)
+def test_point_grid_index_gives_the_same_patch(patch_bounds):
+    """Cropping a patch via the index of the cloud gives the same points, in the same order, as a scan of the cloud."""
+    cloud = laspy.read(LEFTY)
+    point_index = PointGridIndex(cloud.x, cloud.y, cell_size=20)
+    scanned = crop_single_patch_from_LasData(cloud, cloud.header, patch_bounds)
+    indexed = crop_single_patch_from_LasData(cloud, cloud.header, patch_bounds, point_index=point_index)
+    assert np.array_equal(scanned.points.array, indexed.points.array)
+    xmin, ymin, xmax, ymax = patch_bounds
+    is_in_patch = (cloud.x >= xmin) & (cloud.x <= xmax) & (cloud.y >= ymin) & (cloud.y <= ymax)
+    assert np.array_equal(point_index.query(patch_bounds), np.flatnonzero(is_in_patch))
+
+
+# Sub-patches of LEFTY: with 2 patches, points are selected by a scan. With 8, they are selected via a PointGridIndex.
+LEFTY_SUBPATCHES_BOUNDS = [(792000 + dx, 6271171 + dy, 792000 + dx + 25, 6271171 + dy + 25) for dx in [0, 25] for dy in [0, 25, 50, 75]]
+
+
+@pytest.mark.parametrize(
+    "all_patch_bounds,max_num_writers", [(LEFTY_SUBPATCHES_BOUNDS[:2], 256), (LEFTY_SUBPATCHES_BOUNDS, 256), (LEFTY_SUBPATCHES_BOUNDS, 3)]
+)
+def test_extract_patches_by_streaming_gives_the_same_patches(all_patch_bounds, max_num_writers):
+    """Reading the cloud by small chunks (and by groups of patches) gives the same patches as reading it at once."""
+    in_memory_patches = list(crop_patches_from_cloud(LEFTY, all_patch_bounds))
+    streamed_tmp_files = list(extract_patches_by_streaming(LEFTY, all_patch_bounds, chunk_size=5_000, max_num_writers=max_num_writers))
+    assert len(streamed_tmp_files) == len(all_patch_bounds)
+    for in_memory, streamed_tmp_file in zip(in_memory_patches, streamed_tmp_files):
+        streamed = laspy.read(streamed_tmp_file.name)
+        in_memory.update_header()
+        assert len(streamed) > 0
+        assert np.array_equal(in_memory.points.array, streamed.points.array)
+        assert streamed.header.point_count == in_memory.header.point_count
+        assert np.allclose(streamed.header.mins, in_memory.header.mins)
+        assert np.allclose(streamed.header.maxs, in_memory.header.maxs)
+
+
+def test_extract_patches_from_copc_gives_the_same_patches():
+    """Querying the octree of a COPC file gives the same points as cropping the whole (plain LAZ) cloud, possibly in another order."""
+    assert is_copc(LEFTY_COPC) and not is_copc(LEFTY)
+    all_patch_bounds = LEFTY_SUBPATCHES_BOUNDS + [(792010.5, 6271180.25, 792033, 6271199), (0, 0, 50, 50)]
+    cropped_patches = list(crop_patches_from_cloud(LEFTY, all_patch_bounds))
+    queried_patches = list(crop_patches_from_copc(LEFTY_COPC, all_patch_bounds))
+    for cropped, queried in zip(cropped_patches, queried_patches):
+        # Queried patches are written as plain LAZ files.
+        with write_patch_to_tmp_file(queried) as queried_tmp_file:
+            assert not is_copc(queried_tmp_file.name)
+        assert len(queried.points) == len(cropped.points)
+        cropped_order, queried_order = np.lexsort((cropped.X, cropped.Y, cropped.Z)), np.lexsort((queried.X, queried.Y, queried.Z))
+        for dim in ["X", "Y", "Z", "intensity", "classification", "gps_time"]:
+            assert np.array_equal(cropped[dim][cropped_order], queried[dim][queried_order])
+
+
+def test_colorize_from_rgbnir():
+    """Points take the I-R-G-B values of the pixel that contains them, scaled to 16 bits. Points outside of the image keep their colors."""
+    rgb_file = "tests/data/bd_ortho_vintage/rgb/D30-2021.vrt"
+    irc_file = "tests/data/bd_ortho_vintage/irc/792000_6272000-50mx100m-left-patch-0000001.tiff"
+    patch_bounds = LEFTY_DOWN_GEOMETRY.bounds
+    rgb_arr, irc_arr, transform, _ = extract_rgbnir_patch_as_arrays(rgb_file, irc_file, BDORTHO_PIXELS_PER_METER, patch_bounds)
+    cloud = laspy.read(LEFTY)
+    # The patch image does not cover the points on its right and bottom edges, which keep their colors (in the "Red" extra dimension).
+    patch = crop_single_patch_from_LasData(cloud, cloud.header, patch_bounds)
+    colorized = colorize_from_rgbnir(patch, rgb_arr, irc_arr, transform)
+
+    assert colorized.point_format.id == 8
+    assert "Red" not in colorized.point_format.extra_dimension_names
+    # Pixels of points, as computed by GDAL
+    cols = np.floor(-transform.c / transform.a + np.asarray(colorized.x) * (1.0 / transform.a)).astype(int)
+    rows = np.floor(-transform.f / transform.e + np.asarray(colorized.y) * (1.0 / transform.e)).astype(int)
+    is_in_image = (cols < rgb_arr.shape[2]) & (rows < rgb_arr.shape[1])
+    assert is_in_image.any() and not is_in_image.all()
+    rows, cols = rows[is_in_image], cols[is_in_image]
+    assert np.array_equal(colorized.nir[is_in_image], irc_arr[0][rows, cols].astype(np.uint16) * 256)
+    assert np.array_equal(colorized.red[is_in_image], rgb_arr[0][rows, cols].astype(np.uint16) * 256)
+    assert np.array_equal(colorized.blue[is_in_image], rgb_arr[2][rows, cols].astype(np.uint16) * 256)
+    assert np.array_equal(colorized.red[~is_in_image], patch.Red[~is_in_image])
+    assert np.array_equal(colorized.X, patch.X)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        colorized_path = Path(tmp_dir) / "colorized.laz"
+        write_las_atomically(colorized, colorized_path)
+        assert [p.name for p in Path(tmp_dir).iterdir()] == ["colorized.laz"]
+        assert np.array_equal(laspy.read(colorized_path).points.array, colorized.points.array)
+
+
+def wms_stand_in(requested_layers, proj, layer, minx, miny, maxx, maxy, pixel_per_meter, outfile, timeout):
+    """Stand-in for the Géoplateforme WMS: serves the orthoimages of the test data (covering LEFTY only) over the requested bounds."""
+    requested_layers.append(layer)
+    write_stand_in_orthoimage(layer, (minx, miny, maxx, maxy), pixel_per_meter, outfile)
+
+
+def test_batch_wms_requests(toy_sampling_file, monkeypatch):
+    """Orthoimages are requested once per file (RGB and IRC), and all the patches of the file are colorized from them."""
+    requested_layers = []
+    monkeypatch.setattr(bd_ortho_today, "download_image_from_geoplateforme", partial(wms_stand_in, requested_layers))
+    with tempfile.TemporaryDirectory() as tmp_dir, pytest.warns(UserWarning, match="Géoplateforme"):
+        extractor = LAZExtractor(None, toy_sampling_file.name, Path(tmp_dir), batch_wms_requests=True)
+        for single_file_path, single_file_sampling in extractor.sampling.groupby(FILE_PATH_COLNAME):
+            extractor._extract_from_single_file(single_file_path, single_file_sampling)
+        assert requested_layers == [bd_ortho_today.RGB_LAYER, bd_ortho_today.IRC_LAYER] * NUM_TEST_FILES
+        for patch_info in extractor.sampling.itertuples():
+            patch = laspy.read(extractor._patch_path(patch_info))
+            assert patch.point_format.id == 8
+            is_covered_by_stand_in = "left" in getattr(patch_info, FILE_PATH_COLNAME)
+            assert (np.asarray(patch.nir) > 0).mean() > 0.9 if is_covered_by_stand_in else (np.asarray(patch.nir) == 0).all()
+
+
+def test_wms_cache(toy_sampling_file, monkeypatch):
+    """With a WMS cache, orthoimages are requested once per patch, and reused by later extractions of the same patches."""
+    requested_layers = []
+    monkeypatch.setattr(bd_ortho_today, "download_image_from_geoplateforme", partial(wms_stand_in, requested_layers))
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as tmp_dir, pytest.warns(UserWarning, match="Géoplateforme"):
+        for dataset_dir in ["first", "second"]:
+            extractor = LAZExtractor(None, toy_sampling_file.name, Path(tmp_dir) / dataset_dir, wms_cache_dir=Path(cache_dir))
+            for single_file_path, single_file_sampling in extractor.sampling.groupby(FILE_PATH_COLNAME):
+                extractor._extract_from_single_file(single_file_path, single_file_sampling)
+            assert requested_layers == [bd_ortho_today.RGB_LAYER, bd_ortho_today.IRC_LAYER] * len(extractor.sampling)
+        for patch_info in extractor.sampling.itertuples():
+            patch = laspy.read(extractor._patch_path(patch_info))
+            is_covered_by_stand_in = "left" in getattr(patch_info, FILE_PATH_COLNAME)
+            assert (np.asarray(patch.nir) > 0).mean() > 0.9 if is_covered_by_stand_in else (np.asarray(patch.nir) == 0).all()
+
+
+class ColorizationError(Exception):
+    pass
+
+
+@pytest.mark.parametrize("extractor_kwargs", [{"batch_wms_requests": True}, {"wms_cache_dir": "wms_cache"}])
+def test_wms_orthoimages_are_released_when_colorization_fails(toy_sampling_file, monkeypatch, extractor_kwargs):
+    """Readers of the temporary orthoimages are closed even if the colorization of a patch fails."""
+    monkeypatch.setattr(bd_ortho_today, "download_image_from_geoplateforme", partial(wms_stand_in, []))
+    discarded = []
+    monkeypatch.setattr(laz.DATASET_READERS_CACHE, "discard", lambda paths: discarded.append(tuple(paths)))
+
+    def failing_colorization(self, patch_info, patch, wms_orthoimages=None):
+        raise ColorizationError()
+
+    monkeypatch.setattr(LAZExtractor, "_colorize_and_save_patch", failing_colorization)
+    with tempfile.TemporaryDirectory() as tmp_dir, pytest.warns(UserWarning, match="Géoplateforme"):
+        extractor_kwargs = {key: Path(tmp_dir) / value if key == "wms_cache_dir" else value for key, value in extractor_kwargs.items()}
+        extractor = LAZExtractor(None, toy_sampling_file.name, Path(tmp_dir) / "dataset", **extractor_kwargs)
+        single_file_path, single_file_sampling = next(iter(extractor.sampling.groupby(FILE_PATH_COLNAME)))
+        with pytest.raises(ColorizationError):
+            extractor._extract_from_single_file(single_file_path, single_file_sampling)
+    assert len(discarded) == 1 and [Path(path).name for path in discarded[0]] == ["rgb.tiff", "irc.tiff"]
+
+
 @pytest.mark.parametrize("cloud_path", [LEFTY, RIGHTY])
 def test_lefty_and_righty_color_are_white_and_equal(cloud_path):
     """Verifies that test data is pure white (R==G==B, filled with 65280).
@@ -0,0 +1,88 @@
+from pathlib import Path
+import tempfile
+import laspy
+import numpy as np
+
+from pacasam.connectors.connector import PATCH_ID_COLNAME
+from pacasam.extractors.laz import FILE_PATH_COLNAME, LAZExtractor
+from pacasam.extractors.journal import ExtractionJournal
+from pacasam.extractors.point_arrays import PARTS_DIRNAME, POINT_ARRAYS_LAYOUT, POINTS_DIRNAME, PointArraysWriter, gather_point_arrays
+from pacasam.samplers.sampler import SPLIT_COLNAME
+
+
+def extract_from_all_files(extractor: LAZExtractor, sampling):
+    for single_file_path, single_file_sampling in sampling.groupby(FILE_PATH_COLNAME):
+        extractor._extract_from_single_file(single_file_path, single_file_sampling)
+    extractor.finalize_output()
+
+
+def load_point_arrays(split_dir: Path) -> dict:
+    points_dir = split_dir / POINTS_DIRNAME
+    return {array.stem: np.load(array, mmap_mode="r") for array in points_dir.glob("*.npy")}
+
+
+def test_extract_laz_patches_to_point_arrays(toy_sampling_file_with_orthoimagery_filepaths):
+    """Patches saved as point arrays are the same as LAZ patches, and are appended to the arrays of previous extractions."""
+    sampling_path = toy_sampling_file_with_orthoimagery_filepaths.name
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files_extractor = LAZExtractor(None, sampling_path, Path(tmp_dir) / "files")
+        extract_from_all_files(files_extractor, files_extractor.sampling)
+
+        extractor = LAZExtractor(None, sampling_path, Path(tmp_dir) / "npy", output_layout=POINT_ARRAYS_LAYOUT)
+        first_patch_ids = extractor.sampling[PATCH_ID_COLNAME].iloc[::2]
+        extract_from_all_files(extractor, extractor.sampling[extractor.sampling[PATCH_ID_COLNAME].isin(first_patch_ids)])
+        # The other patches are appended to the arrays when resuming.
+        resumed_extractor = LAZExtractor(None, sampling_path, Path(tmp_dir) / "npy", output_layout=POINT_ARRAYS_LAYOUT)
+        to_extract = resumed_extractor.select_patches_to_extract()
+        assert not to_extract[PATCH_ID_COLNAME].isin(first_patch_ids).any()
+        extract_from_all_files(resumed_extractor, to_extract)
+        assert resumed_extractor.select_patches_to_extract().empty
+
+        for split, split_sampling in extractor.sampling.groupby(SPLIT_COLNAME):
+            split_dir = Path(tmp_dir) / "npy" / split
+            assert not (split_dir / PARTS_DIRNAME).exists()
+            arrays = load_point_arrays(split_dir)
+            assert sorted(arrays["patch_ids"]) == sorted(split_sampling[PATCH_ID_COLNAME])
+            assert arrays["offsets"][-1] == len(arrays["xyz"]) == len(arrays["rgbnir"])
+            for i, patch_id in enumerate(arrays["patch_ids"]):
+                las = laspy.read(files_extractor.make_new_patch_path(patch_id=patch_id, split=split))
+                start, end = arrays["offsets"][i], arrays["offsets"][i + 1]
+                assert end - start == len(las.points)
+                assert np.allclose(arrays["xyz"][start:end] + arrays["origins"][i], las.xyz, atol=0.01)
+                assert (arrays["classification"][start:end] == las.classification).all()
+                assert (arrays["rgbnir"][start:end, 0] == las.red).all() and (arrays["rgbnir"][start:end, 3] == las.nir).all()
+
+
+def test_unclosed_parts_are_not_gathered(toy_sampling_file_with_orthoimagery_filepaths):
+    with tempfile.TemporaryDirectory() as dataset_root:
+        extractor = LAZExtractor(
+            None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root), output_layout=POINT_ARRAYS_LAYOUT
+        )
+        # e.g. a worker interrupted before its part was closed.
+        split = extractor.sampling[SPLIT_COLNAME].iloc[0]
+        unclosed_writer = PointArraysWriter(Path(dataset_root), split, extractor.journal, extractor.patch_suffix)
+        extractor.finalize_output()
+        for raw_file in unclosed_writer.raw_files.values():
+            raw_file.close()
+        assert not (Path(dataset_root) / split / POINTS_DIRNAME).exists()
+        assert not (Path(dataset_root) / split / PARTS_DIRNAME).exists()
+        assert len(extractor.select_patches_to_extract()) == len(extractor.sampling)
+
+
+def test_point_arrays_keep_string_patch_ids():
+    """Patch ids of LiPaC samplings are strings (e.g. `0793_6272-000000123`), of varying lengths across parts."""
+    las = laspy.create(point_format=3, file_version="1.2")
+    las.x, las.y, las.z = np.array([1.0, 2.0]), np.array([3.0, 4.0]), np.array([5.0, 6.0])
+    with tempfile.TemporaryDirectory() as dataset_root:
+        journal = ExtractionJournal(Path(dataset_root))
+        journal.create()
+        patch_ids = ["0793_6272-000000123", "0793_6272-000000124", "10793_6272-000000125"]
+        for part_patch_ids in [patch_ids[:2], patch_ids[2:]]:
+            writer = PointArraysWriter(Path(dataset_root), "train", journal, ".laz")
+            for patch_id in part_patch_ids:
+                writer.add(patch_id, las, (0.0, 0.0, 50.0, 50.0))
+            writer.close()
+            gather_point_arrays(Path(dataset_root) / "train")
+        arrays = load_point_arrays(Path(dataset_root) / "train")
+        assert arrays["patch_ids"].tolist() == patch_ids
+        assert journal.extracted_patches() == {f"train/TRAIN-{patch_id}.laz" for patch_id in patch_ids}
@@ -0,0 +1,72 @@
+from pathlib import Path
+import tempfile
+import numpy as np
+import laspy
+import pandas as pd
+import pytest
+
+from pacasam.connectors.connector import PATCH_ID_COLNAME
+from pacasam.extractors.laz import crop_patches_from_cloud, get_union_of_bounds, read_cloud_within_bounds
+from pacasam.extractors.scheduling import BYTES_IN_A_GB, compute_worker_utilization, estimate_task_cost, schedule_tasks, spatial_order
+from conftest import LEFTY
+
+# Sub-patches of LEFTY, enough to be cropped via a PointGridIndex.
+LEFTY_SUBPATCHES_BOUNDS = [(792000 + dx, 6271171 + dy, 792000 + dx + 25, 6271171 + dy + 25) for dx in [0, 25] for dy in [0, 25, 50, 75]]
+
+
+@pytest.fixture
+def file_samplings():
+    """Tasks of a dense tile (300 patches) and of 9 light tiles (10 patches), with files of 0.1GB."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_samplings = []
+        for file_rank, num_patches in enumerate([10] * 5 + [300] + [10] * 4):
+            file_path = Path(tmp_dir) / f"tile-{file_rank}.laz"
+            with open(file_path, "wb") as f:
+                f.truncate(BYTES_IN_A_GB // 10)  # sparse file
+            file_samplings.append((str(file_path), pd.DataFrame({PATCH_ID_COLNAME: file_rank * 1000 + np.arange(num_patches)})))
+        yield file_samplings
+
+
+def test_schedule_tasks_submits_longest_tasks_first(file_samplings):
+    tasks = schedule_tasks(file_samplings, num_jobs=1)
+    assert [len(sampling) for _, sampling, _ in tasks] == [300] + [10] * 9
+    assert not any(is_subtask for _, _, is_subtask in tasks)
+
+
+def test_schedule_tasks_splits_heavy_tasks(file_samplings):
+    num_jobs = 4
+    tasks = schedule_tasks(file_samplings, num_jobs=num_jobs)
+    dense_tile = file_samplings[5][0]
+    subtasks = [sampling for file_path, sampling, is_subtask in tasks if is_subtask]
+    assert 1 < len(subtasks) <= num_jobs and all(file_path == dense_tile for file_path, _, is_subtask in tasks if is_subtask)
+    # Sub-tasks hold all the patches of the dense tile, once.
+    assert sorted(pd.concat(subtasks)[PATCH_ID_COLNAME]) == sorted(file_samplings[5][1][PATCH_ID_COLNAME])
+    costs = [estimate_task_cost(BYTES_IN_A_GB // 10, len(sampling)) for _, sampling, _ in tasks]
+    assert costs == sorted(costs, reverse=True)
+    # The heaviest task now fits the mean load of a worker.
+    assert costs[0] <= sum(costs) / num_jobs
+
+
+def test_compute_worker_utilization():
+    task_timings = [(1, 3.0), (2, 1.0), (1, 1.0)]
+    assert compute_worker_utilization(task_timings, wall_time_second=5.0, num_jobs=3) == [0.8, 0.2, 0.0]
+
+
+def test_subtasks_give_the_same_patches_from_their_area():
+    """Sub-tasks of a file only keep the points of the area of their patches, and give the same patches."""
+    patches = list(crop_patches_from_cloud(LEFTY, LEFTY_SUBPATCHES_BOUNDS))
+    first_subtask = list(crop_patches_from_cloud(LEFTY, LEFTY_SUBPATCHES_BOUNDS[:4], within_union_of_bounds=True))
+    second_subtask = list(crop_patches_from_cloud(LEFTY, LEFTY_SUBPATCHES_BOUNDS[4:], within_union_of_bounds=True))
+    for patch, subtask_patch in zip(patches, first_subtask + second_subtask):
+        assert np.array_equal(patch.points.array, subtask_patch.points.array)
+    area = read_cloud_within_bounds(LEFTY, get_union_of_bounds(LEFTY_SUBPATCHES_BOUNDS[:4]), chunk_size=10_000)
+    assert 0 < len(area.points) < laspy.open(LEFTY).header.point_count
+
+
+def test_heavy_tasks_are_split_into_compact_areas():
+    xmin, ymin = np.meshgrid(np.arange(4) * 50, np.arange(4) * 50)
+    sampling = pd.DataFrame({PATCH_ID_COLNAME: np.arange(16), "xmin": xmin.ravel(), "ymin": ymin.ravel()})
+    sampling["xmax"], sampling["ymax"] = sampling["xmin"] + 50, sampling["ymin"] + 50
+    rows = spatial_order(sampling)
+    assert list(sampling["xmin"].iloc[rows]) == sorted(sampling["xmin"])
+    assert list(spatial_order(sampling[[PATCH_ID_COLNAME]])) == list(range(16))
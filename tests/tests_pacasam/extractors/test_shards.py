@@ -0,0 +1,81 @@
+import io
+from pathlib import Path
+import tarfile
+import tempfile
+import laspy
+import pandas as pd
+import pytest
+from rasterio.io import MemoryFile
+
+from pacasam.extractors.bd_ortho_vintage import BDOrthoVintageExtractor
+from pacasam.extractors.laz import FILE_PATH_COLNAME, LAZExtractor
+from pacasam.extractors.journal import ExtractionJournal
+from pacasam.extractors.shards import INDEX_FILENAME, SHARDS_LAYOUT, ShardWriter, read_patch_from_shard, write_index
+
+PATCH_SIZE = 1000
+
+
+def test_shard_writer_bounds_the_size_of_shards():
+    with tempfile.TemporaryDirectory() as dataset_root, tempfile.TemporaryDirectory() as tmp_dir:
+        dataset_root = Path(dataset_root)
+        (dataset_root / "train").mkdir()
+        journal = ExtractionJournal(dataset_root)
+        journal.create()
+        writer = ShardWriter(dataset_root, "train", max_shard_size_bytes=2.5 * PATCH_SIZE, journal=journal)
+        patches = {}
+        for patch_id in range(5):
+            patches[patch_id] = Path(tmp_dir) / f"{patch_id}.laz"
+            patches[patch_id].write_bytes(bytes([patch_id]) * PATCH_SIZE)
+            writer.add(patch_id, patches[patch_id], f"TRAIN-{patch_id}.laz")
+        # Patches of the shard in progress are not recorded yet.
+        assert journal.extracted_patches() == {f"train/TRAIN-{patch_id}.laz" for patch_id in range(4)}
+        writer.close()
+        assert journal.extracted_patches() == {f"train/TRAIN-{patch_id}.laz" for patch_id in range(5)}
+
+        shards = sorted((dataset_root / "train").glob("*.tar"))
+        assert len(shards) == 3 and not list((dataset_root / "train").glob(".*"))
+        index = pd.read_parquet(write_index(dataset_root))
+        assert sorted(index["patch_id"]) == list(range(5)) and index["shard"].nunique() == 3
+        for row in index.itertuples():
+            assert read_patch_from_shard(dataset_root, row) == patches[row.patch_id].read_bytes()
+        with tarfile.open(dataset_root / index["shard"].iloc[0]) as shard:
+            assert shard.getnames() == index[index["shard"] == index["shard"].iloc[0]]["member"].tolist()
+
+
+@pytest.mark.parametrize("num_jobs", [1, 2])
+def test_extract_to_shards(toy_sampling_file_with_orthoimagery_filepaths, num_jobs):
+    """Patches are identical in shards and in files, and are not extracted again when resuming."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sampling_path = toy_sampling_file_with_orthoimagery_filepaths.name
+        files_extractor = BDOrthoVintageExtractor(None, sampling_path, Path(tmp_dir) / "files")
+        files_extractor.extract()
+        shards_extractor = BDOrthoVintageExtractor(
+            None, sampling_path, Path(tmp_dir) / "shards", num_jobs=num_jobs, output_layout=SHARDS_LAYOUT
+        )
+        shards_extractor.extract()
+
+        index = pd.read_parquet(Path(tmp_dir) / "shards" / INDEX_FILENAME)
+        assert sorted(index["patch_id"]) == sorted(shards_extractor.sampling["patch_id"])
+        assert not list((Path(tmp_dir) / "shards").glob("*/*.tiff"))
+        for row in index.itertuples():
+            with MemoryFile(read_patch_from_shard(Path(tmp_dir) / "shards", row)) as memfile, memfile.open() as patch:
+                patch_path = files_extractor.make_new_patch_path(patch_id=row.patch_id, split=row.split)
+                assert patch_path.name == row.member
+                with MemoryFile(patch_path.read_bytes()) as file_memfile, file_memfile.open() as file_patch:
+                    assert (patch.read() == file_patch.read()).all()
+
+        resumed_extractor = BDOrthoVintageExtractor(None, sampling_path, Path(tmp_dir) / "shards", output_layout=SHARDS_LAYOUT)
+        assert resumed_extractor.select_patches_to_extract().empty
+
+
+def test_extract_laz_patches_to_shards(toy_sampling_file_with_orthoimagery_filepaths):
+    with tempfile.TemporaryDirectory() as dataset_root:
+        extractor = LAZExtractor(None, toy_sampling_file_with_orthoimagery_filepaths.name, Path(dataset_root), output_layout=SHARDS_LAYOUT)
+        for single_file_path, single_file_sampling in extractor.sampling.groupby(FILE_PATH_COLNAME):
+            extractor._extract_from_single_file(single_file_path, single_file_sampling)
+        extractor.finalize_output()
+        index = pd.read_parquet(Path(dataset_root) / INDEX_FILENAME)
+        assert index["member"].tolist() == [extractor._patch_path(p).name for p in extractor.sampling.itertuples()]
+        for row in index.itertuples():
+            patch = laspy.read(io.BytesIO(read_patch_from_shard(Path(dataset_root), row)))
+            assert patch.point_format.id == 8 and len(patch.points) > 0
@@ -0,0 +1,54 @@
+import os
+from pathlib import Path
+import tempfile
+from mpire import WorkerPool
+
+from pacasam.extractors.bd_ortho_today import IRC_LAYER, RGB_LAYER
+from pacasam.extractors.wms_cache import WMSImageCache
+from conftest import LEFTY_DOWN_GEOMETRY, LEFTY_UP_GEOMETRY
+
+IRC_IMAGE = "tests/data/bd_ortho_vintage/irc/792000_6272000-50mx100m-left-patch-0000000.tiff"
+PIXEL_PER_METER = 5
+
+
+def test_wms_cache_fetches_stored_images():
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as out_dir:
+        cache = WMSImageCache(Path(cache_dir))
+        outfile = Path(out_dir) / "irc.tiff"
+        assert not cache.fetch(IRC_LAYER, "2154", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER, outfile)
+        cache.store(IRC_LAYER, "2154", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER, IRC_IMAGE)
+        # Same image, whatever the types of the parameters.
+        integer_bounds = tuple(int(b) for b in LEFTY_UP_GEOMETRY.bounds)
+        assert cache.fetch(IRC_LAYER, 2154, integer_bounds, float(PIXEL_PER_METER), outfile)
+        assert outfile.read_bytes() == Path(IRC_IMAGE).read_bytes()
+        # Any other layer, srid, bounds, or resolution is another image.
+        assert not cache.fetch(RGB_LAYER, "2154", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER, outfile)
+        assert not cache.fetch(IRC_LAYER, "2975", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER, outfile)
+        assert not cache.fetch(IRC_LAYER, "2154", LEFTY_DOWN_GEOMETRY.bounds, PIXEL_PER_METER, outfile)
+        assert not cache.fetch(IRC_LAYER, "2154", LEFTY_UP_GEOMETRY.bounds, 2 * PIXEL_PER_METER, outfile)
+
+
+def test_wms_cache_supports_concurrent_writers():
+    """Processes that store the same image concurrently leave a single complete image, and no temporary files."""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = WMSImageCache(Path(cache_dir))
+        with WorkerPool(n_jobs=4) as pool:
+            pool.map(cache.store, [(IRC_LAYER, "2154", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER, IRC_IMAGE)] * 16)
+        cached_files = [p for p in Path(cache_dir).rglob("*") if p.is_file()]
+        assert cached_files == [cache.image_path(IRC_LAYER, "2154", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER)]
+        assert cached_files[0].read_bytes() == Path(IRC_IMAGE).read_bytes()
+
+
+def test_wms_cache_evicts_least_recently_used_images():
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as out_dir:
+        image_size_gb = os.stat(IRC_IMAGE).st_size / 1024**3
+        cache = WMSImageCache(Path(cache_dir), max_size_gb=1.5 * image_size_gb)
+        cache.store(IRC_LAYER, "2154", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER, IRC_IMAGE)
+        cache.store(IRC_LAYER, "2154", LEFTY_DOWN_GEOMETRY.bounds, PIXEL_PER_METER, IRC_IMAGE)
+        os.utime(cache.image_path(IRC_LAYER, "2154", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER), (0, 0))
+        # Fetching the older image marks it as recently used.
+        assert cache.fetch(IRC_LAYER, "2154", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER, Path(out_dir) / "irc.tiff")
+        os.utime(cache.image_path(IRC_LAYER, "2154", LEFTY_DOWN_GEOMETRY.bounds, PIXEL_PER_METER), (1, 1))
+        cache.evict()
+        assert cache.image_path(IRC_LAYER, "2154", LEFTY_UP_GEOMETRY.bounds, PIXEL_PER_METER).exists()
+        assert not cache.image_path(IRC_LAYER, "2154", LEFTY_DOWN_GEOMETRY.bounds, PIXEL_PER_METER).exists()
@@ -0,0 +1,123 @@
+import logging
+import time
+import numpy as np
+import pandas as pd
+import pytest
+
+from pacasam.connectors.connector import FILE_ID_COLNAME, PATCH_ID_COLNAME
+from pacasam.connectors.synthetic import NB_POINTS_COLNAMES, SyntheticConnector
+from pacasam.samplers import algos
+from pacasam.samplers.algos import FPS_ENGINES, STRATIFICATION_METHODS, fps, normalize_df, sample_with_stratification
+
+NUM_POINTS = 2000
+NUM_DIMS = 9
+NUM_TO_SAMPLE = 200
+
+
+# Three strata of very different sizes.
+STRATA_SIZES = {"big": 100, "small": 5, "medium": 50}
+
+
+@pytest.fixture()
+def stratified_patches() -> pd.DataFrame:
+    file_ids = np.concatenate([np.full(n, fill_value=file_id) for file_id, n in STRATA_SIZES.items()])
+    return pd.DataFrame({PATCH_ID_COLNAME: range(len(file_ids)), FILE_ID_COLNAME: file_ids})
+
+
+@pytest.fixture()
+def random_points() -> np.ndarray:
+    # Small integer values so that both engines compute the exact same distances, whatever the summation order.
+    return np.random.default_rng(0).integers(low=0, high=100, size=(NUM_POINTS, NUM_DIMS)).astype(float)
+
+
+def test_fps_inplace_matches_legacy(random_points):
+    legacy = fps(random_points, NUM_TO_SAMPLE, engine="legacy")
+    inplace = fps(random_points, NUM_TO_SAMPLE, engine="inplace")
+    assert np.array_equal(legacy, inplace)
+
+
+@pytest.mark.parametrize("engine", FPS_ENGINES.keys())
+def test_fps_returns_distinct_indices(random_points, engine):
+    sample_inds = fps(random_points, NUM_TO_SAMPLE, engine=engine)
+    assert len(sample_inds) == NUM_TO_SAMPLE
+    assert len(np.unique(sample_inds)) == NUM_TO_SAMPLE
+
+
+def test_fps_inplace_never_selects_twice_with_duplicated_points():
+    # All points are identical: distances are all zero, but each point must still be selected once.
+    arr = np.zeros(shape=(10, NUM_DIMS))
+    sample_inds = fps(arr, 10)
+    assert sorted(sample_inds) == list(range(10))
+
+
+def test_fps_with_unknown_engine_raises_error(random_points):
+    with pytest.raises(ValueError):
+        fps(random_points, NUM_TO_SAMPLE, engine="unknown")
+
+
+@pytest.mark.parametrize("method", STRATIFICATION_METHODS)
+def test_sample_with_stratification_spreads_patches_across_strata(stratified_patches, method):
+    num_to_sample = 60
+    sampled = sample_with_stratification(stratified_patches, num_to_sample, keys=[FILE_ID_COLNAME], method=method)
+    assert len(sampled) == num_to_sample
+    assert sampled[PATCH_ID_COLNAME].is_unique
+    # The small strata is exhausted.
+    assert sampled[FILE_ID_COLNAME].value_counts()["small"] == STRATA_SIZES["small"]
+
+
+def test_sample_with_stratification_round_robin_is_balanced(stratified_patches):
+    sampled = sample_with_stratification(stratified_patches, 60, keys=[FILE_ID_COLNAME], method="round_robin")
+    counts = sampled[FILE_ID_COLNAME].value_counts()
+    # The remaining patches are shared evenly by the two strata that are not exhausted.
+    assert abs(counts["big"] - counts["medium"]) <= 1
+
+
+@pytest.mark.parametrize("method", STRATIFICATION_METHODS)
+def test_sample_with_stratification_takes_at_most_one_patch_by_strata(stratified_patches, method):
+    sampled = sample_with_stratification(stratified_patches, 2, keys=[FILE_ID_COLNAME], method=method)
+    assert len(sampled) == 2
+    assert sampled[FILE_ID_COLNAME].is_unique
+
+
+def test_sample_with_stratification_round_robin_draws_strata_uniformly(monkeypatch):
+    """With fewer patches to sample than strata, a large stratum is not more likely to be drawn than the others."""
+    file_ids = np.concatenate([np.full(400, fill_value="big")] + [np.full(4, fill_value=f"small-{rank}") for rank in range(99)])
+    patches = pd.DataFrame({PATCH_ID_COLNAME: range(len(file_ids)), FILE_ID_COLNAME: file_ids})
+    num_runs = 300
+    num_runs_with_big = 0
+    for random_state in range(num_runs):
+        monkeypatch.setattr(algos, "GLOBAL_RANDOM_STATE", random_state)
+        sampled = sample_with_stratification(patches, 10, keys=[FILE_ID_COLNAME], method="round_robin")
+        num_runs_with_big += "big" in set(sampled[FILE_ID_COLNAME])
+    # 10 strata out of 100: the large stratum is expected in 10% of the runs.
+    assert 0.03 < num_runs_with_big / num_runs < 0.2
+
+
+def test_sample_with_stratification_is_deterministic(stratified_patches):
+    first = sample_with_stratification(stratified_patches, 30, keys=[FILE_ID_COLNAME])
+    second = sample_with_stratification(stratified_patches, 30, keys=[FILE_ID_COLNAME])
+    assert first.equals(second)
+
+
+def test_sample_with_stratification_with_unknown_method_raises_error(stratified_patches):
+    with pytest.raises(ValueError):
+        sample_with_stratification(stratified_patches, 30, method="unknown")
+
+
+@pytest.mark.slow
+def test_benchmark_fps_engines_on_synthetic_data():
+    """Benchmark of the FPS engines on synthetic class histograms, with the chunk size used for LiPaC."""
+    db_size = 20_000
+    num_to_sample = 2_000
+    connector = SyntheticConnector(log=None, binary_descriptors_prevalence=[0.1], split="any", db_size=db_size)
+    db = normalize_df(df=connector.db[NB_POINTS_COLNAMES], columns=NB_POINTS_COLNAMES)
+    arr = db[NB_POINTS_COLNAMES].values
+
+    durations = {}
+    for engine in FPS_ENGINES:
+        start = time.perf_counter()
+        fps(arr, num_to_sample, engine=engine)
+        durations[engine] = time.perf_counter() - start
+        logging.info(f"FPS engine `{engine}`: {num_to_sample} out of {db_size} in {durations[engine]:.2f}s")
+
+    assert durations["inplace"] < durations["legacy"]
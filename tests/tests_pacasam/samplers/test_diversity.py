@@ -0,0 +1,24 @@
+from pacasam.samplers.diversity import DiversitySampler
+from pacasam.utils import load_sampling_config
+
+
+def test_diversity_sampler_is_identical_in_serial_and_in_parallel(synthetic_connector, session_logger):
+    conf = load_sampling_config("configs/Synthetic.yml")
+    # Small chunks to have several independent FPS tasks.
+    conf["DiversitySampler"]["max_chunk_size_for_fps"] = 30
+    conf["DiversitySampler"]["num_workers"] = 1
+    serial = DiversitySampler(connector=synthetic_connector, sampling_config=conf, log=session_logger).get_patches()
+
+    conf["DiversitySampler"]["num_workers"] = 2
+    parallel = DiversitySampler(connector=synthetic_connector, sampling_config=conf, log=session_logger).get_patches()
+
+    assert len(serial) == conf["target_total_num_patches"]
+    assert serial.equals(parallel)
+
+
+def test_diversity_sampler_yields_an_empty_sampling_from_no_candidates(synthetic_connector, session_logger):
+    conf = load_sampling_config("configs/Synthetic.yml")
+    sampler = DiversitySampler(connector=synthetic_connector, sampling_config=conf, log=session_logger)
+    no_candidates = synthetic_connector.db.iloc[:0]
+    patches = list(sampler._get_patches_via_fps(no_candidates, num_to_sample=10, cols_for_fps=conf["DiversitySampler"]["columns"]))
+    assert len(patches) == 1 and patches[0].empty
@@ -1,6 +1,12 @@
+from pathlib import Path
 import tempfile
+from unittest.mock import MagicMock
 import pytest
 import geopandas as gpd
+import shapely
+import yaml
+from pacasam.connectors import lipac
+from pacasam.connectors.lipac import LazyLiPaCConnector
 from pacasam.connectors.geopandas import GeopandasConnector
 from pacasam.run_sampling import run_sampling
 from pacasam.run_sampling import parser
@@ -9,9 +15,10 @@ from pacasam.samplers.sampler import Sampler
 from pacasam.utils import SAMPLERS_LIBRARY
 
 
-def _run_sampling_by_args(sampler_class, output_path, connector_class, config_file):
+def _run_sampling_by_args(sampler_class, output_path, connector_class, config_file, *other_args):
     args = parser.parse_args(
         args=[
+            *other_args,
             "--sampler_class",
             sampler_class,
             "--connector_class",
@@ -41,6 +48,45 @@ def test_run_sampling_on_synthetic_data(sampler_class):
         assert all(c in sampling for c in Sampler.sampling_schema)
 
 
+def test_refresh_cache_is_refused_for_other_connectors():
+    with tempfile.TemporaryDirectory() as output_path, pytest.raises(SystemExit):
+        _run_sampling_by_args("RandomSampler", output_path, "SyntheticConnector", "configs/Synthetic.yml", "--refresh_cache")
+
+
+def test_run_sampling_with_lazy_lipac_does_not_load_the_database(monkeypatch):
+    """The sampling is not compared with the database, which would download the whole database."""
+    query_result = gpd.GeoDataFrame(
+        {
+            "patch_id": ["a-000000001", "b-000000002"],
+            "file_id": ["a", "b"],
+            "file_path": ["//store.ign.fr/store-lidarhd/a.laz", "//store.ign.fr/store-lidarhd/b.laz"],
+            "rgb_file": ["//store.ign.fr/store-lidarhd/a_rgb.jp2", "//store.ign.fr/store-lidarhd/b_rgb.jp2"],
+            "irc_file": ["//store.ign.fr/store-lidarhd/a_irc.jp2", "//store.ign.fr/store-lidarhd/b_irc.jp2"],
+            "test": [None, None],
+        },
+        geometry=[shapely.box(0, 0, 50, 50), shapely.box(50, 0, 100, 50)],
+        crs="EPSG:2154",
+    )
+    monkeypatch.setattr(lipac, "create_engine", MagicMock())
+    monkeypatch.setattr(lipac.pd, "read_sql", MagicMock(side_effect=lambda *args, **kwargs: query_result[["patch_id", "file_id"]].copy()))
+    monkeypatch.setattr(lipac.gpd, "read_postgis", MagicMock(side_effect=lambda *args, **kwargs: iter([query_result.copy()])))
+    load_database = MagicMock(side_effect=AssertionError("The database should not be loaded in lazy mode."))
+    monkeypatch.setattr(LazyLiPaCConnector, "load_database", load_database)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conf = yaml.safe_load(Path("configs/Lipac.yml").read_text())
+        sql_query_path = Path(tmp_dir) / "query.sql"
+        sql_query_path.write_text("SELECT * FROM VIGNETTE;")
+        conf["target_total_num_patches"] = 2
+        conf["connector_kwargs"].update(lazy=True, extraction_sql_query_path=str(sql_query_path), snapshot_cache_dir=None)
+        config_file = Path(tmp_dir) / "Lipac.yml"
+        config_file.write_text(yaml.dump(conf))
+        gpkg_path = _run_sampling_by_args("RandomSampler", str(Path(tmp_dir) / "outputs"), "LiPaCConnector", str(config_file))
+        assert len(gpd.read_file(gpkg_path)) == 2
+        assert not (Path(tmp_dir) / "outputs" / "stats").exists()
+    load_database.assert_not_called()
+
+
 @pytest.mark.lipac
 @pytest.mark.slow
 @pytest.mark.parametrize("sampler_class", SAMPLERS_LIBRARY.keys())